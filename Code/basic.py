@@ -1,6 +1,9 @@
 __author__ = "Bar Bokovza"
 
 #region Imports
+import os
+import tempfile
+
 import numpy as np
 #endregion
 
@@ -69,7 +72,7 @@ def Length_VarsPic (varsPic):
     size = 0
 
     for item in varsPic:
-        if item is not -1:
+        if item != -1:
             size = size + 1
 
     return size
@@ -91,6 +94,25 @@ def Create_VarsPic_Places (varsPic, places):
 
     return result
 
+def Create_Filter_Places (a_col, matches):
+    """
+    Create the list of columns that are left after filtering - every column that is not a repeat of a variable.
+    :param a_col: amount of columns in the array
+    :type a_col: int
+    :param matches: list of matches (column of the first appearance, column of the repeat)
+    :type matches: list
+    :return: List of columns
+    :rtype: list
+    """
+    repeats = [match[1] for match in matches]
+    result = []
+
+    for i in range(a_col):
+        if i not in repeats:
+            result.append(i)
+
+    return result
+
 def Create_VarsPic_Physical (lst, size):
     """
     Create Physical Variables Picture from a Virtual Variables Picture
@@ -113,15 +135,314 @@ def Create_VarsPic_Physical (lst, size):
 
     return result
 
+def Create_Columns (virtual, size):
+    """
+    Create the columns of the variables of a block - the column of the first appearance of every variable
+    :param virtual: A Virtual Variables Picture
+    :type virtual: list
+    :param size: An amount of variables in the rule
+    :type size: int
+    :return: column of every variable (-1 = not in the block)
+    :rtype: list
+    """
+    cols = [-1] * size
+
+    for place, ptr in enumerate(virtual):
+        if cols[ptr] == -1:
+            cols[ptr] = place
+
+    return cols
+
+def Create_Columns_Join (a_cols, b_cols, size):
+    """
+    Create the layout of a join of 2 relations by the columns of their variables - the pairs of the joined columns,
+    the (side, column) pairs of the written columns and the columns of the variables in the result.
+    :param a_cols: column of every variable in the first relation (-1 = not in the relation)
+    :type a_cols: list
+    :param b_cols: column of every variable in the second relation (-1 = not in the relation)
+    :type b_cols: list
+    :param size: An amount of variables in the rule
+    :type size: int
+    :return: (keys, out, cols) - flat lists of the pairs, column of every variable in the result
+    :rtype: tuple
+    """
+    keys, out, cols = [], [], [-1] * size
+
+    for i in range(size):
+        if a_cols[i] != -1 and b_cols[i] != -1:
+            keys += [a_cols[i], b_cols[i]]
+
+        if a_cols[i] != -1:
+            cols[i] = len(out) // 2
+            out += [0, a_cols[i]]
+        elif b_cols[i] != -1:
+            cols[i] = len(out) // 2
+            out += [1, b_cols[i]]
+
+    return keys, out, cols
+
+def Group_Rows (keys):
+    """
+    Group the rows of an array by their values
+    :param keys: Array
+    :type keys: np.ndarray
+    :return: {tuple of the values: array of the indexes of the rows}
+    :rtype: dict
+    """
+    if np.shape(keys)[0] == 0:
+        return { }
+
+    order = np.lexsort(keys.T[::-1])
+    sorted_keys = keys[order]
+
+    starts = np.flatnonzero(np.r_[True, np.any(sorted_keys[1:] != sorted_keys[:-1], axis = 1)])
+    ends = np.r_[starts[1:], len(order)]
+
+    return {tuple(sorted_keys[start].tolist()): order[start:end] for start, end in zip(starts, ends)}
+
+def Row_Ids (keys):
+    """
+    An id of every row of an array - the rows with the same values have the same id
+    :param keys: Array
+    :type keys: np.ndarray
+    :return: Array of the ids (int64)
+    :rtype: np.ndarray
+    """
+    if np.shape(keys)[1] == 0:
+        return np.zeros(np.shape(keys)[0], dtype = np.int64)
+
+    ids = np.asarray(keys[:, 0], dtype = np.int64)
+    for col in range(1, np.shape(keys)[1]):  ## the int32 values of two columns are one int64 key
+        if col > 1:
+            _unique, ids = np.unique(ids, return_inverse = True)
+        ids = (ids << 32) | (np.asarray(keys[:, col], dtype = np.int64) & 0xFFFFFFFF)
+    return ids
+
+def Join_Ranges (a_keys, b_keys):
+    """
+    The rows of the second array that match every row of the first array in an equi join
+    :param a_keys: Array of the joined columns of the first array
+    :type a_keys: np.ndarray
+    :param b_keys: Array of the joined columns of the second array
+    :type b_keys: np.ndarray
+    :return: (Array of the rows of the second array sorted by their keys, Array of the position of the first match
+     of every row of the first array in it, Array of the amount of matches of every row of the first array)
+    :rtype: tuple
+    """
+    a_row, b_row = np.shape(a_keys)[0], np.shape(b_keys)[0]
+    if a_row == 0 or b_row == 0:
+        return np.zeros(0, dtype = np.int64), np.zeros(a_row, dtype = np.int64), np.zeros(a_row, dtype = np.int64)
+
+    ids = Row_Ids(np.concatenate((a_keys, b_keys)))
+    a_ids, b_ids = ids[:a_row], ids[a_row:]
+
+    order = np.argsort(b_ids, kind = "stable")
+    b_sorted = b_ids[order]
+    starts = np.searchsorted(b_sorted, a_ids, "left")
+    return order, starts, np.searchsorted(b_sorted, a_ids, "right") - starts
+
+def Join_Pairs (a_keys, b_keys, ranges = None):
+    """
+    The pairs of rows of an equi join - by the rows of the first array, and for every row by the rows of the second
+    array (the order of a nested loop)
+    :param a_keys: Array of the joined columns of the first array
+    :type a_keys: np.ndarray
+    :param b_keys: Array of the joined columns of the second array
+    :type b_keys: np.ndarray
+    :param ranges: [Optional] the ranges of the join [default = Join_Ranges(a_keys, b_keys)]
+    :type ranges: tuple
+    :return: (Array of the rows in the first array, Array of the rows in the second array)
+    :rtype: tuple
+    """
+    order, starts, counts = Join_Ranges(a_keys, b_keys) if ranges is None else ranges
+    total = int(np.sum(counts))
+
+    xs = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return xs, order[offsets + np.arange(total)]
+
+def Gather_Rows (a, b, xs, ys, join_varsPic, result_col):
+    """
+    Create the rows of a join from its pairs of rows
+    :param a: (Array, Physical Variables Picture)
+    :type a: tuple
+    :param b: (Array, Physical Variables Picture)
+    :type b: tuple
+    :param xs: Array of the rows in the first array
+    :param ys: Array of the rows in the second array
+    :param join_varsPic: Joined Physical Variables Picture
+    :type join_varsPic: np.ndarray
+    :param result_col: amount of columns of the result
+    :type result_col: int
+    :return: Array
+    :rtype: np.ndarray
+    """
+    a_idx, a_varsPic = a
+    b_idx, b_varsPic = b
+    result = np.zeros((len(xs), result_col), dtype = np.int32)
+
+    for i in range(np.shape(a_varsPic)[0]):
+        if join_varsPic[i] >= 0:
+            if a_varsPic[i] >= 0:
+                result[:, join_varsPic[i]] = np.asarray(a_idx)[xs, a_varsPic[i]]
+            else:
+                result[:, join_varsPic[i]] = np.asarray(b_idx)[ys, b_varsPic[i]]
+
+    return result
+
+#endregion
+
+#region GAP Stream
+class GAP_Stream:
+    """
+    "Definition Zone" that is created by batches of rows - iterating it gives the rows of the batches, and every
+    batch is created only when the rows of the previous batch were used.
+    """
+
+    def __init__ (self, batches):
+        """
+        Initialization
+        :param batches: iterator of arrays
+        """
+        self.batches = batches
+        self.rows = 0
+
+    def Batches (self):
+        """
+        :return: iterator of the batches (arrays)
+        """
+        for batch in self.batches:
+            self.rows += len(batch)
+            yield batch
+
+    def __iter__ (self):
+        for batch in self.Batches():
+            for row in batch:
+                yield row
+
 #endregion
 
 #region GAP OpenCL
 class GAP_Basic:
     """
     Implementation of the rational functions in Python
+    With a memory budget, joins that are larger than the budget are spilled to memory mapped temporary files
+    (Grace hash join), and their results are memory mapped arrays that are read while the rule is executed.
     """
 
-    def Cartesian (self, a, b, join_varsPic):
+    def __init__ (self, memory = None, directory = None):
+        """
+        Initialization
+        :param memory: [Optional] memory budget in bytes for a single result [default = no budget]
+        :type memory: int
+        :param directory: [Optional] directory of the spilled files [default = the temporary directory]
+        :type directory: str
+        """
+        self.memory = memory
+        self.directory = directory
+        self.stats = {"spills": 0, "partitions": 0, "spilled_bytes": 0}
+
+    #region Spilling
+    def Over_Budget (self, nbytes):
+        """
+        :param nbytes: amount of bytes of an array
+        :type nbytes: int
+        :return: True if the array is larger than the memory budget
+        :rtype: bool
+        """
+        return self.memory is not None and nbytes > self.memory
+
+    def Spill_Create (self):
+        """
+        Create a temporary file for spilled rows
+        :return: (path, file opened for binary writing)
+        :rtype: tuple
+        """
+        handle, path = tempfile.mkstemp(prefix = "gap_", suffix = ".bin", dir = self.directory)
+        return path, os.fdopen(handle, "wb")
+
+    def Spill_Write (self, filer, rows):
+        """
+        Write rows to a spilled file
+        :param filer: the file
+        :param rows: The rows
+        :type rows: np.ndarray
+        """
+        data = np.ascontiguousarray(rows, dtype = np.int32).tobytes()
+        filer.write(data)
+        self.stats["spilled_bytes"] += len(data)
+
+    def Spill_Map (self, path, rows, cols):
+        """
+        Map a spilled file as an array (read only). The file is removed when it is possible - it stays on the disk
+        until the array is released.
+        :param path: path of the file
+        :type path: str
+        :param rows: amount of rows in the file
+        :type rows: int
+        :param cols: amount of columns in the file
+        :type cols: int
+        :return: The array
+        :rtype: np.ndarray
+        """
+        if rows * cols == 0:
+            result = np.zeros((rows, cols), dtype = np.int32)
+        else:
+            result = np.memmap(path, dtype = np.int32, mode = "r", shape = (rows, cols))
+
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+        return result
+
+    def Spill_Partitions (self, array, keys, count):
+        """
+        Hash partition the rows of an array (by the columns in keys) to temporary files
+        :param array: The array
+        :type array: np.ndarray
+        :param keys: list of the key columns
+        :type keys: list
+        :param count: amount of partitions
+        :type count: int
+        :return: list of (path, amount of rows)
+        :rtype: list
+        """
+        a_row, a_col = np.shape(array)
+        files = [self.Spill_Create() for i in range(count)]
+        sizes = [0] * count
+
+        chunk = max(1, self.memory // max(1, 2 * a_col * 4))
+        for start in range(0, a_row, chunk):
+            rows = np.asarray(array[start:start + chunk])
+
+            hashed = np.zeros(len(rows), dtype = np.int64)
+            for key in keys:
+                hashed = (hashed * 1000003 + rows[:, key]) % 2147483647
+            part = hashed % count
+
+            for p in range(count):
+                selected = rows[part == p]
+                if len(selected) > 0:
+                    self.Spill_Write(files[p][1], selected)
+                    sizes[p] += len(selected)
+
+        for path, filer in files:
+            filer.close()
+
+        return [(files[p][0], sizes[p]) for p in range(count)]
+
+    def Spill_Statistics (self):
+        """
+        :return: {"spills": amount of spilled functions, "partitions": amount of partitions,
+         "spilled_bytes": amount of bytes that were written to the disk}
+        :rtype: dict
+        """
+        return dict(self.stats)
+    #endregion
+
+    def Cartesian (self, a, b, join_varsPic, result_col = None):
         """
         Implement Cartesian Multiplication between relations
         :param a: (Array, Physical Variables Pictures of the array)
@@ -130,6 +451,8 @@ class GAP_Basic:
         :param b: (Array, Physical Variables Pictures of the array)
         :param join_varsPic: Physical Variables Pictures of the demanded array
         :type join_varsPic: np.ndarray
+        :param result_col: [Optional] amount of columns of the demanded array [default = Length_VarsPic(join_varsPic)]
+        :type result_col: int
         :return: (Array, join_varsPic)
         :rtype: tuple
         """
@@ -139,21 +462,44 @@ class GAP_Basic:
         b_idx, b_varsPic = b
         b_row, b_col = np.shape(b_idx)
 
-        size = np.shape(a_varsPic)[0]
+        if result_col is None:
+            result_col = Length_VarsPic(join_varsPic)
 
-        result = np.zeros((a_row * b_row, Length_VarsPic(join_varsPic)), dtype = np.int32)
+        if a_row > 1 and self.Over_Budget(a_row * b_row * result_col * 4):
+            return self.Cartesian_Spill(a, b, join_varsPic, result_col)
 
-        for x in range(a_row):
-            for y in range(b_row):
-                rowPosition = (x * a_col + y) * (a_col + b_col)
-                for z in range(size):
-                    if join_varsPic[z] != -1:
-                        if (a_varsPic[z] != -1):
-                            result[rowPosition + join_varsPic[z]] = a[x * a_col + a_varsPic[z]]
-                        else:
-                            result[rowPosition + join_varsPic[z]] = b[y * b_col + b_varsPic[z]]
+        xs, ys = np.repeat(np.arange(a_row), b_row), np.tile(np.arange(b_row), a_row)
+        return Gather_Rows(a, b, xs, ys, join_varsPic, result_col), join_varsPic
 
-        return result, join_varsPic
+    def Cartesian_Spill (self, a, b, join_varsPic, result_col):
+        """
+        Cartesian Multiplication that is larger than the memory budget - the result is written to a temporary file
+        by chunks of rows of the first array.
+        :param a: (Array, Physical Variables Pictures of the array)
+        :type a:tuple
+        :param b: (Array, Physical Variables Pictures of the array)
+        :type b:tuple
+        :param join_varsPic: Physical Variables Pictures of the demanded array
+        :type join_varsPic: np.ndarray
+        :param result_col: amount of columns of the demanded array
+        :type result_col: int
+        :return: (Memory mapped array, join_varsPic)
+        :rtype: tuple
+        """
+        a_idx, a_varsPic = a
+        a_row, b_row = np.shape(a_idx)[0], np.shape(b[0])[0]
+
+        self.stats["spills"] += 1
+        path, filer = self.Spill_Create()
+
+        chunk = max(1, self.memory // max(1, b_row * result_col * 4))
+        for start in range(0, a_row, chunk):
+            rows, _varsPic = self.Cartesian((np.asarray(a_idx[start:start + chunk]), a_varsPic), b, join_varsPic,
+                result_col)
+            self.Spill_Write(filer, rows)
+
+        filer.close()
+        return self.Spill_Map(path, a_row * b_row, result_col), join_varsPic
 
     def SelectAbove (self, data, minValue):
         """
@@ -173,7 +519,7 @@ class GAP_Basic:
         current = 0
 
         for x in range(a_row):
-            if a_values[x] > minValue:
+            if a_values[x] >= minValue:
                 for i in range(a_col):
                     result_idx[current][i] = a_idx[x][i]
 
@@ -183,22 +529,24 @@ class GAP_Basic:
 
         return result_idx
 
-    def Filter (self, a, matches):
+    def Filter (self, a, matches, places = None):
         """
         Implement Selection [List of (Field1 = Field2) connected with AND] {array}
         :param a: (Array, Physical Variables Picture)
         :type a:tuple
         :param matches: list of matches
         :type matches: list
+        :param places: [Optional] the columns that are left (Create_Filter_Places) [default = created by the matches]
+        :type places: list
         :return: (Array, Physical Variables Picture)
         :rtype: tuple
         """
         a_idx, a_varsPic = a
         a_row, a_col = np.shape(a_idx)
-        varsPic_row = np.shape(a_varsPic)[0]
-        varsPic_size = Length_VarsPic(a_varsPic)
+        if places is None:
+            places = Create_Filter_Places(a_col, matches)
 
-        result_idx = np.zeros(a_row * varsPic_size, dtype = np.int32)
+        result_idx = np.zeros((a_row, len(places)), dtype = np.int32)
 
         count = 0
         for x in range(a_row):
@@ -213,14 +561,11 @@ class GAP_Basic:
             if not isOk:
                 continue
 
-            curr = count
+            for i in range(len(places)):
+                result_idx[count][i] = a_idx[x][places[i]]
             count += 1
 
-            for i in range(varsPic_row):
-                if a_varsPic[i] is not -1:
-                    result_idx[curr][a_varsPic[i]] = a_idx[x][a_varsPic[i]]
-
-        result_idx = np.resize(result_idx, (count, varsPic_size))
+        result_idx = np.resize(result_idx, (count, len(places)))
         return result_idx, a_varsPic
 
     def Projection (self, data, projectionLst):
@@ -242,54 +587,130 @@ class GAP_Basic:
 
         return result
 
-    def SuperJoin (self, a, b):
+    def SuperJoin (self, a, b, join = None):
         """
         Implement Join between two tables.
         :param a: (Array, Physical Variables Picture)
         :type a: tuple
         :param b: (Array, Physical Variables Picture)
         :type b: tuple
+        :param join: [Optional] (Joined Physical Variables Picture, list of the joined variables, amount of columns of
+         the result) - precomputed by GAP_PhysicalPlan [default = created by the pictures]
+        :type join: tuple
         :return: (Joined Array, Joined Physical Variables Picture)
         :rtype: tuple
         """
         a_idx, a_varsPic = a
         b_idx, b_varsPic = b
 
+        a_row, a_col = np.shape(a_idx)
+        b_row, b_col = np.shape(b_idx)
+
+        if join is None:
+            join_varsPic, joinLst = Create_VarsPic_Join(a_varsPic, b_varsPic)
+            if len(joinLst) == 0:
+                return self.Cartesian(a, b, join_varsPic)
+            result_col = a_col + b_col - len(joinLst)
+        else:
+            join_varsPic, joinLst, result_col = join
+            if len(joinLst) == 0:
+                return self.Cartesian(a, b, join_varsPic, result_col)
+
+        a_keys = np.asarray(a_idx)[:, [a_varsPic[join] for join in joinLst]]
+        b_keys = np.asarray(b_idx)[:, [b_varsPic[join] for join in joinLst]]
+        ranges = Join_Ranges(a_keys, b_keys)
+        if self.Over_Budget(int(np.sum(ranges[2])) * result_col * 4):
+            return self.SuperJoin_Spill(a, b, join_varsPic, joinLst)
+
+        xs, ys = Join_Pairs(a_keys, b_keys, ranges)
+        result = Gather_Rows(a, b, xs, ys, join_varsPic, result_col)
+
+        return result, join_varsPic
+
+    def SuperJoin_Spill (self, a, b, join_varsPic, joinLst):
+        """
+        Grace hash join - both arrays are hash partitioned to temporary files by the joined variables, and every
+        pair of partitions is joined in memory (Join_Pairs). The result is written to a temporary file.
+        :param a: (Array, Physical Variables Picture)
+        :type a: tuple
+        :param b: (Array, Physical Variables Picture)
+        :type b: tuple
+        :param join_varsPic: Joined Physical Variables Picture
+        :type join_varsPic: np.ndarray
+        :param joinLst: list of the joined variables
+        :type joinLst: np.ndarray
+        :return: (Memory mapped array, Joined Physical Variables Picture)
+        :rtype: tuple
+        """
+        a_idx, a_varsPic = a
+        b_idx, b_varsPic = b
+
         a_row, a_col = np.shape(a_idx)
         b_row, b_col = np.shape(b_idx)
         size = np.shape(a_varsPic)[0]
 
-        join_varsPic, joinLst = Create_VarsPic_Join(a_varsPic, b_varsPic)
+        a_keys = [a_varsPic[join] for join in joinLst]
+        b_keys = [b_varsPic[join] for join in joinLst]
+
+        out = []
+        for i in range(size):
+            if join_varsPic[i] >= 0:
+                out.append((0, a_varsPic[i]) if a_varsPic[i] >= 0 else (1, b_varsPic[i]))
+        result_col = len(out)
 
-        if len(joinLst) is 0:
-            return self.Cartesian(a, b, join_varsPic)
+        count = max(2, -(-2 * (a_row * a_col + b_row * b_col) * 4 // self.memory))
+        a_parts = self.Spill_Partitions(a_idx, a_keys, count)
+        b_parts = self.Spill_Partitions(b_idx, b_keys, count)
 
-        result_col = a_col + b_col - len(joinLst)
-        result = np.zeros((a_row * b_row, result_col), dtype = np.int32)
+        self.stats["spills"] += 1
+        self.stats["partitions"] += count
+        path, filer = self.Spill_Create()
         current = 0
+        limit = max(1, self.memory // max(1, 2 * result_col * 4))
 
-        for x in range(a_row):
-            for y in range(b_row):
-
-                isOk, i = True, 0
-                while i < len(joinLst):
-                    join = joinLst[i]
-                    if a_idx[x][a_varsPic[join]] != b_idx[y][b_varsPic[join]]:
-                        isOk = False
-                        break
-                    i += 1
+        for p in range(count):
+            a_part = self.Spill_Map(a_parts[p][0], a_parts[p][1], a_col)
+            b_part = self.Spill_Map(b_parts[p][0], b_parts[p][1], b_col)
 
-                if isOk:
-                    for i in range(size):
-                        if join_varsPic[i] >= 0:
-                            if a_varsPic[i] >= 0:
-                                result[current][join_varsPic[i]] = a_idx[x][a_varsPic[i]]
-                            else:
-                                result[current][join_varsPic[i]] = b_idx[y][b_varsPic[i]]
-                    current += 1
+            xs, ys = Join_Pairs(np.asarray(a_part[:, a_keys]), np.asarray(b_part[:, b_keys]))
 
-        result = np.resize(result, (current, a_col + b_col - len(joinLst)))
-        return result, join_varsPic
+            for start in range(0, len(xs), limit):
+                x, y = xs[start:start + limit], ys[start:start + limit]
+                rows = np.zeros((len(x), result_col), dtype = np.int32)
+                for i in range(result_col):
+                    side, col = out[i]
+                    rows[:, i] = a_part[x, col] if side == 0 else b_part[y, col]
+
+                self.Spill_Write(filer, rows)
+                current += len(rows)
+
+            del a_part, b_part
+
+        filer.close()
+        return self.Spill_Map(path, current, result_col), join_varsPic
+
+    def SuperJoin_Stream (self, a, b, rows = 1 << 16, join = None):
+        """
+        Join between two tables by batches - every batch is the join of a range of rows of a with b, with at most
+        about "rows" rows.
+        :param a: (Array, Physical Variables Picture)
+        :type a: tuple
+        :param b: (Array, Physical Variables Picture)
+        :type b: tuple
+        :param rows: [Optional] amount of rows in a batch [default = 65536]
+        :type rows: int
+        :param join: [Optional] the precomputed metadata of the join (see SuperJoin)
+        :type join: tuple
+        :return: generator of arrays
+        """
+        a_idx, a_varsPic = a
+        a_row, b_row = np.shape(a_idx)[0], np.shape(b[0])[0]
+        chunk = max(1, rows // max(1, b_row))
+
+        for start in range(0, a_row, chunk):
+            batch, _varsPic = self.SuperJoin((np.asarray(a_idx[start:start + chunk]), a_varsPic), b, join)
+            if len(batch) > 0:
+                yield batch
 
     def Distinct (self, array, dictionary = None):
         """
@@ -314,36 +735,42 @@ class GAP_Basic:
                     dist[tup] = 1
 
         if len(dist) == 0:
-            return np.zeros(0, dtype = np.int32), np.zeros(0, dtype = np.float)
+            return np.zeros((0, np.shape(array)[1]), dtype = np.int32), np.zeros(0, dtype = np.float32)
 
         idx = np.array(list(dist.keys()), dtype = np.int32)
         if not dictionary == None:
-            values = np.array(list(dist.values()), dtype = np.float)
+            values = np.array(list(dist.values()), dtype = np.float32)
         else:
             values = None
 
         return idx, values
 
-    def SelectAbove_Full (self, a, virtual_places, data, minValue, toJoin = False):
+    def SelectAbove_Full (self, a, virtual_places, dataHolder, predicat, minValue, toJoin = False, places = None):
         """
         Execution the Full process of Select Above - Preparation for Select Above + Select Above
         :param a: (Array, Physical Variables Picture)
         :param virtual_places:
-        :param data: The Dictionary to get the data from.
+        :param dataHolder: The data agent to get the data from.
+        :param predicat: The predicat of the block
         :param minValue: The minimum value
         :param toJoin: [Optional] if to join to the original array [default = FALSE]
+        :param places: [Optional] (physical places, Physical Variables Picture of the places, metadata of the join) -
+         precomputed by GAP_PhysicalPlan [default = created by the pictures]
         :return:
         """
+        data = dataHolder.GetData(predicat)
         a_array, a_valsPic = a
-        physical_places, places_valsPic = Create_VarsPic_Places(a_valsPic, virtual_places), Create_VarsPic_Physical(
-            virtual_places, np.shape(a_valsPic)[0])
+        if places is None:
+            places = Create_VarsPic_Places(a_valsPic, virtual_places), Create_VarsPic_Physical(virtual_places,
+                np.shape(a_valsPic)[0]), None
+        physical_places, places_valsPic, join = places
 
         projection_array = self.Projection(a_array, physical_places)
         distinct_array = self.Distinct(projection_array, data)
         select_idx = self.SelectAbove(distinct_array, minValue)
 
         if toJoin:
-            return self.SuperJoin(a, (select_idx, places_valsPic))
+            return self.SuperJoin(a, (select_idx, places_valsPic), join)
         return select_idx, places_valsPic
 
 #endregion
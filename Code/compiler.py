@@ -11,9 +11,24 @@ __author__ = "Bar Bokovza"
 # noinspection PyPep8
 
 #region IMPORTS
+import copy
+import gc
+import hashlib
+import importlib.util
+import itertools
+import marshal
+import os
+import pickle
+import re
+import threading
+import types
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
 import numpy as np
 
 from Code.dataHolder import GAP_Data
+from Code.basic import GAP_Stream, Create_VarsPic_Join, Create_VarsPic_Physical, Create_VarsPic_Places, \
+    Create_Filter_Places, Create_Columns, Create_Columns_Join, Length_VarsPic
 
 #endregion
 
@@ -38,6 +53,9 @@ class RuleType(object):
 #region p_ Functions
 
 def _IsFloat (number):
+    if number.isidentifier():
+        return False  ## a variable (without the exception of float)
+
     # noinspection PyBroadException
     try:
         float(number)
@@ -45,6 +63,174 @@ def _IsFloat (number):
         return False
     return True
 
+def _IsConstant (argument):
+    """
+    Return true if an argument of a block is a constant (an integer) and not a variable
+    :param argument: argument of a block
+    :type argument: str
+    :return: True / False
+    :rtype: bool
+    """
+    if argument.isidentifier():
+        return False  ## a variable (without the exception of int)
+
+    try:
+        int(argument)
+    except ValueError:
+        return False
+    return True
+
+def _Notation_Template (notation):
+    """
+    Split an arithmetic notation to a template and its numbers (coefficients), for example : "0.6*a*b" ->
+    ("_c0*a*b", [0.6])
+    :param notation: notation of a header
+    :type notation: str
+    :return: (template:str, list of coefficients) - (None, None) if the notation is not arithmetic
+    :rtype: tuple
+    """
+    if re.fullmatch(r"[\w.+\-*/() ]+", notation) is None:
+        return None, None
+
+    coefficients = []
+
+    def Replace (match):
+        coefficients.append(float(match.group(0)))
+        return "_c{0}".format(len(coefficients) - 1)
+
+    return re.sub(r"(?<![\w.])(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?", Replace, notation), coefficients
+
+def _Block_Signature (block):
+    """
+    :param block: GAP Block
+    :return: the structure of a block (without its predicat)
+    :rtype: tuple
+    """
+    return block.Type, tuple(block.VirtualVarsPic), tuple(block.Constants), block.Notation
+
+def _Rule_Signature (rule):
+    """
+    The structure of a rule for the rule families (GAP_Family) - the rules of a family have the same signature
+    :param rule: GAP Rule
+    :return: (signature - None if the rule cannot be in a family, the body blocks in the order of the signature)
+    :rtype: tuple
+    """
+    template, coefficients = _Notation_Template(rule.Header.Notation)
+    if rule.Type == RuleType.HEADER or template is None:
+        return None, None
+
+    blocks = sorted(rule.Body, key = lambda block: _Block_Signature(block) + (block.Predicat,))
+    signatures = [_Block_Signature(block) for block in blocks]
+    if any(block.Type != BlockType.ABOVE and signatures.count(signature) > 1 for block, signature in zip(blocks,
+            signatures)):
+        return None, None  ## the blocks of the rules can not be matched (Select Above blocks are matched by predicat)
+
+    header = tuple(rule.Header.VirtualVarsPic), tuple(rule.Header.Constants), len(rule.Header.Arguments)
+    annotations = tuple(block.Predicat for block in blocks if block.Type == BlockType.ANNOTATION)
+
+    return (len(rule.Dictionary), header, template, tuple(signatures), annotations), blocks
+
+def _Family_Shared (blocks):
+    """
+    :param blocks: The body blocks of every rule of a family in the order of its signature (_Rule_Signature)
+    :type blocks: list
+    :return: The positions of the blocks with the same predicat in all the rules
+    :rtype: list
+    """
+    return [j for j in range(len(blocks[0])) if len(set(lst[j].Predicat for lst in blocks)) == 1]
+
+def _Picture_Key (varsPic):
+    """
+    :param varsPic: Physical Variables Picture (np.ndarray) / columns of the variables (list)
+    :return: hashable key of the picture
+    """
+    return varsPic.tobytes() if isinstance(varsPic, np.ndarray) else tuple(varsPic)
+
+def _Join_Tree (items, join):
+    """
+    Walk on the join tree of Create_DefinitionZone_Join (the pairs of every level, the last item of an odd level is
+    joined in the next level)
+    :param items: The items of the leaves
+    :type items: list
+    :param join: function (item, item) -> the item of their join
+    :return: The item of the root
+    """
+    while len(items) > 1:
+        items = [join(items[i], items[i + 1]) for i in range(0, len(items) - 1, 2)] + items[
+            len(items) - len(items) % 2:]
+    return items[0]
+
+def _ReadOnly (value):
+    """
+    :return: The value with its arrays not writeable (the arrays of tuples / lists are changed too)
+    """
+    if isinstance(value, np.ndarray):
+        value = value.copy()
+        value.flags.writeable = False
+        return value
+    if isinstance(value, (tuple, list)):
+        return tuple(_ReadOnly(item) for item in value)
+    return value
+
+def _Rule_Text (rule):
+    """
+    :param rule: GAP Rule in string
+    :type rule: str
+    :return: The normalized text of the rule - without the characters that the parser ignores
+    :rtype: str
+    """
+    return rule.replace(" ", "").replace("\n", "").replace("\r", "")
+
+def _Rename_Code (code, old, new):
+    """
+    Rename the function that a compiled code defines (Rule_{idx} / Jacobi_{idx}) - the code of a rule is not compiled
+    again when the index of the rule changes
+    :param code: compiled code of a rule (GAP_Rule.Arrange_Execution)
+    :type code: types.CodeType
+    :param old: The name of the function in the code
+    :type old: str
+    :param new: The new name of the function
+    :type new: str
+    :return: The compiled code
+    :rtype: types.CodeType
+    """
+    consts = []
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType) and const.co_name == old:
+            const = const.replace(co_name = new, co_qualname = new) if hasattr(const, "co_qualname") else \
+                const.replace(co_name = new)
+        consts.append(const)
+
+    return code.replace(co_names = tuple(new if name == old else name for name in code.co_names),
+        co_consts = tuple(consts))
+
+def _Compile_Sources (sources):
+    """
+    Compile the code of a batch of rules (GAP_Rule.Create_Sources) - the function of the processes of
+    GAP_Compiler.PreRun, so the compiled code is marshalled
+    :param sources: list of (code of Rule_0, code of Jacobi_0)
+    :type sources: list
+    :return: list of (marshalled code of Rule_0, marshalled code of Jacobi_0)
+    :rtype: list
+    """
+    return [tuple(marshal.dumps(compile(source, "<string>", "exec")) for source in pair) for pair in sources]
+
+def _Engine_Version ():
+    """
+    The version of the compiled rules - the compiled code (marshal), the arrays of the plans and the sources of the
+    compiler are in it, so a change of any of them does not use the rules of the older version.
+    :return: hash of the version
+    :rtype: str
+    """
+    result = hashlib.sha1(importlib.util.MAGIC_NUMBER + np.__version__.encode("utf-8"))
+
+    for path in [__file__, os.path.join(os.path.dirname(os.path.abspath(__file__)), "basic.py")]:
+        filer = open(path, "rb")
+        result.update(filer.read())
+        filer.close()
+
+    return result.hexdigest()
+
 def _IsEmpty (array):
     """
     Return true if the array is empty
@@ -54,56 +240,126 @@ def _IsEmpty (array):
     """
     return np.shape(array)[0] == 0
 
+def _Future_Done (value):
+    """
+    Create a future that is already done
+    :param value: The result of the future
+    :return: The future
+    :rtype: Future
+    """
+    result = Future()
+    result.set_result(value)
+    return result
+
+def _Future_Join (pool, a, b, gpu, plan):
+    """
+    The future of the join of 2 futures of arrays - the join is submitted to the pool when both of them are done,
+    so it waits only for its own inputs.
+    :param pool: The thread pool
+    :type pool: ThreadPoolExecutor
+    :param a: future of (Array, Physical Variables Picture)
+    :type a: Future
+    :param b: future of (Array, Physical Variables Picture)
+    :type b: Future
+    :param gpu: the execution agent for the relational functions (OpenCL / Basic)
+    :param plan: The plan of the rule (the metadata of the join)
+    :type plan: GAP_Plan
+    :return: future of the joined (Array, Physical Variables Picture)
+    :rtype: Future
+    """
+    result = Future()
+    state, lock, inputs = [2], threading.Lock(), [a, b]
+
+    def Join (x, y):
+        if _IsEmpty(x[0]):
+            return x
+        if _IsEmpty(y[0]):
+            return y
+        return gpu.SuperJoin(x, y, plan.Join(x[1], y[1]))
+
+    def Finish (future):
+        if future.exception() is not None:
+            result.set_exception(future.exception())
+        else:
+            result.set_result(future.result())
+
+    def Ready (future):
+        with lock:
+            state[0] -= 1
+            if state[0] > 0:
+                return
+
+        x, y = inputs
+        inputs.clear()  ## the callbacks of the inputs refer to them
+
+        if x.exception() is not None or y.exception() is not None:
+            result.set_exception(x.exception() or y.exception())
+        else:
+            pool.submit(Join, x.result(), y.result()).add_done_callback(Finish)
+
+    a.add_done_callback(Ready)
+    b.add_done_callback(Ready)
+    return result
+
+_PREDICAT_PATTERN = re.compile(r"(<-|&)\s*([^\s()\[\]:,&<]+)")  ## the predicat of every block (after its separator)
+
+_BLOCK_PATTERN = re.compile(r"\s*([^\s()\[\]:,&<]+)\s*[(\[]([^()\[\]:&<]*)[)\]]\s*:(.*)", re.DOTALL)
+
 def _Parse_Block (block):
     """
-    Gets a block in a GAP Rule and return a tuple of (atom, args, notation, blockType)
+    Gets a block in a GAP Rule and return a tuple of (atom, args, notation)
+    The block is tokenized by _BLOCK_PATTERN (in a single pass) - the spaces are ignored.
     :param block: block in a GAP rule
-    :return: (atom:str, args:list, notation:str, blockType:BlockType)
+    :type block: str
+    :return: (atom:str, args:list, notation:str)
     :rtype: tuple
-    :raise ValueError: The predicat [predicat] does not have an atom and arguments
+    :raise ValueError: The predicat [predicat] does not have an atom and arguments / The block [block] is not a GAP
+     block
     """
-    predicat, notation = block.split(":")
+    match = _BLOCK_PATTERN.fullmatch(block)
+    if match is None:
+        if block.strip() != "" and "(" not in block and "[" not in block:
+            raise ValueError("The predicat '" + block.split(":")[0].strip() + "' does not have an atom and arguments")
+        raise ValueError("The block '" + block.strip() + "' is not a GAP block")
 
-    atoms = predicat.split(",")
-    if len(atoms) < 2:
-        raise ValueError("The predicat '" + predicat + "' does not have an atom and arguments")
+    atom, args, notation = match.group(1, 2, 3)
 
-    atom, args = atoms[0], atoms[1:]
+    args = [arg.strip() for arg in args.split(",")]
+    if "" in args:
+        raise ValueError("The predicat '" + atom + "' does not have an atom and arguments")
 
-    return atom, args, notation
+    return atom, args, "".join(notation.split())
 
-def _Parse_Rule (rule):
+def _Parse_Rule (rule, blocks = None):
     """
     gets a string of rule, and return a tuple with header, body and a list of args that are avaliable in the rule
     :param rule: GAP Rule in string
     :type rule: str
+    :param blocks: [Optional] registry of the parsed blocks (text of block -> _Parse_Block), the blocks that are in
+     it are not parsed again [default = no registry]
+    :type blocks: dict
     :return: simplified header, simplified items in body, and list of arguments that are in the rule.
     :rtype: tuple
+    :raise ValueError: The rule [rule] does not have a header and a body
     """
-    args = []
-
-    rule = rule.replace(" ", "")
-    rule = rule.replace("(", ",")
-    rule = rule.replace(")", "")
-    rule = rule.replace("[", ",")
-    rule = rule.replace("]", "")
-    str_header, str_body = rule.split("<-")
-
-    headerBlock = _Parse_Block(str_header)
-    args.append(headerBlock[1])
-
-    body_lst = []
+    str_header, arrow, str_body = rule.partition("<-")
+    if arrow == "":
+        raise ValueError("The rule '" + rule.strip() + "' does not have a header and a body")
 
-    for block in str_body.split("&"):
-        parsedBlock = _Parse_Block(block)
-        body_lst.append(parsedBlock)
-        args.append(parsedBlock[1])
+    parsed = []
+    for block in [str_header] + str_body.split("&"):
+        result = blocks.get(block) if blocks is not None else None
+        if result is None:
+            result = _Parse_Block(block)
+            if blocks is not None:
+                blocks[block] = result
+        parsed.append(result)
 
-    return headerBlock, body_lst, args
+    return parsed[0], parsed[1:], [block[1] for block in parsed]
 
 def _Create_VirtualVarsPic (arguments, dictionary):
     """
-    transform arg variables from names to numbers
+    transform arg variables from names to numbers (the constants are skipped)
     :param arguments: list of arguments of a block
     :param dictionary: dictionary of arguments
     :return: the list of arguments in numbers instead of names
@@ -111,7 +367,8 @@ def _Create_VirtualVarsPic (arguments, dictionary):
     virtual = []
 
     for arg in arguments:
-        virtual.append(dictionary[arg])
+        if not _IsConstant(arg):
+            virtual.append(dictionary[arg])
 
     return virtual
 
@@ -120,26 +377,28 @@ def _Create_PhysicalVarsPic (virtual, size):
     transform virtual pic to physical pic
     :param virtual: the virtual variables picture
     :param size: the amount of unique arguments in rule
-    :return:physical variables picture of the virtual that we got as a parameter
+    :return:physical variables picture of the virtual that we got as a parameter, and the matches - pairs of
+    (column of the first appearance, column of the repeat) of the repeated variables
     """
-    result = np.zeros(size, dtype = np.int32)
-    result.fill(-1)
+    result = [-1] * size  ## a list - an item of an array is slower to read / write
 
     count = 0
-    matches = []
+    matches, first = [], { }
 
-    for ptr in virtual:
+    for place, ptr in enumerate(virtual):
         if result[ptr] == -1:
             result[ptr] = count
+            first[ptr] = place
             count += 1
         else:
-            matches.append((result[ptr], count))
+            matches.append((first[ptr], place))
 
-    return result, matches
+    return np.array(result, dtype = np.int32), matches
 
 def _Create_ArgumentsDictionary (lst):
     """
-    create dictionary of arguments variables based on the list of args that we get from parameter
+    create dictionary of arguments variables based on the list of args that we get from parameter (the constants are
+    not variables)
     :param lst: list of arguments variables in names
     :type lst:list
     :return: dictionary of that list
@@ -149,7 +408,7 @@ def _Create_ArgumentsDictionary (lst):
 
     for args in lst:
         for arg in args:
-            if not arg in result:
+            if not arg in result and not _IsConstant(arg):
                 result[arg] = count
                 count += 1
 
@@ -163,19 +422,7 @@ def _Create_CommandString (lst):
     :return: string of a code with tabs
     :rtype: str
     """
-    result = ""
-
-    for line in lst:
-        text, tabsCount = line
-
-        command = ""
-        for i in range(tabsCount):
-            command += "\t"
-
-        command += text
-        result += command + "\n"
-
-    return result
+    return "".join("\t" * tabsCount + text + "\n" for text, tabsCount in lst)
 
 #endregion
 
@@ -207,6 +454,9 @@ class GAP_Block:
     """
     This is the class of GAP Block
     it analyses GAP block and save all the needed data for it.
+    The integer arguments are constants - the array of the block holds only the atoms with these values (a point
+    selection by GAP_Data) and only the columns of the variables. The array of a block with only constants has no
+    columns, and a row only if its atom exists - the block gates the rule.
     """
 
     def __init__ (self, parsed, dictionary = None):
@@ -225,10 +475,30 @@ class GAP_Block:
         if _IsFloat(self.Notation):
             self.Type = BlockType.ABOVE
 
+        self.Arguments = [str(int(arg)) if _IsConstant(arg) else arg for arg in arguments]
+        self.Constants = [(place, int(arg)) for place, arg in enumerate(arguments) if _IsConstant(arg)]
+        self.Key = "".join("{0},".format(int(arg)) if _IsConstant(arg) else "a_{0},".format(dictionary[arg])
+            for arg in arguments)
+
         self.VirtualVarsPic = _Create_VirtualVarsPic(arguments, dictionary)
         size = len(dictionary)
         self.PhysicalVarsPic, self.Matches = _Create_PhysicalVarsPic(self.VirtualVarsPic, size)
 
+    def Rename (self, predicat):
+        """
+        :param predicat: The predicat of the new block
+        :type predicat: str
+        :return: The block with another predicat (the other data of the block does not depend on it) - the block is
+         not parsed again (GAP_Parser.Rule)
+        :rtype: GAP_Block
+        """
+        block = object.__new__(GAP_Block)  ## the attributes are set in the order of the initialization
+        block.Predicat, block.Notation, block.Type = predicat, self.Notation, self.Type
+        block.Arguments, block.Constants, block.Key = self.Arguments, self.Constants, self.Key
+        block.VirtualVarsPic, block.PhysicalVarsPic, block.Matches = self.VirtualVarsPic, self.PhysicalVarsPic, \
+            self.Matches
+        return block
+
     def Bool_NeedFilter (self):
         """
         return true if the arguments in the block needs to pass Filtering
@@ -237,10 +507,31 @@ class GAP_Block:
         """
         return not len(self.Matches) is 0
 
+    def Create_Keys (self, rows):
+        """
+        The keys of the atoms of the block for rows of a "Definition Zone" (the constants are added)
+        :param rows: Array - the columns in the order of the variables of the rule
+        :type rows: np.ndarray
+        :return: Array of the keys
+        :rtype: np.ndarray
+        """
+        if len(self.Constants) == 0:
+            return rows[:, self.VirtualVarsPic]
+
+        keys = np.empty((np.shape(rows)[0], len(self.Arguments)), dtype = rows.dtype)
+        places = [place for place, arg in enumerate(self.Arguments) if not _IsConstant(arg)]
+        keys[:, places] = rows[:, self.VirtualVarsPic]
+
+        for place, value in self.Constants:
+            keys[:, place] = value
+        return keys
+
     def __str__ (self):
         result = self.Predicat + " ("
         for num in self.VirtualVarsPic:
             result += int(num).__str__() + " "
+        for place, value in self.Constants:
+            result += "[{0}]={1} ".format(place, value)
 
         result += "): " + self.Notation
         return result
@@ -282,30 +573,593 @@ class GAP_Block:
 
 #endregion
 
+#region GAP Plan
+class GAP_Plan:
+    """
+    The operator plan of the "Definition Zone" of a rule - the scans of the body blocks (with their filters) and the
+    Select Above blocks. Agents that implement Execute_Plan get the whole plan instead of the single functions.
+    The scan of a Select Above block of a predicat with an annotation index (GAP_Data.Index_Annotations) gets only the
+    atoms above the minimum, so the block is not selected again.
+    The scan of a block with constants gets only the atoms with these values (and above the minimum, for a Select
+    Above block), so a Select Above block with constants is not in Aboves.
+    """
+
+    def __init__ (self, rule):
+        """
+        Initialization
+        :param rule: The rule
+        :type rule: GAP_Rule
+        """
+        self.Size = len(rule.Dictionary)
+        self.Scans, self.Aboves, self.Minimums, self.Constants = [], [], [], []
+
+        for block in rule.Body:
+            self.Scans.append((block.Predicat, block.VirtualVarsPic, block.Matches))
+            self.Minimums.append(float(block.Notation) if block.Type == BlockType.ABOVE else None)
+            self.Constants.append(block.Constants)
+
+            if block.Type == BlockType.ABOVE and len(block.Constants) == 0:
+                self.Aboves.append((block.Predicat, block.VirtualVarsPic, float(block.Notation)))
+
+    def Key (self, terms, dataHolder):
+        """
+        The key of the join of some scans in a GAP_JoinCache - the variables are renamed by their first appearance, so
+        the same join in other rules (with other names of the variables) has the same key.
+        :param terms: list of the indexes of the scans in the order of the join
+        :type terms: list
+        :param dataHolder: the data agent (the versions of the predicats are in the key)
+        :type dataHolder: GAP_Data
+        :return: (key, list of the variables of the rule by their new names)
+        :rtype: tuple
+        """
+        names, parts = { }, []
+
+        for j in terms:
+            predicat, virtual, matches = self.Scans[j]
+            args = tuple(names.setdefault(v, len(names)) for v in virtual)
+            parts.append((predicat, args, tuple(self.Constants[j]), self.Minimums[j], dataHolder.versions[predicat]))
+
+        return tuple(parts), sorted(names, key = names.get)
+
+    def Filter_Places (self, j):
+        """
+        :param j: The index of the scan
+        :type j: int
+        :return: The columns of the scan that are left after its filter (None - no filter)
+        :rtype: list
+        """
+        predicat, virtual, matches = self.Scans[j]
+        return Create_Filter_Places(len(virtual), matches) if len(matches) > 0 else None
+
+    def Columns (self, j):
+        """
+        :param j: The index of the scan
+        :type j: int
+        :return: column of every variable in the scan (-1 = not in the scan)
+        :rtype: list
+        """
+        return Create_Columns(self.Scans[j][1], self.Size)
+
+    def Join (self, a_varsPic, b_varsPic):
+        """
+        :param a_varsPic: Physical Variables Picture of the first array
+        :type a_varsPic: np.ndarray
+        :param b_varsPic: Physical Variables Picture of the second array
+        :type b_varsPic: np.ndarray
+        :return: the metadata of the join of the arrays - (Joined Physical Variables Picture, list of the joined
+         variables, amount of columns of the result)
+        :rtype: tuple
+        """
+        join_varsPic, joinLst = Create_VarsPic_Join(a_varsPic, b_varsPic)
+        return join_varsPic, joinLst, Length_VarsPic(join_varsPic)
+
+    def Select (self, j, a_varsPic):
+        """
+        :param j: The index of the scan of a Select Above block
+        :type j: int
+        :param a_varsPic: Physical Variables Picture of the array that is selected
+        :type a_varsPic: np.ndarray
+        :return: the metadata of Select Above - (physical places of the variables of the block, Physical Variables
+         Picture of the places, metadata of the join of the array with the places)
+        :rtype: tuple
+        """
+        virtual = self.Scans[j][1]
+        places_varsPic = Create_VarsPic_Physical(virtual, self.Size)
+        return Create_VarsPic_Places(a_varsPic, virtual), places_varsPic, self.Join(a_varsPic, places_varsPic)
+
+    def Fused_Join (self, a_cols, b_cols):
+        """
+        :param a_cols: column of every variable in the first relation
+        :type a_cols: list
+        :param b_cols: column of every variable in the second relation
+        :type b_cols: list
+        :return: the layout of a fused join of the relations (keys, out, cols) - see Create_Columns_Join
+        :rtype: tuple
+        """
+        return Create_Columns_Join(a_cols, b_cols, self.Size)
+
+    def Finish (self, cols, matches, a_col):
+        """
+        :param cols: column of every variable in the joined relation
+        :type cols: list
+        :param matches: the matches of the joined relation that are not checked yet
+        :type matches: list
+        :param a_col: amount of columns in the joined relation
+        :type a_col: int
+        :return: (the columns that are left after the filter of the matches (None - no filter), column of every
+         variable after the filter, list of the columns of the variables of every block of Aboves)
+        :rtype: tuple
+        """
+        places = None
+        if len(matches) > 0:
+            places = Create_Filter_Places(a_col, matches)
+            cols = [places.index(col) if col != -1 else -1 for col in cols]
+
+        return places, cols, [[cols[ptr] for ptr in virtual] for predicat, virtual, minValue in self.Aboves]
+
+#endregion
+
+#region GAP Physical Plan
+class GAP_PhysicalPlan(GAP_Plan):
+    """
+    The immutable physical plan of a rule (GAP_Compiler.PreRun) - the GAP_Plan with the metadata of all its steps
+    precomputed : the places of the filters and the columns of the scans, the Joined Physical Variables Picture, the
+    list of the joined variables and the amount of columns of every join of the join trees (of the scans, of the
+    Select Above blocks and of the stream), the places of the Select Above blocks and the layouts of the fused joins
+    (GAP_OpenCL.Execute_Plan). The runtime only takes the metadata from the tables.
+    A join that is taken from a GAP_JoinCache may have other columns (the rule that created it has other names of the
+    variables) - its metadata is not in the tables, and it is created as in GAP_Plan.
+    The tables do not depend on the predicats, so the plans of the rules with the same structure share them.
+    """
+
+    def __init__ (self, rule, tables = None):
+        """
+        Initialization
+        :param rule: The rule
+        :type rule: GAP_Rule
+        :param tables: [Optional] the tables of the plans by their structure (GAP_Compiler.PreRun) - the plans of the
+         rules with the same structure share their tables (they are not changed) [default = the tables are created]
+        :type tables: dict
+        """
+        GAP_Plan.__init__(self, rule)
+
+        key = self.Size, tuple((tuple(virtual), tuple(matches)) for predicat, virtual, matches in self.Scans), tuple(
+            minValue is not None for minValue in self.Minimums), tuple(len(constants) for constants in self.Constants)
+        shared = tables.get(key) if tables is not None else None
+        if shared is None:
+            shared = self.Create_Tables(rule)
+            if tables is not None:
+                tables[key] = shared
+
+        self.Joins, self.Selects, self.Fused, self.Finishes, self.Places, self.Cols = shared
+        self.Scans, self.Aboves = tuple(self.Scans), tuple(self.Aboves)
+        self.Minimums, self.Constants = tuple(self.Minimums), _ReadOnly(self.Constants)
+        self.Frozen = True
+
+    def Create_Tables (self, rule):
+        """
+        Create the tables of the plan (in the initialization)
+        :param rule: The rule
+        :type rule: GAP_Rule
+        :return: (Joins, Selects, Fused, Finishes, Places, Cols)
+        :rtype: tuple
+        """
+        scans = range(len(self.Scans))
+        joins, selects, fused, finishes = { }, { }, { }, { }
+        self.Joins, self.Selects, self.Fused, self.Finishes = joins, selects, fused, finishes
+
+        def Join (a, b):
+            key = _Picture_Key(a), _Picture_Key(b)
+            if key not in joins:
+                joins[key] = _ReadOnly(GAP_Plan.Join(self, a, b))
+            return joins[key][0]
+
+        def Select (j, a):
+            key = j, _Picture_Key(a)
+            if key not in selects:
+                select = GAP_Plan.Select(self, j, a)
+                Join(a, select[1])
+                selects[key] = _ReadOnly(select[:2] + (joins[_Picture_Key(a), _Picture_Key(select[1])],))
+            return selects[key]
+
+        def Fused (a, b):
+            key = _Picture_Key(a), _Picture_Key(b)
+            if key not in fused:
+                fused[key] = tuple(tuple(item) for item in GAP_Plan.Fused_Join(self, a, b))
+            return list(fused[key][2])
+
+        root = _Join_Tree([block.PhysicalVarsPic for block in rule.Body], Join)
+
+        aboves = [j for j in scans if self.Minimums[j] is not None and len(self.Constants[j]) == 0]
+        for count in range(1, len(aboves) + 1):
+            for subset in itertools.combinations(aboves, count):
+                _Join_Tree([root] + [Select(j, root)[1] for j in subset], Join)  ## Create_DefinitionZone
+
+                varsPic = root
+                for j in subset:  ## Stream_DefinitionZone
+                    varsPic = Select(j, varsPic)[2][0]
+
+        columns = [GAP_Plan.Columns(self, j) for j in scans]
+        if len(columns) == 1:
+            cols, matches, a_col = columns[0], self.Scans[0][2], len(self.Scans[0][1])
+        else:
+            cols = _Join_Tree(columns, Fused)
+            matches, a_col = [], self.Size - list(cols).count(-1)
+
+        finishes[_Picture_Key(cols), tuple(matches), a_col] = _ReadOnly(GAP_Plan.Finish(self, cols, matches, a_col))
+
+        return types.MappingProxyType(joins), types.MappingProxyType(selects), types.MappingProxyType(fused), \
+            types.MappingProxyType(finishes), tuple(_ReadOnly(GAP_Plan.Filter_Places(self, j)) for j in scans), \
+            _ReadOnly(columns)
+
+    def __setattr__ (self, name, value):
+        """ The attributes are set only in the initialization """
+        if getattr(self, "Frozen", False):
+            raise AttributeError("The physical plan is immutable")
+        object.__setattr__(self, name, value)
+
+    def __getstate__ (self):
+        """ The state for GAP_RuleCache (pickle) - the tables are dicts """
+        return {name: dict(value) if isinstance(value, types.MappingProxyType) else value for name, value in
+            self.__dict__.items()}
+
+    def __setstate__ (self, state):
+        """ Create the plan from its state (pickle) """
+        for name, value in state.items():
+            object.__setattr__(self, name, types.MappingProxyType(value) if isinstance(value, dict) else value)
+
+    def Filter_Places (self, j):
+        """ GAP_Plan.Filter_Places from the table """
+        return self.Places[j]
+
+    def Columns (self, j):
+        """ GAP_Plan.Columns from the table """
+        return self.Cols[j]
+
+    def Join (self, a_varsPic, b_varsPic):
+        """ GAP_Plan.Join from the table """
+        join = self.Joins.get((_Picture_Key(a_varsPic), _Picture_Key(b_varsPic)))
+        return join if join is not None else GAP_Plan.Join(self, a_varsPic, b_varsPic)
+
+    def Select (self, j, a_varsPic):
+        """ GAP_Plan.Select from the table """
+        select = self.Selects.get((j, _Picture_Key(a_varsPic)))
+        return select if select is not None else GAP_Plan.Select(self, j, a_varsPic)
+
+    def Fused_Join (self, a_cols, b_cols):
+        """ GAP_Plan.Fused_Join from the table """
+        layout = self.Fused.get((_Picture_Key(a_cols), _Picture_Key(b_cols)))
+        return layout if layout is not None else GAP_Plan.Fused_Join(self, a_cols, b_cols)
+
+    def Finish (self, cols, matches, a_col):
+        """ GAP_Plan.Finish from the table """
+        finish = self.Finishes.get((_Picture_Key(cols), tuple(matches), a_col))
+        return finish if finish is not None else GAP_Plan.Finish(self, cols, matches, a_col)
+
+#endregion
+
+#region GAP Join Cache
+class GAP_JoinCache:
+    """
+    The results of the joins of some scans (subtrees of the join trees of the rules) in an interval, shared by all the
+    rules that join the same scans (GAP_Plan.Key). The cache is cleared in the start of every interval, and the
+    versions of the predicats in the keys keep it right when the rules of the interval change the data.
+    """
+
+    def __init__ (self):
+        """
+        Initialization
+        """
+        self.entries = { }  ## key -> [(Array, columns of the variables by their names in the key, ...)]
+        self.hits, self.misses, self.rows = 0, 0, 0
+
+    def Get (self, key):
+        """
+        :param key: The key of the join (GAP_Plan.Key)
+        :return: The entry of the join - [result], [None] while the result is computed, None if there is no entry
+        :rtype: list
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+    def Put (self, key):
+        """
+        Add an entry of a join - the result is set in the entry when it is computed
+        :param key: The key of the join (GAP_Plan.Key)
+        :return: The entry of the join ([None])
+        :rtype: list
+        """
+        self.misses += 1
+        self.entries[key] = [None]
+        return self.entries[key]
+
+    def Drop (self, key):
+        """
+        Remove an entry of a join (its result was not computed)
+        :param key: The key of the join (GAP_Plan.Key)
+        """
+        self.entries.pop(key, None)
+
+    def Clear (self):
+        """
+        Remove all the entries (the start of an interval)
+        """
+        self.entries.clear()
+
+    def Statistics (self):
+        """
+        :return: {"hits": joins that were reused, "misses": joins that were computed, "rows": rows that were reused,
+         "reuse": rate of the reused joins}
+        :rtype: dict
+        """
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "rows": self.rows,
+            "reuse": self.hits / total if total > 0 else 0.0}
+
+#endregion
+
+#region GAP Rule Cache
+class GAP_RuleCache:
+    """
+    Disk cache of the compiled rules - the parsed rule, its physical plan (GAP_PhysicalPlan) and its marshalled code,
+    by the hash of the normalized text of the rule. The rules of a version of the engine (_Engine_Version) are in a
+    single pack file of the directory, that is read in the first use and written by Save (the pack is replaced, so a
+    reader never sees a partial pack - when 2 processes save together, the rules of one of them are compiled again in
+    the next run).
+    """
+
+    def __init__ (self, directory):
+        """
+        Initialization
+        :param directory: directory of the cache
+        :type directory: str
+        """
+        self.directory = directory
+        self.path = os.path.join(directory, "rules-{0}.pack".format(_Engine_Version()[:16]))
+        self.entries, self.changed = None, False  ## key -> pickled rule (read in the first use)
+        self.hits, self.misses = 0, 0
+
+    def Key (self, text):
+        """
+        :param text: GAP Rule in string
+        :type text: str
+        :return: The key of the rule - hash of its normalized text
+        :rtype: str
+        """
+        return hashlib.sha1(_Rule_Text(text).encode("utf-8")).hexdigest()
+
+    def Entries (self):
+        """
+        :return: The entries of the pack (it is read in the first use)
+        :rtype: dict
+        """
+        if self.entries is None:
+            self.entries = { }
+
+            if os.path.exists(self.path):
+                filer = open(self.path, "rb")
+                try:
+                    self.entries = pickle.load(filer)
+                except (pickle.UnpicklingError, EOFError, ValueError):
+                    pass  ## a broken pack - the rules are compiled again
+                filer.close()
+
+        return self.entries
+
+    def Get (self, text):
+        """
+        :param text: GAP Rule in string
+        :type text: str
+        :return: The compiled rule (GAP_Rule) - None if it is not in the cache
+        :rtype: GAP_Rule
+        """
+        entry = self.Entries().get(self.Key(text))
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return pickle.loads(entry)
+
+    def Put (self, rule):
+        """
+        Add a compiled rule (GAP_Rule.Arrange_Execution) to the cache, if it is not in it
+        :param rule: The rule
+        :type rule: GAP_Rule
+        """
+        key = self.Key(rule.Text)
+        entries = self.Entries()
+
+        if key not in entries:
+            entries[key] = pickle.dumps(rule, pickle.HIGHEST_PROTOCOL)
+            self.changed = True
+
+    def Save (self):
+        """
+        Write the pack, if rules were added to it
+        """
+        if not self.changed:
+            return
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        filer = open(self.path + ".tmp", "wb")
+        pickle.dump(self.entries, filer, pickle.HIGHEST_PROTOCOL)
+        filer.close()
+        os.replace(self.path + ".tmp", self.path)
+
+        self.changed = False
+
+    def Statistics (self):
+        """
+        :return: {"hits": rules that were loaded from the cache, "misses": rules that were parsed, "rules": amount
+         of rules in the pack}
+        :rtype: dict
+        """
+        return {"hits": self.hits, "misses": self.misses, "rules": len(self.Entries())}
+
+#endregion
+
+#region GAP Parser
+class GAP_Parser:
+    """
+    Streaming parser of the GAP files - the rules are read lazily (a line at a time) and the parts of the rules are in
+    hashed registries : every text of a block is parsed once, every predicat is a single string, the rules with the
+    same arguments in their blocks share the dictionary of the variables, and the rules with the same block (with the
+    same dictionary) share its GAP_Block.
+    So the blocks of a large set of rules are parsed once, and a rule is not compared with the other rules.
+    The rules with the same shape (the same text without their predicats - _PREDICAT_PATTERN) have the same structure,
+    so only the first rule of a shape is parsed - the other rules are its copies with their predicats.
+    """
+
+    def __init__ (self):
+        """
+        Initialization
+        """
+        self.Texts = { }      ## text of a block -> the parsed block (_Parse_Block)
+        self.Predicats = { }  ## predicat -> the string of the predicat
+        self.Variables = { }  ## arguments of the blocks of a rule -> (dictionary of the variables, number)
+        self.Blocks = { }     ## (arguments, notation, number of the dictionary) -> {predicat -> GAP_Block}
+        self.Shapes = { }     ## text of a rule without its predicats -> the template of the shape (None - parsed)
+
+    def Stream (self, path):
+        """
+        Read the rules of a GAP file lazily (the empty lines are skipped)
+        :param path: Gap file path
+        :type path: str
+        :return: generator of the rules (str)
+        """
+        filer = open(path, "r")
+        try:
+            for line in filer:
+                if not line.isspace():
+                    yield line
+        finally:
+            filer.close()
+
+    def Dictionary (self, args):
+        """
+        :param args: list of the arguments of every block of a rule (_Parse_Rule)
+        :type args: list
+        :return: (the dictionary of the variables of the rule, its number in the registry)
+        :rtype: tuple
+        """
+        key = tuple(map(tuple, args))
+        entry = self.Variables.get(key)
+        if entry is None:
+            entry = self.Variables[key] = _Create_ArgumentsDictionary(args), len(self.Variables)
+        return entry
+
+    def Block (self, parsed, dictionary, number):
+        """
+        :param parsed: basic tuple of a block (_Parse_Rule)
+        :type parsed: tuple
+        :param dictionary: the dictionary of the variables of the rule
+        :type dictionary: dict
+        :param number: the number of the dictionary in the registry
+        :type number: int
+        :return: The block (shared by the rules with the same block and the same dictionary)
+        :rtype: GAP_Block
+        """
+        predicat, arguments, notation = parsed
+        blocks = self.Blocks.setdefault((tuple(arguments), notation, number), { })
+
+        block = blocks.get(predicat)
+        if block is None:
+            predicat = self.Predicats.setdefault(predicat, predicat)
+            block = blocks[predicat] = GAP_Block((predicat, arguments, notation), dictionary)
+        return block
+
+    def Rule (self, text):
+        """
+        :param text: GAP Rule in string
+        :type text: str
+        :return: The rule
+        :rtype: GAP_Rule
+        """
+        parts = _PREDICAT_PATTERN.split("&" + text)  ## the header is after a separator too
+        names = parts[2::3]
+        del parts[2::3]
+        shape = tuple(parts)
+
+        template = self.Shapes.get(shape, False)
+        if template is False:  ## the first rule of the shape
+            rule = GAP_Rule(text, self)
+            self.Shapes[shape] = self.Template(rule, text, names)
+            return rule
+        if template is None:
+            return GAP_Rule(text, self)
+
+        first, registries, sources, order = template
+        blocks = []
+        for name, registry, source in zip(names, registries, sources):
+            block = registry.get(name)
+            if block is None:
+                predicat = self.Predicats.setdefault(name, name)
+                block = registry[predicat] = source.Rename(predicat)
+            blocks.append(block)
+
+        return first.Rename(text, blocks, order)
+
+    def Template (self, rule, text, names):
+        """
+        :param rule: The first rule of a shape
+        :type rule: GAP_Rule
+        :param text: The text of the rule
+        :type text: str
+        :param names: The predicats of the shape of the rule (_PREDICAT_PATTERN)
+        :type names: list
+        :return: The template of the shape - (the rule, the registry of every block of the rule (Blocks), the blocks
+         of the rule in the order of the text, the place of every body block of the rule in the text) - None if the
+         predicats of the shape are not the blocks of the rule (the rules of the shape are parsed)
+        :rtype: tuple
+        """
+        header, body, args = _Parse_Rule(text, self.Texts)
+        number = self.Dictionary(args)[1]
+        registries = [self.Blocks[(tuple(arguments), notation, number)] for predicat, arguments, notation in
+            [header] + body]
+        blocks = [registry[parsed[0]] for registry, parsed in zip(registries, [header] + body)]
+
+        places = {id(block): k for k, block in enumerate(blocks)}
+        if names != [block.Predicat for block in blocks] or len(places) < len(blocks):
+            return None  ## a separator in a notation, or a block that is twice in the rule (its copies may differ)
+
+        return rule, registries, blocks, [places[id(block)] for block in rule.Body]
+
+#endregion
+
 #region GAP Rule
 class GAP_Rule:
     """
     it analyses and save all the data needed for a single gap rule.
+    The plan of the rule (GAP_Plan) is created in its first use - the physical plan of PreRun replaces it, so the
+    plans of a large set of rules are not created while the rules are loaded.
     """
 
-    def __init__ (self, rule):
+    def __init__ (self, rule, parser = None):
         """
         Initialization
         :param rule: GAP Rule in string
         :type rule: str
+        :param parser: [Optional] the registries of the rules of a file (GAP_Parser) [default = registries of the rule]
+        :type parser: GAP_Parser
         """
-        headerBlock, bodyBlock, args = _Parse_Rule(rule)
-        self.Dictionary = _Create_ArgumentsDictionary(args)
-        self.Body, self.Predicats = [], []
-        self.Header = GAP_Block(headerBlock, self.Dictionary)
+        parser = parser if parser is not None else GAP_Parser()
+        headerBlock, bodyBlock, args = _Parse_Rule(rule, parser.Texts)
+        self.Text = _Rule_Text(rule)
+        self.Dictionary, number = parser.Dictionary(args)
+        self.Body = []
+        self.Header = parser.Block(headerBlock, self.Dictionary, number)
         self.Type = RuleType.HEADER
 
-        self.Code_Run, self.Predicats_Dependent = [], []
-
-        self.Predicats.append(headerBlock[0])
+        self.Code_Run = []
+        self.Code_Index = None  ## (idx, addon) of the compiled code - Arrange_Execution
 
         for block in bodyBlock:
-            parsed_block = GAP_Block(block, self.Dictionary)
+            parsed_block = parser.Block(block, self.Dictionary, number)
 
             if parsed_block.Type == BlockType.ANNOTATION and self.Type == RuleType.HEADER:
                 self.Type = RuleType.GROUND
@@ -314,16 +1168,43 @@ class GAP_Rule:
 
             self.Body.append(parsed_block)
 
-            if block[0] not in self.Predicats:
-                self.Predicats.append(block[0])
-
-            if block[0] not in self.Predicats_Dependent:
-                self.Predicats_Dependent.append(block[0])
+        self.Predicats_Dependent = list(dict.fromkeys(block.Predicat for block in self.Body))
+        self.Predicats = list(dict.fromkeys([self.Header.Predicat] + self.Predicats_Dependent))
 
         self.Body.sort()
 
         if self.Type == RuleType.HEADER:
-            self.Predicats_Dependent = [headerBlock[0]]
+            self.Predicats_Dependent = [self.Header.Predicat]
+
+    def Rename (self, text, blocks, order):
+        """
+        :param text: GAP Rule in string - a rule with the shape of this rule (GAP_Parser.Rule) and other predicats
+        :type text: str
+        :param blocks: The blocks of the new rule in the order of the text (the header first)
+        :type blocks: list
+        :param order: The place in the text of every body block of this rule
+        :type order: list
+        :return: The new rule - it is not parsed, its structure is the structure of this rule
+        :rtype: GAP_Rule
+        """
+        predicats = [block.Predicat for block in blocks]
+
+        rule = object.__new__(GAP_Rule)  ## the attributes are set in the order of the initialization
+        rule.Text, rule.Dictionary, rule.Body, rule.Header = _Rule_Text(text), self.Dictionary, [blocks[k] for k in
+            order], blocks[0]
+        rule.Type, rule.Code_Run, rule.Code_Index = self.Type, [], None
+        rule.Predicats_Dependent = predicats[:1] if self.Type == RuleType.HEADER else list(dict.fromkeys(
+            predicats[1:]))
+        rule.Predicats = list(dict.fromkeys(predicats))
+        return rule
+
+    def __getattr__ (self, name):
+        """ The plan is created in its first use (the other attributes are set by the initialization) """
+        if name != "Plan":
+            raise AttributeError(name)
+
+        self.Plan = GAP_Plan(self)
+        return self.Plan
 
     def __str__ (self):
         result = ""
@@ -342,6 +1223,7 @@ class GAP_Rule:
     def Create_CompiledCode (self, total, idx = 0, addon = 0, eps = 0.00001):
         """
         Compile for the code for the running (without "Definition Zone")
+        The function appends (key, improvement) of every added / changed header atom to "changes" if it is given.
         :param total: amount of arguments variables
         :type total:int
         :param idx: the index of the rule
@@ -355,7 +1237,7 @@ class GAP_Rule:
         """
         result = []
 
-        result.append(("def Rule_{0}(def_zone:tuple, lst:list, index:int):".format(idx), addon))
+        result.append(("def Rule_{0}(def_zone:tuple, lst:list, index:int, changes:list = None):".format(idx), addon))
         result.append(("assigns, varsPic = def_zone", addon + 1))
         result.append(("added, changed = 0,0", addon + 1))
 
@@ -366,28 +1248,27 @@ class GAP_Rule:
 
         for block in self.Body:
             if block.Type == BlockType.ANNOTATION:
-                tupleKey = ""
-                for idx in block.VirtualVarsPic:
-                    tupleKey += "a_{0},".format(idx)
-
                 result.append(
-                    ("{0}=MainDict[\"{1}\"][({2})]".format(block.Notation, block.Predicat, tupleKey), addon + 2))
+                    ("{0}=MainDict[\"{1}\"][({2})]".format(block.Notation, block.Predicat, block.Key), addon + 2))
 
         block = self.Header
-        tupleKey = ""
-        for idx in block.VirtualVarsPic:
-            tupleKey += "a_{0},".format(idx)
+        tupleKey = block.Key
 
         result.append((
             "if ({0}) not in MainDict[\"{1}\"].keys() and {2} > 0:".format(tupleKey, block.Predicat, block.Notation),
             addon + 2))
         result.append(("added+=1", addon + 3))
         result.append(("MainDict[\"{0}\"][({1})] = {2}".format(block.Predicat, tupleKey, block.Notation), addon + 3))
+        result.append(("if changes is not None:", addon + 3))
+        result.append(("changes.append((({0}), {1}))".format(tupleKey, block.Notation), addon + 4))
 
         result.append((
             "elif {0} >= MainDict[\"{1}\"][({2})]+({3}):".format(block.Notation, block.Predicat, tupleKey, eps),
             addon + 2))
         result.append(("changed+=1", addon + 3))
+        result.append(("if changes is not None:", addon + 3))
+        result.append(("changes.append((({0}), {1} - MainDict[\"{2}\"][({0})]))".format(tupleKey, block.Notation,
+            block.Predicat), addon + 4))
         result.append(("MainDict[\"{0}\"][({1})] = {2}".format(block.Predicat, tupleKey, block.Notation), addon + 3))
 
         result.append(("lst[index] = (added, changed)", addon + 1))
@@ -397,6 +1278,7 @@ class GAP_Rule:
     def Create_CompiledCode_HeaderRule (self, total, idx = 0, addon = 0, eps = 0.00001):
         """
         Compile for the code for the running [Header rule] (without "Definition Zone")
+        The function appends (key, improvement) of every added / changed header atom to "changes" if it is given.
         :param total: amount of arguments variables
         :type total:int
         :param idx: the index of the rule
@@ -410,7 +1292,7 @@ class GAP_Rule:
         """
         result = []
 
-        result.append(("def Rule_{0}(def_zone:tuple, lst:list, index:int):".format(idx), addon))
+        result.append(("def Rule_{0}(def_zone:tuple, lst:list, index:int, changes:list = None):".format(idx), addon))
         result.append(("assigns, varsPic = def_zone", addon + 1))
         result.append(("changed = 0", addon + 1))
 
@@ -420,14 +1302,15 @@ class GAP_Rule:
             result.append(("a_{0} = row[varsPic[{0}]]".format(i), addon + 2))
 
         block = self.Header
-        tupleKey = ""
-        for idx in block.VirtualVarsPic:
-            tupleKey += "a_{0},".format(idx)
+        tupleKey = block.Key
 
         result.append((
             "if {0} >= MainDict[\"{1}\"][({2})]+({3}):".format(block.Notation, block.Predicat, tupleKey, eps),
             addon + 2))
         result.append(("changed+=1", addon + 3))
+        result.append(("if changes is not None:", addon + 3))
+        result.append(("changes.append((({0}), {1} - MainDict[\"{2}\"][({0})]))".format(tupleKey, block.Notation,
+            block.Predicat), addon + 4))
         result.append(("MainDict[\"{0}\"][({1})] = {2}".format(block.Predicat, tupleKey, block.Notation), addon + 3))
 
         result.append(("lst[index] = (added, changed)", addon + 1))
@@ -435,83 +1318,382 @@ class GAP_Rule:
 
         return result
 
-    def Arrange_Execution (self, idx, addon = 0):
+    def Create_CompiledCode_Jacobi (self, total, idx = 0, addon = 0, eps = 0.00001):
+        """
+        Compile for the code for the running in Jacobi mode (without "Definition Zone") - the annotations are read
+        from the data of the previous interval (MainDict is not changed), and the header atoms are written to the
+        delta of the rule (merged with max by GAP_Compiler.Merge_Deltas)
+        :param total: amount of arguments variables
+        :type total:int
+        :param idx: the index of the rule
+        :type idx:int
+        :param addon: how much tabs do add
+        :type addon: int
+        :param eps: the epsilon of the rule [default = 0.000001]
+        :type eps:float
+        :return: code list
+        :rtype: list
+        """
+        result = []
+
+        result.append(("def Jacobi_{0}(def_zone:tuple, lst:list, index:int, delta:dict):".format(idx), addon))
+        result.append(("assigns, varsPic = def_zone", addon + 1))
+        result.append(("added, changed = 0,0", addon + 1))
+        result.append(("header = MainDict[\"{0}\"]".format(self.Header.Predicat), addon + 1))
+
+        result.append(("for row in assigns:", addon + 1))
+
+        for i in range(total):
+            result.append(("a_{0} = row[varsPic[{0}]]".format(i), addon + 2))
+
+        for block in self.Body:
+            if block.Type == BlockType.ANNOTATION:
+                result.append(
+                    ("{0}=MainDict[\"{1}\"][({2})]".format(block.Notation, block.Predicat, block.Key), addon + 2))
+
+        block = self.Header
+        tupleKey = block.Key
+
+        result.append(("key, value = ({0}), {1}".format(tupleKey, block.Notation), addon + 2))
+        result.append(("old = delta.get(key)", addon + 2))
+        result.append(("if old is None:", addon + 2))
+        result.append(("old = header.get(key)", addon + 3))
+
+        result.append(("if old is None:", addon + 2))
+        result.append(("if value > 0:", addon + 3))
+        result.append(("added+=1", addon + 4))
+        result.append(("delta[key] = value", addon + 4))
+
+        result.append(("elif value >= old+({0}):".format(eps), addon + 2))
+        result.append(("changed+=1", addon + 3))
+        result.append(("delta[key] = value", addon + 3))
+
+        result.append(("lst[index] = (added, changed)", addon + 1))
+        result.append(("return", addon + 1))
+        return result
+
+    def __getstate__ (self):
+        """ The state for GAP_RuleCache (pickle) - the compiled code is marshalled """
+        state = dict(self.__dict__)
+        for name in ["Code_Run", "Code_Jacobi"]:
+            if isinstance(state.get(name), types.CodeType):
+                state[name] = marshal.dumps(state[name])
+        return state
+
+    def __setstate__ (self, state):
+        """ Create the rule from its state (pickle) """
+        for name in ["Code_Run", "Code_Jacobi"]:
+            if isinstance(state.get(name), bytes):
+                state[name] = marshal.loads(state[name])
+        self.__dict__.update(state)
+
+    def Create_Sources (self, idx = 0, addon = 0):
         """
-        Before execution, compile the rule
         :param idx: the index of the rule
         :type idx: int
         :param addon: how much tabs to add to the code
         :type addon: int
+        :return: The code of the rule - (code of Rule_{idx}, code of Jacobi_{idx})
+        :rtype: tuple
         """
-        if self.Type == RuleType.HEADER:
-            self.Code_Run = compile(_Create_CommandString(
-                self.Create_CompiledCode_HeaderRule(len(self.Dictionary), idx = idx, addon = addon)), "<string>",
-                "exec")
-        else:
-            self.Code_Run = compile(
-                _Create_CommandString(self.Create_CompiledCode(len(self.Dictionary), idx = idx, addon = addon)),
-                "<string>", "exec")
+        total = len(self.Dictionary)
+        run = self.Create_CompiledCode_HeaderRule if self.Type == RuleType.HEADER else self.Create_CompiledCode
+
+        return _Create_CommandString(run(total, idx = idx, addon = addon)), _Create_CommandString(
+            self.Create_CompiledCode_Jacobi(total, idx = idx, addon = addon))
 
-    def Create_DefinitionZone_Join (self, arrays, gpu):
+    def Arrange_Execution (self, idx, addon = 0, codes = None, tables = None):
+        """
+        Before execution, compile the rule and its physical plan (GAP_PhysicalPlan)
+        A rule that was already compiled (in an earlier run, or from a GAP_RuleCache) is not compiled again - only its
+        functions are renamed if its index was changed.
+        :param idx: the index of the rule
+        :type idx: int
+        :param addon: how much tabs to add to the code
+        :type addon: int
+        :param codes: [Optional] the compiled code of Create_Sources with the index 0 (GAP_Compiler.PreRun)
+         [default = compiled here]
+        :type codes: tuple
+        :param tables: [Optional] the tables of the physical plans by their structure - see GAP_PhysicalPlan
+         [default = the tables are created for the rule]
+        :type tables: dict
+        """
+        if codes is not None:
+            self.Code_Run, self.Code_Jacobi = codes
+            self.Code_Index = 0, addon
+
+        if self.Code_Index is None or self.Code_Index[1] != addon:
+            run, jacobi = self.Create_Sources(idx, addon)
+            self.Code_Run = compile(run, "<string>", "exec")
+            self.Code_Jacobi = compile(jacobi, "<string>", "exec")
+        elif self.Code_Index[0] != idx:
+            old = self.Code_Index[0]
+            self.Code_Run = _Rename_Code(self.Code_Run, "Rule_{0}".format(old), "Rule_{0}".format(idx))
+            self.Code_Jacobi = _Rename_Code(self.Code_Jacobi, "Jacobi_{0}".format(old), "Jacobi_{0}".format(idx))
+
+        self.Code_Index = idx, addon
+
+        if not isinstance(vars(self).get("Plan"), GAP_PhysicalPlan):  ## the plan of the loading is not created
+            self.Plan = GAP_PhysicalPlan(self, tables)
+
+    def Create_DefinitionZone_Join (self, arrays, gpu, count = 1, pool = None, cache = None, dataHolder = None):
         """
         Executing the PART B in the Definition Zone algorithm : Join
-        :param arrays: The Arrays to join
+        :param arrays: The Arrays to join (with a pool - arrays / futures of arrays)
         :type arrays: list
         :param gpu: the execution agent for the relational functions (OpenCL / Basic)
-        :return: list of arrays with only 1 array
+        :param count: [Optional] join until there are at most count arrays [default = 1]
+        :type count: int
+        :param pool: [Optional] thread pool for the joins of every level of the tree [default = no pool]
+        :type pool: ThreadPoolExecutor
+        :param cache: [Optional] the joins of the scans that were done by other rules in the interval (the arrays
+         must be the scans of the blocks, without a pool) [default = no cache]
+        :type cache: GAP_JoinCache
+        :param dataHolder: [Optional] the data agent - for the keys of the cache
+        :type dataHolder: GAP_Data
+        :return: list of arrays with only 1 array (at most count arrays)
         :rtype: list
         """
-        next = []
+        if pool is not None:
+            return self.Create_DefinitionZone_Join_Parallel(arrays, gpu, count, pool)
 
-        while len(arrays) > 1:
+        next, terms, nextTerms = [], [[j] for j in range(len(arrays))], []
+
+        while len(arrays) > count:
             while len(arrays) > 0:
                 if len(arrays) is 1:
                     next.append(arrays.pop(0))
+                    nextTerms.append(terms.pop(0))
                 else:
                     a = arrays.pop(0)
                     b = arrays.pop(0)
+                    term = terms.pop(0) + terms.pop(0)
 
-                    res = gpu.SuperJoin(a, b)
+                    res = self.Create_DefinitionZone_Shared(a, b, term, gpu, cache, dataHolder)
                     if _IsEmpty(res[0]):
                         arrays.clear()
                         arrays.append(res)
                         return arrays
 
                     next.append(res)
+                    nextTerms.append(term)
 
-            arrays = next
-            next = []
+            arrays, terms = next, nextTerms
+            next, nextTerms = [], []
 
         return arrays
 
-    def Create_DefinitionZone (self, dataHolder, gpu):
+    def Create_DefinitionZone_Shared (self, a, b, terms, gpu, cache, dataHolder):
         """
-        Executing the fully algorithm of "Definition Zone"
+        Join of 2 arrays of the join tree - the join is taken from the cache if another rule did it in the interval
+        :param a: (Array, Physical Variables Picture)
+        :type a: tuple
+        :param b: (Array, Physical Variables Picture)
+        :type b: tuple
+        :param terms: The indexes of the scans of the join
+        :type terms: list
+        :param gpu: the execution agent for the relational functions (OpenCL / Basic)
+        :param cache: The join cache (None - no cache)
+        :type cache: GAP_JoinCache
+        :param dataHolder: the data agent
+        :type dataHolder: GAP_Data
+        :return: (Joined Array, Joined Physical Variables Picture)
+        :rtype: tuple
+        """
+        join = self.Plan.Join(a[1], b[1])
+        if cache is None:
+            return gpu.SuperJoin(a, b, join)
+
+        key, variables = self.Plan.Key(terms, dataHolder)
+        entry = cache.Get(key)
+
+        if entry is not None:
+            array, columns = entry[0]
+            cache.rows += np.shape(array)[0]
+
+            varsPic = np.full(len(self.Dictionary), -1, dtype = np.int32)
+            varsPic[variables] = columns
+            return array, varsPic
+
+        entry = cache.Put(key)
+        array, varsPic = gpu.SuperJoin(a, b, join)
+        entry[0] = array, [varsPic[v] for v in variables]
+        return array, varsPic
+
+    def Create_DefinitionZone_Join_Parallel (self, arrays, gpu, count, pool):
+        """
+        Create_DefinitionZone_Join with a thread pool - every join of the tree is submitted when its 2 inputs are
+        done (not when all the level is done).
+        :param arrays: The Arrays / futures of arrays to join
+        :type arrays: list
+        :param gpu: the execution agent for the relational functions (OpenCL / Basic)
+        :param count: join until there are at most count arrays
+        :type count: int
+        :param pool: The thread pool
+        :type pool: ThreadPoolExecutor
+        :return: list of arrays (at most count arrays)
+        :rtype: list
+        """
+        futures = [item if isinstance(item, Future) else _Future_Done(item) for item in arrays]
+
+        while len(futures) > count:
+            joined = [_Future_Join(pool, futures[i], futures[i + 1], gpu, self.Plan) for i in
+                range(0, len(futures) - 1, 2)]
+            futures = joined + futures[len(futures) - len(futures) % 2:]
+
+        arrays = [future.result() for future in futures]
+        for array in arrays:
+            if _IsEmpty(array[0]):
+                return [array]
+
+        return arrays
+
+    def Create_DefinitionZone_Block (self, block, dataHolder, gpu, places = None):
+        """
+        The array of a block (filtered)
+        :param block: The block
+        :type block: GAP_Block
         :param dataHolder: the data agent
         :type dataHolder: GAP_Data
         :param gpu: The relational functions agent (OpenCL / Basic)
+        :param places: [Optional] the columns that are left after the filter (GAP_Plan.Filter_Places)
+        :type places: list
+        :return: (Array, Physical Variables Picture)
+        :rtype: tuple
         """
-        lst = list(range(len(self.Body)))
+        array = dataHolder.Generate_NDArray(block.Predicat, float(block.Notation) if block.Type == BlockType.ABOVE
+            else None, block.Constants)
 
+        if (len(block.Matches) > 0):
+            return gpu.Filter((array, block.PhysicalVarsPic), block.Matches, places)
+        return array, block.PhysicalVarsPic
+
+    def Create_DefinitionZone_Scan (self, dataHolder, gpu, pool = None):
+        """
+        Executing the PART A in the Definition Zone algorithm : the arrays of the blocks (filtered)
+        :param dataHolder: the data agent
+        :type dataHolder: GAP_Data
+        :param gpu: The relational functions agent (OpenCL / Basic)
+        :param pool: [Optional] thread pool - the blocks are submitted to it and their futures are returned
+        :type pool: ThreadPoolExecutor
+        :return: (list of arrays - only the empty array if there is one, list of indexes of Select Above blocks)
+        :rtype: tuple
+        """
         arrays = []
         aboveLst = []
 
-        for i in lst:
+        for i in range(len(self.Body)):
             block = self.Body[i]
 
-            if (len(block.Matches) > 0):
-                array = gpu.Filter((dataHolder.Generate_NDArray(block.Predicat), block.PhysicalVarsPic), block.Matches)
+            places = self.Plan.Filter_Places(i)
+
+            if pool is not None:
+                arrays.append(pool.submit(self.Create_DefinitionZone_Block, block, dataHolder, gpu, places))
             else:
-                array = (dataHolder.Generate_NDArray(block.Predicat), block.PhysicalVarsPic)
+                array = self.Create_DefinitionZone_Block(block, dataHolder, gpu, places)
 
-            if _IsEmpty(array[0]):
-                return array
-            arrays.append(array)
+                if _IsEmpty(array[0]):
+                    return [array], aboveLst
+                arrays.append(array)
 
-            if block.Type is BlockType.ABOVE:
+            if block.Type is BlockType.ABOVE and len(block.Constants) == 0 and not dataHolder.Indexed(block.Predicat):
                 aboveLst.append(i)
 
-        arrays = self.Create_DefinitionZone_Join(arrays, gpu)
+        return arrays, aboveLst
+
+    def Stream_DefinitionZone (self, dataHolder, gpu, rows = 1 << 16, pool = None):
+        """
+        Executing the "Definition Zone" as a stream of batches of rows - the last join creates the batches, and the
+        Select Above blocks are done on every batch.
+        :param dataHolder: the data agent
+        :type dataHolder: GAP_Data
+        :param gpu: The relational functions agent (OpenCL / Basic)
+        :param rows: [Optional] amount of rows in a batch [default = 65536]
+        :type rows: int
+        :param pool: [Optional] thread pool for the blocks and the joins before the last join [default = no pool]
+        :type pool: ThreadPoolExecutor
+        :return: (GAP_Stream, Physical Variables Picture)
+        :rtype: tuple
+        """
+        stream = getattr(gpu, "Stream_Plan", None)
+        if stream is not None:
+            return stream(self.Plan, dataHolder, rows)
+
+        arrays, aboveLst = self.Create_DefinitionZone_Scan(dataHolder, gpu, pool)
+        if len(arrays) == 1 and not isinstance(arrays[0], Future) and _IsEmpty(arrays[0][0]):
+            return GAP_Stream(iter([])), arrays[0][1]
+
+        arrays = self.Create_DefinitionZone_Join(arrays, gpu, 2, pool)
+        if _IsEmpty(arrays[0][0]):
+            return GAP_Stream(iter([])), arrays[0][1]
+
+        if len(arrays) == 2:
+            varsPic = self.Plan.Join(arrays[0][1], arrays[1][1])[0]
+        else:
+            varsPic = arrays[0][1]
+
+        for i in aboveLst:
+            varsPic = self.Plan.Select(i, varsPic)[2][0]
+
+        return GAP_Stream(self.Stream_DefinitionZone_Batches(arrays, aboveLst, dataHolder, gpu, rows)), varsPic
+
+    def Stream_DefinitionZone_Batches (self, arrays, aboveLst, dataHolder, gpu, rows):
+        """
+        Generator of the batches of Stream_DefinitionZone
+        :param arrays: 1 / 2 arrays (the last join)
+        :type arrays: list
+        :param aboveLst: list of indexes of the Select Above blocks
+        :type aboveLst: list
+        :param dataHolder: the data agent
+        :param gpu: The relational functions agent (OpenCL / Basic)
+        :param rows: amount of rows in a batch
+        :type rows: int
+        :return: generator of arrays
+        """
+        join = self.Plan.Join(arrays[0][1], arrays[1][1]) if len(arrays) == 2 else None
+
+        if len(arrays) == 2 and hasattr(gpu, "SuperJoin_Stream"):
+            source = gpu.SuperJoin_Stream(arrays[0], arrays[1], rows, join)
+            varsPic = join[0]
+        else:
+            array, varsPic = gpu.SuperJoin(arrays[0], arrays[1], join) if len(arrays) == 2 else arrays[0]
+            array = np.asarray(array)
+            source = (array[start:start + rows] for start in range(0, np.shape(array)[0], rows))
+
+        for batch in source:
+            batch_varsPic = varsPic
+
+            for i in aboveLst:
+                if _IsEmpty(batch):
+                    break
+
+                block = self.Body[i]
+                batch, batch_varsPic = gpu.SelectAbove_Full((batch, batch_varsPic), block.VirtualVarsPic, dataHolder,
+                    block.Predicat, float(block.Notation), True, self.Plan.Select(i, batch_varsPic))
+
+            if not _IsEmpty(batch):
+                yield batch
+
+    def Create_DefinitionZone (self, dataHolder, gpu, pool = None, cache = None):
+        """
+        Executing the fully algorithm of "Definition Zone"
+        :param dataHolder: the data agent
+        :type dataHolder: GAP_Data
+        :param gpu: The relational functions agent (OpenCL / Basic)
+        :param pool: [Optional] thread pool for the blocks, the Select Above blocks and the joins [default = no pool]
+        :type pool: ThreadPoolExecutor
+        :param cache: [Optional] the joins of the interval that are shared with other rules [default = no cache]
+        :type cache: GAP_JoinCache
+        """
+        execute = getattr(gpu, "Execute_Plan", None)
+        if execute is not None:
+            return execute(self.Plan, dataHolder, cache)
+
+        arrays, aboveLst = self.Create_DefinitionZone_Scan(dataHolder, gpu, pool)
+        if len(arrays) == 1 and not isinstance(arrays[0], Future) and _IsEmpty(arrays[0][0]):
+            return arrays[0]
+
+        arrays = self.Create_DefinitionZone_Join(arrays, gpu, 1, pool, cache, dataHolder)
 
         final_idx, final_varsPic = arrays[0]
 
@@ -521,16 +1703,21 @@ class GAP_Rule:
         if len(aboveLst) > 0:
             for i in aboveLst:
                 block = self.Body[i]
+                args = ((final_idx, final_varsPic), block.VirtualVarsPic, dataHolder, block.Predicat,
+                    float(block.Notation), False, self.Plan.Select(i, final_varsPic))
 
-                after = gpu.SelectAbove_Full((final_idx, final_varsPic), block.VirtualVarsPic,
-                    dataHolder.GetData(block.Predicat), float(block.Notation))
+                if pool is not None:
+                    arrays.append(pool.submit(gpu.SelectAbove_Full, *args))
+                    continue
+
+                after = gpu.SelectAbove_Full(*args)
 
                 if _IsEmpty(after[0]):
                     return after
 
                 arrays.append(after)
 
-            arrays = self.Create_DefinitionZone_Join(arrays, gpu)
+            arrays = self.Create_DefinitionZone_Join(arrays, gpu, 1, pool)
             final_idx, final_varsPic = arrays[0]
             final_idx, _vals = gpu.Distinct(final_idx)
 
@@ -538,61 +1725,418 @@ class GAP_Rule:
 
 #endregion
 
+#region GAP Family
+class GAP_Family:
+    """
+    A family of rules with the same join structure - the same body blocks except of the predicats of Select Above
+    blocks, and the same header notation except of its numbers (the coefficients), for example :
+    g1_member(X):0.6*a*b<-g1_member(Y):b&p(Y):1&friend(Y,X):a&p(X):1
+    g1_member(X):0.3*a*b<-g1_member(Y):b&p(Y):1&friend(Y,X):a&q(X):1
+    The "Definition Zone" of the shared blocks is created once, the Select Above blocks that are not shared are masks
+    of its rows, and the header notations of all the rules are evaluated together as vectors (a row of coefficients
+    per rule) - the annotations of the shared blocks are read once for all the rules.
+    """
+
+    def __init__ (self, rules, indexes, blocks):
+        """
+        Initialization
+        :param rules: The rules of the family (GAP_Rule)
+        :type rules: list
+        :param indexes: The indexes of the rules in the compiler
+        :type indexes: list
+        :param blocks: The body blocks of every rule in the order of its signature (_Rule_Signature)
+        :type blocks: list
+        """
+        self.Indexes, self.Headers = indexes, [rule.Header for rule in rules]
+        self.Size = len(rules[0].Dictionary)
+
+        shared = _Family_Shared(blocks)
+        self.Shared = copy.copy(rules[0])
+        self.Shared.Body = [blocks[0][j] for j in shared]
+        self.Plan = self.Shared.Plan = GAP_PhysicalPlan(self.Shared)
+
+        self.Filters = [[lst[j] for j in range(len(lst)) if j not in shared] for lst in blocks]
+        self.Annotations = [block for block in self.Shared.Body if block.Type == BlockType.ANNOTATION]
+
+        template = _Notation_Template(rules[0].Header.Notation)[0]
+        self.Code = compile(template, "<string>", "eval")
+        self.Coefficients = np.array([_Notation_Template(rule.Header.Notation)[1] for rule in rules],
+            dtype = np.float64).reshape(len(rules), -1)
+
+        self.Rows, self.Masks = np.zeros((0, self.Size), dtype = np.int32), np.zeros((len(rules), 0), dtype = bool)
+
+    def Create_DefinitionZone (self, dataHolder, gpu, pool = None, cache = None):
+        """
+        The "Definition Zone" of the shared blocks
+        :param dataHolder: the data agent
+        :type dataHolder: GAP_Data
+        :param gpu: The relational functions agent (OpenCL / Basic)
+        :param pool: [Optional] thread pool for the blocks and the joins [default = no pool]
+        :type pool: ThreadPoolExecutor
+        :param cache: [Optional] the joins of the interval that are shared with other rules [default = no cache]
+        :type cache: GAP_JoinCache
+        :return: (Array, Physical Variables Picture)
+        :rtype: tuple
+        """
+        return self.Shared.Create_DefinitionZone(dataHolder, gpu, pool, cache)
+
+    def Create_Zones (self, zone, dataHolder):
+        """
+        Mask the rows of the "Definition Zone" of the shared blocks by the Select Above blocks of every rule
+        :param zone: The "Definition Zone" of the shared blocks (Array, Physical Variables Picture)
+        :type zone: tuple
+        :param dataHolder: the data agent
+        :type dataHolder: GAP_Data
+        :return: list of the "Definition Zones" of the rules (the columns in the order of the variables)
+        :rtype: list
+        """
+        assigns, varsPic = np.asarray(zone[0]), zone[1]
+        if _IsEmpty(assigns):
+            rows = np.zeros((0, self.Size), dtype = np.int32)
+        else:
+            rows = np.ascontiguousarray(assigns[:, [varsPic[i] for i in range(self.Size)]], dtype = np.int32)
+
+        masks = np.ones((len(self.Filters), np.shape(rows)[0]), dtype = bool)
+        for m in range(len(self.Filters)):
+            for block in self.Filters[m]:
+                data, minimum = dataHolder.GetData(block.Predicat) or { }, float(block.Notation)
+                places = np.flatnonzero(masks[m])
+                keys = map(tuple, block.Create_Keys(rows[places]).tolist())
+                masks[m, places] = [data.get(key, -np.inf) >= minimum for key in keys]
+
+        self.Rows, self.Masks = rows, masks
+        identity = np.arange(self.Size, dtype = np.int32)
+        return [(rows[masks[m]], identity) for m in range(len(self.Filters))]
+
+    def Execute (self, dataHolder, eps = 0.00001, changes = None):
+        """
+        Execute the rules of the family on the rows of the last "Definition Zones" (Create_Zones) - the atoms of every
+        header are merged into the data as arrays (GAP_Data.Upsert)
+        :param dataHolder: the data agent
+        :type dataHolder: GAP_Data
+        :param eps: [Optional] the epsilon of the rules [default = 0.00001]
+        :type eps: float
+        :param changes: [Optional] list of lists per rule - (key, improvement) of every added / changed header atom is
+         appended to the list of its rule
+        :type changes: list
+        :return: list of (amount of added atoms, amount of changed atoms) per rule
+        :rtype: list
+        """
+        data, rows, masks = dataHolder.data, self.Rows, self.Masks
+        names = {"__builtins__": { }}
+
+        for block in self.Annotations:
+            values = data.get(block.Predicat, { })  ## a predicat without atoms has no rows
+            keys = map(tuple, block.Create_Keys(rows).tolist())
+            names[block.Notation] = np.array([values[key] for key in keys], dtype = np.float64)
+        for c in range(np.shape(self.Coefficients)[1]):
+            names["_c{0}".format(c)] = self.Coefficients[:, c:c + 1]
+
+        values = np.broadcast_to(eval(self.Code, names), np.shape(masks))
+        result = []
+
+        for m in range(len(self.Headers)):
+            header, places = self.Headers[m], np.flatnonzero(masks[m])
+
+            added, changed, delta = dataHolder.Upsert(header.Predicat, header.Create_Keys(rows[places]),
+                values[m, places], eps)
+            if changes is not None:
+                changes[m].extend(delta)
+
+            result.append((added, changed))
+
+        return result
+
+#endregion
+
 #region GAP Compiler
 class GAP_Compiler:
     """
     it loads a gap file (of more than 1) and compile the rules to python code
     """
 
-    def __init__ (self, eps = 0.00001):
+    def __init__ (self, eps = 0.00001, workers = 0, cache = None, processes = 0):
         """
         Initialization
         :param eps: epsilon of the gap rules
         :type eps: float
+        :param workers: [Optional] amount of threads for the blocks and the joins of a rule [default = 0 - no threads]
+        :type workers: int
+        :param cache: [Optional] directory of the compiled rules cache (GAP_RuleCache) [default = no cache]
+        :type cache: str
+        :param processes: [Optional] amount of processes that compile the rules (PreRun) [default = 0 - no processes]
+        :type processes: int
         """
         self.Rules = []
+        self.Parser = GAP_Parser()
+        self.Processes = processes
+        self.Cache = GAP_RuleCache(cache) if cache is not None else None
+        self.Families = []  ## GAP_Family - only after Create_Families
+        self.Joins = GAP_JoinCache()  ## the joins that are shared by the rules in an interval (None - not shared)
         self.e = eps
+        self.Workers = workers
+        self.Pool = None
+
+    def Get_Pool (self):
+        """
+        Get the thread pool of the "Definition Zones" (it is created in the first use)
+        :return: The thread pool (None if there are no workers)
+        :rtype: ThreadPoolExecutor
+        """
+        if self.Workers > 0 and self.Pool is None:
+            self.Pool = ThreadPoolExecutor(max_workers = self.Workers)
+        return self.Pool
 
     def Load (self, path):
         """
         load a single gap file into the compiler
+        The file is read lazily and parsed by the registries of the compiler (GAP_Parser). The rules that are in the
+        cache (GAP_RuleCache) are not parsed - they are loaded compiled.
+        The garbage collector is paused while loading - the rules have no cycles, and its collections scan all the
+        rules that were loaded again and again.
         :param path: Gap file path
         :type path: str
         """
-        filer = open(path, "r")
-
-        for line in filer.readlines():
-            rule = GAP_Rule(line)
-            self.Rules.append(rule)
+        collect = gc.isenabled()
+        gc.disable()
+
+        try:
+            for line in self.Parser.Stream(path):
+                rule = self.Cache.Get(line) if self.Cache is not None else None
+                if rule is None:
+                    rule = self.Parser.Rule(line)
+                self.Rules.append(rule)
+        finally:
+            if collect:
+                gc.enable()
 
     def GetPredicats (self):
         """
         Get the predicats avaliable of all the predicats in the all rules
-        :return: list of predicats
+        :return: list of predicats (in the order of their first appearance)
         :rtype: list
         """
-        lst = []
+        return list(dict.fromkeys(itertools.chain.from_iterable(rule.Predicats for rule in self.Rules)))
+
+    def Create_Families (self):
+        """
+        Find the families of rules (GAP_Family) - rules with the same signature whose shared blocks have all the
+        variables of the rule
+        :return: list of GAP_Family
+        :rtype: list
+        """
+        groups = { }
+
+        for i in range(len(self.Rules)):
+            signature, blocks = _Rule_Signature(self.Rules[i])
+            if signature is not None:
+                groups.setdefault(signature, []).append((i, blocks))
+
+        self.Families = []
+        for group in groups.values():
+            if len(group) < 2:
+                continue
+
+            indexes, blocks = [i for i, lst in group], [lst for i, lst in group]
+            shared = [blocks[0][j] for j in _Family_Shared(blocks)]
+            variables = set(v for block in shared for v in block.VirtualVarsPic)
+            if len(variables) < len(self.Rules[indexes[0]].Dictionary):
+                continue  ## the masks are only of the rows of the shared blocks
+
+            self.Families.append(GAP_Family([self.Rules[i] for i in indexes], indexes, blocks))
+
+        return self.Families
 
+    def Create_Batches (self):
+        """
+        Split the rules (in their order) to batches of rules that their "Definition Zones" can be created together -
+        no rule in a batch uses the header predicat of an earlier rule in the batch.
+        The rules of a family (Create_Families) are in the batch of the first rule of the family.
+        :return: list of batches (lists of indexes of rules)
+        :rtype: list
+        """
+        batches, headers = [], set()
+        families = {family.Indexes[0]: family.Indexes for family in self.Families}
+        members = set(i for family in self.Families for i in family.Indexes[1:])
+
+        for i in range(len(self.Rules)):
+            if i in members:
+                continue
+
+            unit = families.get(i, [i])
+            body = [scan[0] for j in unit for scan in self.Rules[j].Plan.Scans]
+
+            if len(batches) == 0 or any(predicat in headers for predicat in body):
+                batches.append([])
+                headers = set()
+
+            batches[-1].extend(unit)
+            headers.update(self.Rules[j].Header.Predicat for j in unit)
+
+        return batches
+
+    def Create_DefinitionZones (self, batch, dataHolder, gpu):
+        """
+        Create the "Definition Zones" of a batch of rules (Create_Batches)
+        :param batch: list of indexes of rules
+        :type batch: list
+        :param dataHolder: the data agent
+        :type dataHolder: GAP_Data
+        :param gpu: The relational functions agent (OpenCL / Basic)
+        :return: list of "Definition Zones"
+        :rtype: list
+        """
+        families = {i: family for family in self.Families for i in family.Indexes}
+        owners, seen = [], set()  ## (the rules and the families of the batch, index of the rule)
+
+        for i in batch:
+            owner = families.get(i, self.Rules[i])
+            if id(owner) not in seen:
+                seen.add(id(owner))
+                owners.append((owner, i))
+
+        execute = getattr(gpu, "Execute_Plans", None)
+        if execute is not None:
+            zones = execute([owner.Plan for owner, i in owners], dataHolder, self.Joins)
+        else:
+            zones = [owner.Create_DefinitionZone(dataHolder, gpu, self.Get_Pool(), self.Joins) for owner, i in owners]
+
+        result = { }
+        for (owner, i), zone in zip(owners, zones):
+            if isinstance(owner, GAP_Family):
+                result.update(zip(owner.Indexes, owner.Create_Zones(zone, dataHolder)))
+            else:
+                result[i] = zone
+
+        return [result[i] for i in batch]
+
+    def Merge_Deltas (self, dataHolder, deltas, eps = None):
+        """
+        Merge the deltas of the rules (Jacobi mode) into the data with max semantics (GAP_Data.Upsert)
+        :param dataHolder: the data agent
+        :type dataHolder: GAP_Data
+        :param deltas: list of the deltas of the rules (key -> annotation), by the indexes of the rules
+        :type deltas: list
+        :param eps: [Optional] epsilon of a change [default = the epsilon of the compiler]
+        :type eps: float
+        :return: (amount of added atoms, amount of changed atoms, list of changed predicats)
+        :rtype: tuple
+        """
+        eps = self.e if eps is None else eps
+        added, changed, predicats = 0, 0, []
+
+        for i in range(len(deltas)):
+            predicat = self.Rules[i].Header.Predicat
+            delta_added, delta_changed, delta = dataHolder.Upsert(predicat, list(deltas[i].keys()),
+                list(deltas[i].values()), eps)
+            added, changed = added + delta_added, changed + delta_changed
+
+            if len(delta) > 0 and predicat not in predicats:
+                predicats.append(predicat)
+
+        return added, changed, predicats
+
+    def Run_FixPoint (self, dataHolder, gpu, families = True):
+        """
+        Run the rules until a fix point on the data of a data holder. The compiled code is executed in its own namespace
+        (MainDict is the data of the data holder), so it does not change the console. The intervals are executed as
+        the intervals of the console (Gauss-Seidel) - the rule families are executed together (GAP_Family), and the
+        joins are shared by the rules (the join cache of the compiler).
+        :param dataHolder: the data agent
+        :type dataHolder: GAP_Data
+        :param gpu: The relational functions agent (OpenCL / Basic)
+        :param families: [Optional] execute the rule families together [default = True]
+        :type families: bool
+        :return: amount of intervals
+        :rtype: int
+        """
+        namespace = {"MainDict": dataHolder.data}
+        zones, changeSet = [None] * len(self.Rules), [(0, 0)] * len(self.Rules)
+
+        self.PreRun()
         for rule in self.Rules:
-            for atom in rule.Predicats:
-                if atom not in lst:
-                    lst.append(atom)
+            exec(rule.Code_Run, namespace)
 
-        return lst
+        if families:
+            self.Create_Families()
+        else:
+            self.Families.clear()
+        firsts = {family.Indexes[0]: family for family in self.Families}
+        members = set(i for family in self.Families for i in family.Indexes[1:])
+
+        intervals, add_fix_point = 0, False
+        while True:
+            added, changed = 0, 0
+            if self.Joins is not None:
+                self.Joins.Clear()
+
+            for batch in self.Create_Batches():
+                if not add_fix_point:
+                    for i, zone in zip(batch, self.Create_DefinitionZones(batch, dataHolder, gpu)):
+                        zones[i] = zone
+
+                for i in batch:
+                    if i in firsts:
+                        family = firsts[i]
+                        for j, result in zip(family.Indexes, family.Execute(dataHolder, self.e)):
+                            changeSet[j] = result
+                    elif i not in members:  ## a member is executed with the first rule of its family
+                        namespace["Rule_{0}".format(i)](zones[i], changeSet, i)
+                    add, change = changeSet[i]
+                    added, changed = added + add, changed + change
+
+                    if add + change > 0:
+                        dataHolder.Touch(self.Rules[i].Header.Predicat)
+
+            if added == 0:
+                if changed == 0:
+                    return intervals
+                add_fix_point = True
+
+            intervals += 1
 
     def PreRun (self):
         """
-        Execute before Running the code on the engine
+        Execute before Running the code on the engine - the rules are compiled with their physical plans, so the
+        "Definition Zones" only execute the plans. The compiled rules are saved in the cache (GAP_RuleCache).
+        The rules are compiled in batches - the code of the rules with the same code (except of their index) is
+        compiled once, with the index 0 (every rule renames its functions), by the processes of the compiler if it has
+        processes. The physical plans of the rules with the same structure share their tables.
         """
-        count = 0
-        for rule in self.Rules:
-            rule.Arrange_Execution(count)
-            count += 1
+        pending = { }  ## code with the index 0 -> indexes of the rules
+        for i in range(len(self.Rules)):
+            rule = self.Rules[i]
+            if rule.Code_Index is None or rule.Code_Index[1] != 0:
+                pending.setdefault(rule.Create_Sources(), []).append(i)
+
+        sources = list(pending.keys())
+        if self.Processes > 0 and len(sources) > 1:
+            size = -(-len(sources) // (self.Processes * 4))  ## 4 batches per process
+            with ProcessPoolExecutor(max_workers = self.Processes) as pool:
+                batches = pool.map(_Compile_Sources, [sources[k:k + size] for k in range(0, len(sources), size)])
+                compiled = [tuple(map(marshal.loads, pair)) for batch in batches for pair in batch]
+        else:
+            compiled = [tuple(compile(source, "<string>", "exec") for source in pair) for pair in sources]
+
+        codes, tables = { }, { }
+        for pair, code in zip(sources, compiled):
+            for i in pending[pair]:
+                codes[i] = code
+
+        for i in range(len(self.Rules)):
+            self.Rules[i].Arrange_Execution(i, codes = codes.get(i), tables = tables)
+
+        if self.Cache is not None:
+            for rule in self.Rules:
+                self.Cache.Put(rule)
+            self.Cache.Save()
 
     def Reset (self):
         """
         Clean all rules from the compiler
         """
         self.Rules.clear()
+        self.Families.clear()
+        self.Parser = GAP_Parser()
 
         #endregion
\ No newline at end of file
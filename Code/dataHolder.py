@@ -3,10 +3,11 @@ __author__ = "Bar Bokovza"
 # region IMPORTS
 from collections import defaultdict
 import csv
+import heapq
 
 import numpy as np
 
-from Code.opencl import Generate_Empty
+from Code.basic import Generate_Empty, Group_Rows, Join_Ranges, Row_Ids
 
 
 # endregion
@@ -14,6 +15,180 @@ from Code.opencl import Generate_Empty
 #region Private Functions
 #endregion
 
+#region GAP Top K
+class GAP_TopK:
+    """
+    Heap of the k atoms with the highest annotations of a predicat. The annotations only rise (max), so an atom that
+    is not in the heap enters it only if it is higher than the lowest atom in the heap.
+    """
+
+    def __init__ (self, k, keys, values):
+        """
+        Initialization
+        :param k: amount of atoms
+        :type k: int
+        :param keys: the keys of the k highest atoms
+        :type keys: list
+        :param values: the annotations of the k highest atoms
+        :type values: list
+        """
+        self.k = k
+        self.members = dict(zip(keys, values))
+        self.heap = [(value, key) for key, value in self.members.items()]
+        heapq.heapify(self.heap)
+
+    def Minimum (self):
+        """
+        :return: the lowest annotation in the heap (None if the heap is empty)
+        :rtype: float
+        """
+        while len(self.heap) > 0 and self.members.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)  ## an older entry of a raised atom
+
+        return self.heap[0][0] if len(self.heap) > 0 else None
+
+    def Raise (self, key, value):
+        """
+        Update the annotation of an atom (added / raised)
+        :param key: the key of the atom
+        :type key: tuple
+        :param value: the annotation
+        :type value: float
+        """
+        if self.k <= 0:
+            return
+
+        if key in self.members:
+            if value <= self.members[key]:
+                return
+        elif len(self.members) >= self.k:
+            if value <= self.Minimum():
+                return
+            del self.members[heapq.heappop(self.heap)[1]]
+
+        self.members[key] = value
+        heapq.heappush(self.heap, (value, key))
+
+        if len(self.heap) > 4 * self.k + 64:
+            self.heap = [(value, key) for key, value in self.members.items()]
+            heapq.heapify(self.heap)
+
+    def Top (self, k):
+        """
+        :param k: amount of atoms (at most the k of the heap)
+        :type k: int
+        :return: list of (key, annotation), from the highest
+        :rtype: list
+        """
+        return sorted(self.members.items(), key = lambda item: item[1], reverse = True)[:k]
+
+#endregion
+
+#region GAP Annotation Index
+class GAP_AnnotationIndex:
+    """
+    Secondary index of a predicat - its atoms sorted by their annotations, so a range of annotations is found by
+    binary search. A raised / added atom is marked as dead in the sorted arrays and kept in a small buffer, the buffer
+    is merged into the sorted arrays when it grows.
+    """
+
+    def __init__ (self, dictionary):
+        """
+        Initialization
+        :param dictionary: the data of the predicat {key: annotation}
+        :type dictionary: dict
+        """
+        self.version, self.width = 0, None  ## width - the arity of the predicat (None until it has an atom)
+        self.Load(dictionary)
+
+    def Load (self, dictionary):
+        """
+        Index all the atoms of the predicat again
+        :param dictionary: the data of the predicat {key: annotation}
+        :type dictionary: dict
+        """
+        self.Build(list(dictionary.keys()), np.fromiter(dictionary.values(), dtype = np.float64,
+            count = len(dictionary)))
+
+    def Build (self, keys, values):
+        """
+        Sort the atoms by their annotations
+        :param keys: list of keys
+        :type keys: list
+        :param values: Values Array
+        :type values: np.ndarray
+        """
+        order = np.argsort(values, kind = "stable")
+        if len(keys) > 0:
+            self.width = len(keys[0])
+
+        self.keys = np.array(keys, dtype = np.int32).reshape((len(keys), self.width or 0))[order]
+        self.values = values[order]
+        self.alive = np.ones(len(keys), dtype = np.bool_)
+        self.position = dict(zip(map(tuple, self.keys.tolist()), range(len(keys))))
+        self.buffer = { }
+        self.version += 1
+
+    def Raise (self, key, value):
+        """
+        Update the annotation of an atom (added / raised)
+        :param key: the key of the atom
+        :type key: tuple
+        :param value: the annotation
+        :type value: float
+        """
+        i = self.position.pop(key, None)
+        if i is not None:
+            self.alive[i] = False
+        elif self.width is None:  ## the first atom of the predicat
+            self.width = len(key)
+            self.keys = self.keys.reshape((0, self.width))
+
+        self.buffer[key] = value
+        self.version += 1
+
+        if len(self.buffer) > max(1024, len(self.values) >> 3):
+            self.Merge()
+
+    def Merge (self):
+        """
+        Merge the buffer into the sorted arrays
+        """
+        keys = [tuple(key) for key in self.keys[self.alive].tolist()] + list(self.buffer.keys())
+        values = np.concatenate([self.values[self.alive], np.fromiter(self.buffer.values(), dtype = np.float64,
+            count = len(self.buffer))])
+        self.Build(keys, values)
+
+    def Range (self, low, high = None):
+        """
+        :param low: the minimum annotation
+        :type low: float
+        :param high: [Optional] the maximum annotation [default = no maximum]
+        :type high: float
+        :return: (Indexes Array, Values Array) of the atoms with annotations in [low, high] - sorted by the annotations
+        :rtype: tuple
+        """
+        start = int(np.searchsorted(self.values, low, side = "left"))
+        end = len(self.values) if high is None else int(np.searchsorted(self.values, high, side = "right"))
+
+        alive = self.alive[start:end]
+        keys, values = self.keys[start:end][alive], self.values[start:end][alive]
+        if len(self.buffer) == 0:
+            return keys, values
+
+        found = [(key, value) for key, value in self.buffer.items() if value >= low and (high is None or value <= high)]
+        if len(found) == 0:
+            return keys, values
+
+        keys = np.concatenate([keys, np.array([key for key, value in found], dtype = np.int32).reshape(
+            (len(found), self.width))])
+        values = np.concatenate([values, np.array([value for key, value in found])])
+
+        order = np.argsort(values, kind = "stable")
+        return keys[order], values[order]
+
+#endregion
+
 #region GAP Data Holder
 class GAP_Data:
     """
@@ -25,6 +200,12 @@ class GAP_Data:
         Initialization
         """
         self.data = defaultdict()
+        self.facts = { }  ## the annotations of the loaded facts - the atoms that are not derived by the rules
+        self.arrays, self.tables = { }, { }
+        self.heaps = { }  ## predicat -> GAP_TopK
+        self.sorted, self.aboves = { }, { }  ## predicat -> GAP_AnnotationIndex, (predicat, minimum) -> keys
+        self.points = { }  ## (predicat, places of the constants) -> (keys, {constants: rows}, {constants: selection})
+        self.versions = defaultdict(int)
 
     def Load (self, path):
         """
@@ -45,14 +226,158 @@ class GAP_Data:
             args = tuple(map(int, record["args"]))
 
             property_dict[args] = annotation
+            self.facts.setdefault(property, { })[args] = annotation
 
         filer.close()
+        self.arrays.clear()
+        self.tables.clear()
+
+        for name in list(self.heaps.keys()):
+            self.Maintain_TopK(name, self.heaps[name].k)
+        for name in list(self.sorted.keys()):
+            self.Index_Annotations(name)
+
+    def Insert (self, path):
+        """
+        Insert the facts of a csv file into the data holder - an annotation of an existing atom is changed only if it
+        is higher (the data of a converged program is kept). The facts of every predicat are merged by Upsert.
+        :param path: csv file path
+        :type path: str
+        :return: {predicat: (amount of added atoms, list of (key, improvement) of the existing atoms)}
+        :rtype: dict
+        """
+        result, batches = { }, { }
+
+        filer = open(path, "r")
+        factsReader = csv.DictReader(filer, fieldnames = ["prop", "annotation"], restkey = "args", restval = 0)
+
+        for record in factsReader:
+            keys, values = batches.setdefault(record["prop"], ([], []))
+            keys.append(tuple(map(int, record["args"])))
+            values.append(float(record["annotation"]))
+
+        filer.close()
+
+        for property, (keys, values) in batches.items():
+            facts = self.facts.setdefault(property, { })  ## a fact below a derived atom is kept for Rollback
+            for key, value in zip(keys, values):
+                facts[key] = max(facts.get(key, 0.0), value)
+
+            added, changed, delta = self.Upsert(property, keys, values)
+            if len(delta) > 0:
+                result[property] = added, delta[added:]
+
+        return result
+
+    def Retract (self, path):
+        """
+        Decrease / delete the facts of a csv file - a fact with annotation 0 is deleted. Only the facts are changed,
+        the atoms themselves are changed by Rollback (after the atoms that were derived from them are found).
+        :param path: csv file path
+        :type path: str
+        :return: {predicat: set of the keys of the decreased / deleted facts}
+        :rtype: dict
+        """
+        result = { }
+
+        filer = open(path, "r")
+        factsReader = csv.DictReader(filer, fieldnames = ["prop", "annotation"], restkey = "args", restval = 0)
+
+        for record in factsReader:
+            facts = self.facts.get(record["prop"], { })
+            annotation = float(record["annotation"])
+            args = tuple(map(int, record["args"]))
+
+            old = facts.get(args)
+            if old is None or annotation >= old:
+                continue
+
+            if annotation > 0:
+                facts[args] = annotation
+            else:
+                del facts[args]
+            result.setdefault(record["prop"], set()).add(args)
+
+        filer.close()
+        return result
+
+    def Rollback (self, atoms):
+        """
+        Set atoms back to the annotations of their facts - atoms that are not facts are deleted
+        :param atoms: {predicat: set of keys}
+        :type atoms: dict
+        """
+        for name, keys in atoms.items():
+            property_dict, facts = self.data.get(name), self.facts.get(name, { })
+            if property_dict is None:
+                continue
+
+            for key in keys:
+                if key in facts:
+                    property_dict[key] = facts[key]
+                else:
+                    property_dict.pop(key, None)
+
+            self.arrays.pop(name, None)  ## the amount of indexes does not tell that indexes were deleted
+            self.tables.pop(name, None)
+            self.Touch(name)
+
+            if name in self.heaps:  ## annotations were decreased
+                self.Maintain_TopK(name, self.heaps[name].k)
+            if name in self.sorted:
+                self.Index_Annotations(name)
 
     def Reset (self):
         """
         Clear all the data
         """
         self.data.clear()
+        self.facts.clear()
+        self.heaps.clear()
+        self.sorted.clear()
+        self.aboves.clear()
+        self.points.clear()
+        self.arrays.clear()
+        self.tables.clear()
+
+    def View (self, predicats):
+        """
+        Create a data holder that shares the atoms (and their arrays) of predicats with this data holder - the
+        predicats must not be changed by the rules that run on the view.
+        :param predicats: list of names of predicats
+        :type predicats: list
+        :return: The new data holder
+        :rtype: GAP_Data
+        """
+        view = GAP_Data()
+
+        for name in predicats:
+            if not name in self.data:
+                continue
+
+            view.data[name], view.versions[name] = self.data[name], self.versions[name]
+            if name in self.facts:
+                view.facts[name] = self.facts[name]
+            if name in self.arrays:
+                view.arrays[name] = self.arrays[name]
+            if name in self.tables:
+                view.tables[name] = self.tables[name]
+            if name in self.sorted:
+                view.sorted[name] = self.sorted[name]
+
+        for key, point in self.points.items():
+            if key[0] in view.data:
+                view.points[key] = point
+
+        return view
+
+    def Touch (self, name):
+        """
+        Mark that the annotations of a predicat were changed (by a rule)
+        :param name: name of the predicat
+        :type name: str
+        """
+        self.versions[name] += 1
 
     def GetData (self, name):
         """
@@ -66,19 +391,302 @@ class GAP_Data:
             return None
         return self.data[name]
 
-    def Generate_NDArray (self, name):
+    def Generate_NDArray (self, name, minValue = None, constants = None):
         """
         Create an array from the indexes of the data of predicat
+        The array is kept until new indexes are added to the predicat, so the same array (and its copy on the
+        OpenCL device) is used again in the next intervals. The array must not be changed in place.
         :param name: Name of predicat
         :type name: str
+        :param minValue: [Optional] only the atoms with annotations >= minValue, if predicat has an annotation index
+         (or if there are constants) [default = all the atoms]
+        :type minValue: float
+        :param constants: [Optional] list of (place, value) - only the atoms with these values, without their columns
+         (see Generate_Selection) [default = no constants]
+        :type constants: list
         :return: Array of Indexes
         :rtype: np.ndarray
         """
+        if constants:
+            return self.Generate_Selection(name, constants, minValue)
+
+        if minValue is not None and name in self.sorted:
+            index = self.sorted[name]
+            version, array = self.aboves.get((name, minValue), (None, None))
+            if version != (id(index), index.version):
+                array = index.Range(minValue)[0]
+                self.aboves[(name, minValue)] = (id(index), index.version), array
+            return array
+
+        dict = self.GetData(name)
+        if dict is None or len(dict) == 0:  ## a predicat without atoms (not loaded / deleted by Rollback)
+            return np.zeros((0, 0), dtype = np.int32)
+
+        if name in self.arrays:
+            count, array = self.arrays[name]
+            if count == len(dict):
+                return array
+
+        array = np.array(list(dict.keys()), dtype = np.int32)
+        self.arrays[name] = len(dict), array
+        return array
+
+    def Generate_Selection (self, name, constants, minValue = None):
+        """
+        Create an array of the indexes of the atoms of predicat with constant values in some places - the columns of
+        the constants are removed.
+        The rows are found by a hash index of the places of the constants (their values -> rows of Generate_NDArray),
+        so only the matching rows are read. The index (and the selections without minValue) are kept until the array
+        of the predicat is created again.
+        :param name: Name of predicat
+        :type name: str
+        :param constants: list of (place, value)
+        :type constants: list
+        :param minValue: [Optional] only the atoms with annotations >= minValue [default = all the atoms]
+        :type minValue: float
+        :return: Array of Indexes
+        :rtype: np.ndarray
+        """
+        dict = self.GetData(name)
+        if dict is None or len(dict) == 0:
+            return np.zeros((0, 0), dtype = np.int32)
+
+        places, values = tuple(c[0] for c in constants), tuple(c[1] for c in constants)
+        array = self.Generate_NDArray(name)
+
+        keys, groups, selections = self.points.get((name, places), (None, None, None))
+        if keys is not array:
+            keys, groups, selections = array, Group_Rows(array[:, list(places)]), { }
+            self.points[(name, places)] = keys, groups, selections
+
+        if minValue is None and values in selections:
+            return selections[values]
+
+        columns = [col for col in range(np.shape(keys)[1]) if col not in places]
+        rows = groups.get(values, np.zeros(0, dtype = np.int64))
+        selection = keys[rows]
+
+        if minValue is not None:
+            annotations = np.array([dict[key] for key in map(tuple, selection.tolist())], dtype = np.float64)
+            return np.ascontiguousarray(selection[annotations >= minValue][:, columns])
+
+        selections[values] = np.ascontiguousarray(selection[:, columns])
+        return selections[values]
+
+    def Generate_Values (self, name):
+        """
+        Create an array of the annotations of predicat, in the order of the rows of Generate_NDArray
+        :param name: Name of predicat
+        :type name: str
+        :return: Values Array
+        :rtype: np.ndarray
+        """
         dict = self.GetData(name)
         if dict is None:
-            return Generate_Empty(np.int32), Generate_Empty(np.float)
+            return Generate_Empty(np.float64)
+
+        return np.fromiter(dict.values(), dtype = np.float64, count = len(dict))
+
+    def TopK (self, name, k):
+        """
+        Get the k atoms with the highest annotations of predicat - from its heap (Maintain_TopK) if it has one,
+        else by a partition of its annotations.
+        :param name: Name of predicat
+        :type name: str
+        :param k: amount of atoms
+        :type k: int
+        :return: (Indexes Array, Values Array) - from the highest annotation
+        :rtype: tuple
+        """
+        dict = self.GetData(name)
+        if dict is None or len(dict) == 0 or k <= 0:
+            return np.zeros((0, 0), dtype = np.int32), Generate_Empty(np.float64)
+
+        heap = self.heaps.get(name)
+        if heap is not None and k <= heap.k:
+            top = heap.Top(k)
+            return np.array([key for key, value in top], dtype = np.int32), np.array([value for key, value in top])
+
+        keys, values = self.Generate_NDArray(name), self.Generate_Values(name)
+        if k < len(values):
+            places = np.argpartition(values, len(values) - k)[len(values) - k:]
+        else:
+            places = np.arange(len(values))
+
+        places = places[np.argsort(values[places])[::-1]]
+        return keys[places], values[places]
+
+    def Maintain_TopK (self, name, k):
+        """
+        Keep a heap of the k atoms with the highest annotations of predicat - it is updated by Raise (the rules)
+        :param name: Name of predicat
+        :type name: str
+        :param k: amount of atoms
+        :type k: int
+        """
+        self.heaps.pop(name, None)
+        keys, values = self.TopK(name, k)
+        self.heaps[name] = GAP_TopK(k, [tuple(key) for key in keys.tolist()], values.tolist())
+
+    def Raise (self, name, changes):
+        """
+        Update the heap of predicat (if it has one) with the atoms that were added / raised by a rule
+        :param name: Name of predicat
+        :type name: str
+        :param changes: list of (key, ...) of the atoms
+        :type changes: list
+        """
+        heap, index = self.heaps.get(name), self.sorted.get(name)
+        if heap is None and index is None:
+            return
+
+        dict = self.data[name]
+        for change in changes:
+            key = tuple(map(int, change[0]))
+            if heap is not None:
+                heap.Raise(key, dict[key])
+            if index is not None:
+                index.Raise(key, dict[key])
+
+    def Upsert (self, name, keys, values, eps = 0.0):
+        """
+        Merge a batch of atoms into predicat with max semantics - the new atoms with positive annotations are added,
+        and an annotation of an existing atom is changed only if the new annotation is higher by eps (at least). The
+        atoms of the batch with the same key are merged first (max).
+        The batch is merged as arrays - the old annotations are found by a join of the keys with the array of the
+        predicat (Generate_NDArray), and the added keys are appended to the array. Only the added / changed atoms are
+        written to the data, and the heap and the annotation index of predicat are updated by them (Raise).
+        :param name: Name of predicat
+        :type name: str
+        :param keys: Array of the keys (a row per atom) / list of keys (tuples)
+        :param values: Values Array - the annotations of the atoms
+        :param eps: [Optional] the minimum rise of an annotation [default = 0 - any rise]
+        :type eps: float
+        :return: (amount of added atoms, amount of changed atoms, list of (key, improvement) - the added atoms first
+         (their improvement is their annotation) and then the changed atoms)
+        :rtype: tuple
+        """
+        values = np.asarray(values, dtype = np.float64)
+        if len(values) == 0:
+            return 0, 0, []
+
+        keys = np.asarray(keys, dtype = np.int32).reshape((len(values), -1))
+        ids = Row_Ids(keys)
+        order = np.lexsort((values, ids))  ## the last annotation of a key is the highest
+        last = np.sort(order[np.r_[ids[order][1:] != ids[order][:-1], True]])
+        keys, values = keys[last], values[last]
+
+        if not name in self.data:
+            self.data[name] = { }
+        target = self.data[name]
+
+        array = self.Generate_NDArray(name)
+        rows, starts, counts = Join_Ranges(keys, array)
+        found = counts > 0
+
+        olds = np.zeros(len(values), dtype = np.float64)
+        olds[found] = self.Generate_Values(name)[rows[starts[found]]]
+        new = ~found & (values > 0)
+        changed = found & (values > olds) & (values >= olds + eps)
+
+        places = np.concatenate([np.flatnonzero(new), np.flatnonzero(changed)])
+        if len(places) == 0:
+            return 0, 0, []
+
+        selected = list(map(tuple, keys[places].tolist()))
+        target.update(zip(selected, values[places].tolist()))
+        delta = list(zip(selected, (values - olds)[places].tolist()))
+
+        added = int(np.count_nonzero(new))
+        if added > 0:  ## the added keys are the last keys of the data
+            array = keys[new] if len(array) == 0 else np.concatenate((array, keys[new]))
+            self.arrays[name] = len(target), array
+
+        self.Raise(name, delta)
+        self.Touch(name)
+
+        return added, len(delta) - added, delta
+
+    def Watched (self, name):
+        """
+        :param name: Name of predicat
+        :type name: str
+        :return: True if predicat has a heap / an annotation index - the changes of the rules are needed (Raise)
+        :rtype: bool
+        """
+        return name in self.heaps or name in self.sorted
+
+    def Index_Annotations (self, name):
+        """
+        Keep an index of the atoms of predicat sorted by their annotations - it is updated by Raise (the rules), and
+        it is used by Range and by the Select Above blocks of the rules
+        :param name: Name of predicat
+        :type name: str
+        """
+        if name in self.sorted:
+            self.sorted[name].Load(self.GetData(name) or { })
+        else:
+            self.sorted[name] = GAP_AnnotationIndex(self.GetData(name) or { })
+
+    def Indexed (self, name):
+        """
+        :param name: Name of predicat
+        :type name: str
+        :return: True if predicat has an annotation index
+        :rtype: bool
+        """
+        return name in self.sorted
+
+    def Range (self, name, low, high = None):
+        """
+        Get the atoms of predicat with annotations in [low, high] - by binary search in its annotation index if it has
+        one, else by a scan of its annotations.
+        :param name: Name of predicat
+        :type name: str
+        :param low: the minimum annotation
+        :type low: float
+        :param high: [Optional] the maximum annotation [default = no maximum]
+        :type high: float
+        :return: (Indexes Array, Values Array) - sorted by the annotations
+        :rtype: tuple
+        """
+        if name in self.sorted:
+            return self.sorted[name].Range(low, high)
+
+        dict = self.GetData(name)
+        if dict is None or len(dict) == 0:
+            return np.zeros((0, 0), dtype = np.int32), Generate_Empty(np.float64)
+
+        keys, values = self.Generate_NDArray(name), self.Generate_Values(name)
+        places = np.flatnonzero((values >= low) & (values <= high if high is not None else True))
+        places = places[np.argsort(values[places], kind = "stable")]
+        return keys[places], values[places]
+
+    def Generate_Table (self, name):
+        """
+        Create a table of the data of predicat - the indexes sorted (lexicographic) and their annotations.
+        The table is kept until the predicat is changed (Touch) or new indexes are added to it.
+        :param name: Name of predicat
+        :type name: str
+        :return: (Sorted Indexes Array, Values Array)
+        :rtype: tuple
+        """
+        dict = self.GetData(name)
+        if dict is None or len(dict) == 0:
+            return np.zeros((0, 0), dtype = np.int32), Generate_Empty(np.float32)
+
+        version = self.versions[name], len(dict)
+        if name in self.tables:
+            tableVersion, table = self.tables[name]
+            if tableVersion == version:
+                return table
+
+        keys = self.Generate_NDArray(name)
+        keys = keys[np.lexsort(keys.T[::-1])]
+        values = np.array([dict[tuple(key)] for key in keys.tolist()], dtype = np.float32)
 
-        return np.array(list(dict.keys()), dtype = np.int32)
+        self.tables[name] = version, (keys, values)
+        return keys, values
 
 #endregion
 
@@ -0,0 +1,355 @@
+__author__ = "Bar Bokovza"
+
+#region Imports
+from time import perf_counter
+
+import numpy as np
+
+from Code.basic import Create_VarsPic_Places, Create_VarsPic_Physical, Create_VarsPic_Join
+#endregion
+
+#region Private Functions
+def _Rows (array):
+    """
+    :param array: an array (host / device)
+    :return: amount of rows in the array
+    :rtype: int
+    """
+    return int(np.shape(array)[0])
+
+def _Size (array):
+    """
+    :param array: an array (host / device)
+    :return: amount of items in the array
+    :rtype: int
+    """
+    return int(np.prod(np.shape(array)))
+
+def _Host (array):
+    """
+    Get the array in the memory of the host (device arrays are read, numpy arrays are returned as is)
+    :param array: an array (host / device)
+    :return: The host array
+    :rtype: np.ndarray
+    """
+    if array is None or isinstance(array, np.ndarray):
+        return array
+    return np.asarray(array)
+
+#endregion
+
+#region GAP Cost Model
+class GAP_CostModel:
+    """
+    Linear cost model of an operator on an engine : time = fixed + rate * work
+    The model is fitted by least squares on the observed timings, older observations decay
+    so the model follows the engine (warm caches, other load on the device...).
+    """
+
+    def __init__ (self, decay = 0.95):
+        """
+        Initialization
+        :param decay: the weight of the older observations in every new observation
+        :type decay: float
+        """
+        self.decay = decay
+        self.n, self.sx, self.sy, self.sxx, self.sxy = 0.0, 0.0, 0.0, 0.0, 0.0
+        self.fixed, self.rate = 0.0, 0.0
+
+    def Observe (self, work, seconds):
+        """
+        Add an observed timing to the model
+        :param work: the amount of work of the call
+        :type work: float
+        :param seconds: the time it took
+        :type seconds: float
+        """
+        d = self.decay
+        self.n = self.n * d + 1
+        self.sx = self.sx * d + work
+        self.sy = self.sy * d + seconds
+        self.sxx = self.sxx * d + work * work
+        self.sxy = self.sxy * d + work * seconds
+
+        det = self.n * self.sxx - self.sx * self.sx
+        if det > 1e-12 * max(1.0, self.sxx * self.n):
+            self.rate = max(0.0, (self.n * self.sxy - self.sx * self.sy) / det)
+            self.fixed = max(0.0, (self.sy - self.rate * self.sx) / self.n)
+        else:
+            self.rate = self.sy / self.sx if self.sx > 0 else 0.0
+            self.fixed = 0.0 if self.sx > 0 else self.sy / self.n
+
+    def Estimate (self, work):
+        """
+        :param work: the amount of work of a call
+        :type work: float
+        :return: the estimated time of the call in seconds
+        :rtype: float
+        """
+        return self.fixed + self.rate * work
+
+    def __repr__ (self):
+        return "{0:.3g}s + {1:.3g}s * work".format(self.fixed, self.rate)
+
+#endregion
+
+#region GAP Dispatch
+class GAP_Dispatch:
+    """
+    Execution agent that routes every relational function to the cheaper engine (GAP_Basic / GAP_OpenCL).
+    The choice is done by a cost model per (function, engine) that is calibrated by a micro-benchmark
+    and refined from the timings of a sample of the calls. Some of the calls are sent to the other engine, so the
+    model of the engine that is not chosen is refined too.
+    """
+
+    Operators = ["SuperJoin", "Cartesian", "Filter", "Projection", "Distinct", "SelectAbove"]
+
+    def __init__ (self, cpu, gpu, calibrate = True, sample = 8, explore = 32):
+        """
+        Initialization
+        :param cpu: The CPU agent
+        :type cpu: GAP_Basic
+        :param gpu: The OpenCL agent
+        :type gpu: GAP_OpenCL
+        :param calibrate: [Optional] run the micro-benchmark now [default = True]
+        :type calibrate: bool
+        :param sample: [Optional] every sample-th call of a function is timed (the device is synchronized only for
+         the timed calls) [default = 8]
+        :type sample: int
+        :param explore: [Optional] every explore-th call of a function runs on the engine that is not chosen, and is
+         timed [default = 32]
+        :type explore: int
+        """
+        self.engines = {"cpu": cpu, "gpu": gpu}
+        self.models = {(op, name): GAP_CostModel() for op in self.Operators for name in self.engines}
+        self.counts = {(op, name): 0 for op in self.Operators for name in self.engines}
+        self.calls = {op: 0 for op in self.Operators}
+        self.sample, self.explore = sample, explore
+
+        if calibrate:
+            self.Calibrate()
+
+    def Run (self, op, work, name, args, observe = True):
+        """
+        Execute a function on an engine and observe its timing
+        :param op: name of the function
+        :type op: str
+        :param work: the amount of work of the call
+        :type work: float
+        :param name: "cpu" / "gpu"
+        :type name: str
+        :param args: the arguments of the function (arrays are moved to the host for the CPU)
+        :type args: tuple
+        :param observe: [Optional] time the call and add the timing to the cost model - the device is synchronized
+         before and after the call [default = True]
+        :type observe: bool
+        :return: the result of the function
+        """
+        engine = self.engines[name]
+        self.counts[(op, name)] += 1
+        if not observe:
+            return getattr(engine, op)(*args)
+
+        if name == "gpu":
+            engine.queue.finish()  ## the timing is of this call only
+        start = perf_counter()
+
+        result = getattr(engine, op)(*args)
+        if name == "gpu":
+            engine.queue.finish()
+
+        self.models[(op, name)].Observe(work, perf_counter() - start)
+        return result
+
+    def Choose (self, op, work):
+        """
+        :param op: name of the function
+        :type op: str
+        :param work: the amount of work of the call
+        :type work: float
+        :return: the engine with the lower estimated time ("cpu" / "gpu")
+        :rtype: str
+        """
+        cpu, gpu = self.models[(op, "cpu")].Estimate(work), self.models[(op, "gpu")].Estimate(work)
+        return "cpu" if cpu <= gpu else "gpu"
+
+    def Dispatch (self, op, work, args, hostArgs):
+        """
+        Execute a function on the cheaper engine - every explore-th call runs on the other engine, and only a sample
+        of the calls is timed
+        :param op: name of the function
+        :param work: the amount of work of the call
+        :param args: the arguments of the function
+        :param hostArgs: the arguments of the function for the CPU engine
+        :return: the result of the function
+        """
+        self.calls[op] += 1
+        count = self.calls[op]
+
+        name = self.Choose(op, work)
+        explore = self.explore > 0 and count % self.explore == 0
+        if explore:
+            name = "gpu" if name == "cpu" else "cpu"
+
+        observe = explore or (self.sample > 0 and count % self.sample == 0)
+        return self.Run(op, work, name, hostArgs() if name == "cpu" else args, observe)
+
+    def Calibrate (self, repeat = 2):
+        """
+        Micro-benchmark of the functions on both engines, 2 sizes per function to fit the fixed and the rate parts.
+        :param repeat: amount of executions per size (the first execution is a warm up and is not observed)
+        :type repeat: int
+        """
+        random = np.random.RandomState(0)
+
+        a_varsPic, b_varsPic = np.array([0, 1, -1], dtype = np.int32), np.array([-1, 0, 1], dtype = np.int32)
+        c_varsPic = np.array([-1, -1, 0], dtype = np.int32)
+
+        for name, engine in self.engines.items():
+            for rows in [16, 64]:
+                a = random.randint(0, rows, (rows, 2)).astype(np.int32)
+                b = random.randint(0, rows, (rows, 2)).astype(np.int32)
+                c = random.randint(0, rows, (rows, 1)).astype(np.int32)
+
+                join_varsPic, _joinLst = Create_VarsPic_Join(a_varsPic, c_varsPic)
+
+                for i in range(repeat + 1):
+                    self.Run("SuperJoin", rows * rows, name, ((a, a_varsPic), (b, b_varsPic)), i > 0)
+                    self.Run("Cartesian", rows * rows, name, ((a, a_varsPic), (c, c_varsPic), join_varsPic), i > 0)
+
+            for rows in [256, 2048]:
+                a = random.randint(0, 16, (rows, 2)).astype(np.int32)
+                values = random.rand(rows).astype(np.float32)
+
+                for i in range(repeat + 1):
+                    self.Run("Filter", rows * 2, name, ((a, a_varsPic), [(0, 1)]), i > 0)
+                    self.Run("Projection", rows * 2, name, (a, [1, 0]), i > 0)
+                    self.Run("Distinct", rows * 2, name, (a, None), i > 0)
+                    self.Run("SelectAbove", rows * 2, name, ((a, values), 0.5), i > 0)
+
+    def Statistics (self):
+        """
+        :return: {function: {engine: (amount of calls, cost model)}}
+        :rtype: dict
+        """
+        result = { }
+        for op in self.Operators:
+            result[op] = {name: (self.counts[(op, name)], self.models[(op, name)]) for name in self.engines}
+        return result
+
+    #region Relational Functions
+    def Cartesian (self, a, b, join_varsPic, result_col = None):
+        """
+        Implement Cartesian Multiplication between relations
+        :param a: (Array, Physical Variables Pictures of the array)
+        :type a:tuple
+        :param b: (Array, Physical Variables Pictures of the array)
+        :type b:tuple
+        :param join_varsPic: Physical Variables Pictures of the demanded array
+        :type join_varsPic: np.ndarray
+        :param result_col: [Optional] amount of columns of the demanded array [default = by join_varsPic]
+        :type result_col: int
+        :return: (Array, join_varsPic)
+        :rtype: tuple
+        """
+        return self.Dispatch("Cartesian", _Rows(a[0]) * _Rows(b[0]), (a, b, join_varsPic, result_col),
+            lambda: ((_Host(a[0]), a[1]), (_Host(b[0]), b[1]), join_varsPic, result_col))
+
+    def SelectAbove (self, data, minValue):
+        """
+        Implement Projection[Indexes] { Selection [Value >= minValue] {indexes, values}}
+        :param data: (Indexes Array, Values Array)
+        :type data: tuple
+        :param minValue: the minimum value of items that we demanded
+        :type minValue: float
+        :return: Indexes Array
+        """
+        return self.Dispatch("SelectAbove", _Size(data[0]), (data, minValue),
+            lambda: ((_Host(data[0]), _Host(data[1])), minValue))
+
+    def Filter (self, a, matches, places = None):
+        """
+        Implement Selection [List of (Field1 = Field2) connected with AND] {array}
+        :param a: (Array, Physical Variables Picture)
+        :type a:tuple
+        :param matches: list of matches
+        :type matches: list
+        :param places: [Optional] the columns that are left [default = created by the matches]
+        :type places: list
+        :return: (Array, Physical Variables Picture)
+        :rtype: tuple
+        """
+        return self.Dispatch("Filter", _Size(a[0]), (a, matches, places),
+            lambda: ((_Host(a[0]), a[1]), matches, places))
+
+    def Projection (self, data, projectionLst):
+        """
+        Implement Projection [list]
+        :param data: Array
+        :param projectionLst: List of demanded fields
+        :type projectionLst:list
+        :return: Array of projected Array (+duplicates)
+        """
+        return self.Dispatch("Projection", _Size(data), (data, projectionLst), lambda: (_Host(data), projectionLst))
+
+    def SuperJoin (self, a, b, join = None):
+        """
+        Implement Join between two tables.
+        :param a: (Array, Physical Variables Picture)
+        :type a: tuple
+        :param b: (Array, Physical Variables Picture)
+        :type b: tuple
+        :param join: [Optional] the precomputed metadata of the join (GAP_PhysicalPlan) [default = by the pictures]
+        :type join: tuple
+        :return: (Joined Array, Joined Physical Variables Picture)
+        :rtype: tuple
+        """
+        return self.Dispatch("SuperJoin", _Rows(a[0]) * _Rows(b[0]), (a, b, join),
+            lambda: ((_Host(a[0]), a[1]), (_Host(b[0]), b[1]), join))
+
+    def Distinct (self, array, dictionary = None):
+        """
+        Implement Distinct on an array
+        :param array: An array
+        :param dictionary: [Optional] if dictionary exist, the function will return also the values for the distinct
+         entries
+        :type dictionary: dict
+        :return: (Indexes Array, Values Array)
+        :rtype: tuple
+        """
+        return self.Dispatch("Distinct", _Size(array), (array, dictionary), lambda: (_Host(array), dictionary))
+
+    def SelectAbove_Full (self, a, virtual_places, dataHolder, predicat, minValue, toJoin = False, places = None):
+        """
+        Execution the Full process of Select Above - every step is dispatched by itself
+        :param a: (Array, Physical Variables Picture)
+        :param virtual_places:
+        :param dataHolder: The data agent to get the data from.
+        :param predicat: The predicat of the block
+        :param minValue: The minimum value
+        :param toJoin: [Optional] if to join to the original array [default = FALSE]
+        :param places: [Optional] (physical places, Physical Variables Picture of the places, metadata of the join) -
+         precomputed by GAP_PhysicalPlan [default = created by the pictures]
+        :return:
+        """
+        data = dataHolder.GetData(predicat)
+        a_array, a_valsPic = a
+        if places is None:
+            places = Create_VarsPic_Places(a_valsPic, virtual_places), Create_VarsPic_Physical(virtual_places,
+                np.shape(a_valsPic)[0]), None
+        physical_places, places_valsPic, join = places
+
+        projection_array = self.Projection(a_array, physical_places)
+        distinct_array = self.Distinct(projection_array, data)
+
+        if _Rows(distinct_array[0]) == 0:
+            return np.zeros((0, len(physical_places)), dtype = np.int32), places_valsPic
+
+        select_idx = self.SelectAbove(distinct_array, minValue)
+
+        if toJoin:
+            return self.SuperJoin(a, (select_idx, places_valsPic), join)
+        return select_idx, places_valsPic
+    #endregion
+
+#endregion
@@ -0,0 +1,201 @@
+__author__ = "Bar Bokovza"
+
+#region Imports
+from Code.compiler import GAP_Compiler, GAP_JoinCache, GAP_Rule, _IsConstant
+#endregion
+
+#region Private Functions
+def _Parse_Atom (atom):
+    """
+    Gets a ground atom in shape predicat(args) and return (predicat, key)
+    :param atom: ground atom, for example : g1_member(42)
+    :type atom: str
+    :return: (predicat:str, key:tuple of ints)
+    :rtype: tuple
+    :raise ValueError: The atom [atom] is not a ground atom
+    """
+    text = atom.replace(" ", "").replace(")", "")
+    if text.count("(") != 1:
+        raise ValueError("The atom '" + atom + "' is not a ground atom")
+
+    predicat, args = text.split("(")
+
+    try:
+        return predicat, tuple(int(arg) for arg in args.split(","))
+    except ValueError:
+        raise ValueError("The atom '" + atom + "' is not a ground atom")
+
+def _Adorned (predicat, adornment):
+    """
+    :return: name of the adorned predicat ("b" - bound argument, "f" - free argument)
+    :rtype: str
+    """
+    return "{0}_{1}".format(predicat, adornment)
+
+def _Magic (predicat, adornment):
+    """
+    :return: name of the magic predicat of an adorned predicat (holds the demanded bound arguments)
+    :rtype: str
+    """
+    return "magic_{0}_{1}".format(predicat, adornment)
+
+def _Block_Text (predicat, args, notation):
+    """
+    :return: text of a block of a GAP rule
+    :rtype: str
+    """
+    return "{0}({1}):{2}".format(predicat, ",".join(args), notation)
+
+#endregion
+
+#region GAP Magic
+class GAP_Magic:
+    """
+    Goal directed queries - the rules of a compiler are rewritten by magic sets, so only the atoms that are relevant to
+    the bound arguments of the query are derived.
+    Every predicat of a header is adorned by its bound / free arguments, and the magic predicat of an adorned predicat
+    holds the bound arguments that are demanded. The bindings are passed from the header to the body blocks (sideways),
+    the blocks of the data first. The constants of the blocks are bound arguments.
+    """
+
+    def __init__ (self, compiler):
+        """
+        Initialization
+        :param compiler: The compiler with the rules
+        :type compiler: GAP_Compiler
+        """
+        self.compiler = compiler
+        self.Derived = set(rule.Header.Predicat for rule in compiler.Rules)
+
+    def Order (self, body, bound):
+        """
+        The order of the body blocks for passing the bindings - the blocks of the data with the most bound arguments
+        first, then the derived blocks with bound arguments, then the rest.
+        :param body: list of GAP_Block
+        :param bound: set of the bound variables
+        :return: list of GAP_Block
+        :rtype: list
+        """
+        result, rest, bound = [], list(body), set(bound)
+
+        while len(rest) > 0:
+            def Score (block):
+                count = sum(1 for arg in block.Arguments if arg in bound or _IsConstant(arg))
+                return count > 0, block.Predicat not in self.Derived, count
+
+            block = max(rest, key = Score)
+            rest.remove(block)
+            result.append(block)
+            bound.update(block.Arguments)
+
+        return result
+
+    def Rewrite (self, goals):
+        """
+        Rewrite the rules for the goals
+        A magic rule without a body is a magic atom of constants (a fact).
+        :param goals: list of (predicat, adornment)
+        :type goals: list
+        :return: list of rules (str)
+        :rtype: list
+        """
+        result, done, queue = [], set(), list(goals)
+
+        while len(queue) > 0:
+            predicat, adornment = queue.pop()
+            if (predicat, adornment) in done:
+                continue
+            done.add((predicat, adornment))
+
+            for rule in self.compiler.Rules:
+                if rule.Header.Predicat != predicat:
+                    continue
+
+                head = rule.Header.Arguments
+                bound = set(head[k] for k in range(len(head)) if adornment[k] == "b")
+
+                body = []
+                if "b" in adornment:
+                    body.append(_Block_Text(_Magic(predicat, adornment),
+                        [head[k] for k in range(len(head)) if adornment[k] == "b"], "1"))
+
+                for block in self.Order(rule.Body, bound):
+                    args = block.Arguments
+
+                    if block.Predicat in self.Derived:
+                        inner = "".join("b" if arg in bound or _IsConstant(arg) else "f" for arg in args)
+                        if "b" in inner:
+                            magic = _Block_Text(_Magic(block.Predicat, inner),
+                                [args[k] for k in range(len(args)) if inner[k] == "b"], "1")
+                            text = "{0}<-{1}".format(magic, "&".join(body))
+                            if text not in result:
+                                result.append(text)
+
+                        queue.append((block.Predicat, inner))
+                        body.append(_Block_Text(_Adorned(block.Predicat, inner), args, block.Notation))
+                    else:
+                        body.append(_Block_Text(block.Predicat, args, block.Notation))
+
+                    bound.update(args)
+
+                result.append("{0}<-{1}".format(_Block_Text(_Adorned(predicat, adornment), head,
+                    rule.Header.Notation), "&".join(body)))
+
+        return result
+
+    def Query (self, atoms, dataHolder, gpu, families = True, share = True):
+        """
+        Derive the annotations of ground atoms. The rewritten rules run as the rules of the console - with the rule
+        families and the join cache.
+        :param atoms: list of ground atoms (str), for example : ["g1_member(42)", "g1_member(7)"]
+        :type atoms: list
+        :param dataHolder: the data agent (its atoms are not changed)
+        :type dataHolder: GAP_Data
+        :param gpu: The relational functions agent (OpenCL / Basic)
+        :param families: [Optional] execute the rule families together [default = True]
+        :type families: bool
+        :param share: [Optional] share the joins of the rules in an interval [default = True]
+        :type share: bool
+        :return: list of the annotations of the atoms (0 if they are not derived)
+        :rtype: list
+        """
+        parsed = [_Parse_Atom(atom) for atom in atoms]
+        goals = []
+
+        for predicat, key in parsed:
+            if predicat in self.Derived and (predicat, "b" * len(key)) not in goals:
+                goals.append((predicat, "b" * len(key)))
+
+        rules = self.Rewrite(goals)
+        compiler = GAP_Compiler(self.compiler.e)
+        compiler.Rules = [GAP_Rule(rule) for rule in rules if not rule.endswith("<-")]
+        compiler.Joins = GAP_JoinCache() if share else None
+
+        data = dataHolder.View([predicat for predicat in dataHolder.data.keys() if predicat not in self.Derived])
+        for rule in compiler.Rules:
+            for predicat in rule.Predicats:
+                if predicat in data.data:
+                    continue
+
+                base = predicat.rsplit("_", 1)[0]
+                data.data[predicat] = { } if predicat.startswith("magic_") else dict(dataHolder.facts.get(base, { }))
+
+        for predicat, key in parsed:
+            if predicat in self.Derived:
+                data.data.setdefault(_Magic(predicat, "b" * len(key)), { })[key] = 1.0
+
+        for rule in rules:
+            if rule.endswith("<-"):
+                predicat, key = _Parse_Atom(rule.split(":")[0])
+                data.data.setdefault(predicat, { })[key] = 1.0
+
+        compiler.Run_FixPoint(data, gpu, families)
+
+        result = []
+        for predicat, key in parsed:
+            name = _Adorned(predicat, "b" * len(key)) if predicat in self.Derived else predicat
+            result.append(data.data.get(name, { }).get(key, 0.0))
+
+        return result
+
+#endregion
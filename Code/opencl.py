@@ -1,118 +1,195 @@
 __author__ = "Bar Bokovza"
 
 #region Imports
+from collections import defaultdict
+import hashlib
+import os
+import threading
+import weakref
+
 import opencl4py as cl
 import numpy as np
+
+from Code.basic import GAP_Stream, Set_Argument, Create_VarsPic_Join, Length_VarsPic, \
+    Create_VarsPic_Places, Create_Filter_Places, Create_VarsPic_Physical, Create_Columns_Join
 #endregion
 
 #region Private Functions
-def Generate_Empty (dtype):
-    """
-    "Create empty numpy array
-    :param dtype: the dtype of the array
-    :return: empty array
-    """
-    return np.zeros(0, dtype = dtype)
+#endregion
 
-def Set_Argument (kernel, idx, value, dataType = np.int32):
+#region GAP Device Memory
+class GAP_BufferPool:
     """
-    Set an primitive type variable as an argument to a kernel
-    :param kernel: The kernel to set the argument on
-    :param idx: The index of the argument. (index of first argument in the kernel = 0)
-    :param value: the value of the variable
-    :param dataType: the type of the variable
-    :rtype: void
+    Pool of OpenCL buffers, arranged by size classes (powers of 2).
+    Released buffers are kept and handed again to the next allocation of the same size class.
     """
-    kernel.set_arg(idx, np.array([value], dtype = dataType))
 
-def Create_VarsPic_Join (a, b):
-    """
-    Create a joined physical Variable Picture based on 2 Physical Variable Pictures.
-    :param a: The physical Variable Picture of the first array
-    :type a: np.ndarray
-    :param b: The physical Variable Picture of the second array
-    :type b: np.ndarray
-    :return: Joined Physical Variable Picture
-    :rtype: np.ndarray
-    """
-    a_row, b_row = np.shape(a)[0], np.shape(b)[0]
+    def __init__ (self, context, minimum = 64):
+        """
+        Initialization
+        :param context: The OpenCL context to allocate the buffers on
+        :param minimum: The smallest size class in bytes
+        :type minimum: int
+        """
+        self.context = context
+        self.minimum = minimum
+        self.free = defaultdict(list)
 
-    if a_row != b_row:
-        zero = np.zeros(0, dtype = np.int32)
-        return zero, zero
+    def SizeClass (self, nbytes):
+        """
+        Get the size class of an allocation
+        :param nbytes: amount of bytes demanded
+        :type nbytes: int
+        :return: amount of bytes that will be allocated
+        :rtype: int
+        """
+        size = self.minimum
+        while size < nbytes:
+            size <<= 1
+        return size
 
-    result = np.zeros(a_row, dtype = np.int32)
-    result.fill(-1)
-    count = 0
-    joinLst = []
+    def Allocate (self, nbytes):
+        """
+        Get a buffer with at least nbytes bytes
+        :param nbytes: amount of bytes demanded
+        :type nbytes: int
+        :return: (buffer, size class)
+        :rtype: tuple
+        """
+        size = self.SizeClass(nbytes)
 
-    for i in range(a_row):
-        a_val, b_val = a[i], b[i]
-        if a_val == -1 and b_val == -1:
-            result[i] = -1
-        else:
-            result[i] = count
-            count = count + 1
+        try:
+            return self.free[size].pop(), size
+        except IndexError:
+            return self.context.create_buffer(cl.CL_MEM_READ_WRITE, size = size), size
 
-        if a_val != -1 and b_val != -1:
-            joinLst.append(i)
+    def Release (self, buffer, size):
+        """
+        Return a buffer to the pool
+        :param buffer: The buffer
+        :param size: The size class of the buffer
+        :type size: int
+        """
+        self.free[size].append(buffer)
 
-    return result, np.array(joinLst, dtype = np.int32)
+    def Clear (self):
+        """
+        Drop all the free buffers of the pool
+        """
+        self.free.clear()
 
-def Length_VarsPic (varsPic):
+class GAP_DeviceArray:
     """
-    Evaluate how many variables are in the array, based on the Physical Variables Picture.
-    :param varsPic: Physical Variables Picture of an array.
-    :type varsPic: np.ndarray
-    :return: amount of variables avaliable based on the Physical Variables Picture.
-    :rtype: int
+    Array that is resident in the memory of the OpenCL device.
+    The host copy is created only when it is demanded (Host / iteration / np.asarray).
     """
-    size = 0
 
-    for item in varsPic:
-        if item is not -1:
-            size = size + 1
+    def __init__ (self, owner, shape, dtype = np.int32, host = None):
+        """
+        Initialization - allocate the buffer from the pool of the owner
+        :param owner: The GAP_OpenCL that owns the buffer
+        :type owner: GAP_OpenCL
+        :param shape: The shape of the array
+        :type shape: tuple
+        :param dtype: The dtype of the array
+        :param host: [Optional] initial content of the array (the array will be uploaded)
+        :type host: np.ndarray
+        """
+        self.owner = owner
+        self.shape = tuple(int(item) for item in shape)
+        self.dtype = np.dtype(dtype)
+        self.host, self.reading = None, None
+        self.lock = threading.Lock()
+        self.buffer, self.capacity = owner.pool.Allocate(max(self.nbytes, 1))
+
+        if host is not None and self.nbytes > 0:
+            host = np.ascontiguousarray(host, dtype = self.dtype)
+            owner.Write(self.buffer, host, self.nbytes)
+
+    @property
+    def nbytes (self):
+        """
+        :return: amount of bytes in use by the array
+        :rtype: int
+        """
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def Host (self):
+        """
+        Get the host copy of the array (read it from the device in the first demand)
+        :return: The array
+        :rtype: np.ndarray
+        """
+        with self.lock:
+            if self.reading is not None:
+                self.reading.wait()
+                self.reading = None
 
-    return size
+            if self.host is None:
+                self.host = np.zeros(self.shape, dtype = self.dtype)
+                if self.nbytes > 0:
+                    self.owner.queue.read_buffer(self.buffer, self.host, size = self.nbytes)
 
-def Create_VarsPic_Virtual (varsPic, places):
-    """
-    Create a list of pysical places based on list "places" and the Physical Variables Picture of an array.
-    :param varsPic: A Physical Variables Picture of an array
-    :type: varsPic: np.ndarray
-    :param places: List of numbers of variables
-    :type: list
-    :return: List of Physical places in the array.
-    :rtype: list
-    """
-    result = []
+            return self.host
+
+    def Prefetch (self):
+        """
+        Start reading the host copy of the array without waiting for it (Host will wait for the read)
+        """
+        with self.lock:
+            if self.host is None and self.reading is None:
+                self.host = np.zeros(self.shape, dtype = self.dtype)
+                if self.nbytes > 0:
+                    self.reading = self.owner.queue.read_buffer(self.buffer, self.host, blocking = False,
+                        size = self.nbytes, need_event = True)
+
+    def Read_Item (self, index):
+        """
+        Read a single item of the array from the device
+        :param index: the index of the item (in the flat array)
+        :type index: int
+        :return: The item
+        """
+        item = np.zeros(1, dtype = self.dtype)
+        self.owner.queue.read_buffer(self.buffer, item, size = self.dtype.itemsize,
+            offset = index * self.dtype.itemsize)
+        return item[0]
+
+    def Resize (self, rows):
+        """
+        Shrink the amount of rows of the array (the buffer is not changed)
+        :param rows: the new amount of rows
+        :type rows: int
+        :return: self
+        :rtype: GAP_DeviceArray
+        """
+        if self.reading is not None:
+            self.reading.wait()
+            self.reading = None
 
-    for place in places:
-        result.append(varsPic[place])
+        self.shape = (int(rows),) + self.shape[1:]
+        self.host = None
+        return self
 
-    return result
+    def __array__ (self, dtype = None, copy = None):
+        if dtype is None:
+            return self.Host()
+        return self.Host().astype(dtype)
 
-def Create_VarsPic_Physical (lst, size):
-    """
-    Create Physical Variables Picture from a Virtual Variables Picture
-    :param lst: A Virtual Variables Picture
-    :type lst: list
-    :param size: An amount of variables in the rule
-    :type size: int
-    :return: A Physical Variables Picture
-    :rtype: np.ndarray
-    """
-    result = np.zeros(size, dtype = np.int32)
-    result.fill(-1)
+    def __iter__ (self):
+        return iter(self.Host())
 
-    count = 0
+    def __len__ (self):
+        return self.shape[0]
 
-    for ptr in lst:
-        if result[ptr] == -1:
-            result[ptr] = count
-            count = count + 1
+    def __del__ (self):
+        if getattr(self, "reading", None) is not None:
+            self.reading.wait()
 
-    return result
+        ## in a collected reference cycle the buffer may be released before the array
+        if getattr(self, "buffer", None) is not None and self.buffer.handle is not None:
+            self.owner.pool.Release(self.buffer, self.capacity)
+        self.buffer = None
 
 #endregion
 
@@ -120,32 +197,328 @@ def Create_VarsPic_Physical (lst, size):
 class GAP_OpenCL:
     """
     Implementation of the rational functions in OpenCL
+    The results of the functions stay on the device (GAP_DeviceArray) until the host demands them.
     """
 
-    def __init__ (self, path = "External/OpenCL/Commands.cl"):
+    def __init__ (self, path = "External/OpenCL/Commands.cl", platform = 0, device = None, cache = None,
+            asynchronous = False):
         """
         Initialization
         :param path: path of the commands file
         :type path: str
+        :param platform: index of the OpenCL platform
+        :type platform: int
+        :param device: [Optional] index of the device in the platform [default = the first GPU, else the first device]
+        :type device: int
+        :param cache: [Optional] directory of the compiled programs cache [default = no cache]
+        :type cache: str
+        :param asynchronous: [Optional] non-blocking uploads, and the results of Execute_Plans are read in the
+         background [default = False]
+        :type asynchronous: bool
         """
         platforms = cl.Platforms()
-        self.platform = platforms.platforms[0]
+        self.platform = platforms.platforms[platform]
 
         devices = self.platform.devices
-        self.device = devices[1]
+        if device is None:
+            gpus = [item for item in devices if item.type & cl.CL_DEVICE_TYPE_GPU]
+            self.device = gpus[0] if len(gpus) > 0 else devices[0]
+        else:
+            self.device = devices[device]
 
         self.context = cl.Context(self.platform, [self.device])
         self.queue = self.context.create_queue(self.device)
 
         filer = open(path, "r")
         txtProgram = filer.read()
+        filer.close()
+
+        self.program = self.Create_Program(txtProgram, cache)
+        self.scan_size = min(256, self.device.max_work_group_size)
+        self.tile_size = min(64, self.device.max_work_group_size)
+        self.tiled_threshold = 1 << 16
+        self.pool = GAP_BufferPool(self.context)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.resident = { }
+        self.asynchronous = asynchronous
+        self.staging, self.serial = [], 0
+
+    def Create_Program (self, txtProgram, cache = None):
+        """
+        Build the program - from the binary in the cache if it was already compiled for this device and driver
+        :param txtProgram: source of the program
+        :type txtProgram: str
+        :param cache: [Optional] directory of the compiled programs cache
+        :type cache: str
+        :return: The program
+        """
+        if cache is None:
+            return self.context.create_program(txtProgram)
+
+        key = "\n".join([self.platform.name, self.device.name, self.device.driver_version, txtProgram])
+        path = os.path.join(cache, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".bin")
+
+        if os.path.exists(path):
+            filer = open(path, "rb")
+            binary = filer.read()
+            filer.close()
+
+            try:
+                return self.context.create_program([binary], binary = True)
+            except cl.CLRuntimeError:
+                pass
+
+        program = self.context.create_program(txtProgram)
+
+        if not os.path.isdir(cache):
+            os.makedirs(cache)
+
+        filer = open(path + ".tmp", "wb")
+        filer.write(program.binaries[0])
+        filer.close()
+        os.replace(path + ".tmp", path)
+
+        return program
+
+    def Get_Kernel (self, name):
+        """
+        Get a kernel from the program (every kernel is created only once in a thread - the arguments of a kernel
+        are set before it is enqueued, so threads can not share kernels)
+        :param name: name of the kernel
+        :type name: str
+        :return: The kernel
+        """
+        kernels = getattr(self.local, "kernels", None)
+        if kernels is None:
+            kernels = self.local.kernels = { }
+
+        if not name in kernels:
+            kernels[name] = self.program.get_kernel(name)
+        return kernels[name]
+
+    def Upload (self, array, dtype = np.int32):
+        """
+        Get the device copy of an array.
+        Numpy arrays are uploaded once and stay resident as long as the host array is alive,
+        so the host arrays that are sent to the agent must not be changed in place.
+        :param array: Host array / Device array
+        :param dtype: the dtype of the array on the device
+        :return: The device array
+        :rtype: GAP_DeviceArray
+        """
+        if isinstance(array, GAP_DeviceArray):
+            return array
+
+        if not isinstance(array, np.ndarray):
+            array = np.array(array, dtype = dtype)
+            return GAP_DeviceArray(self, np.shape(array), dtype, array)
+
+        key = (id(array), np.dtype(dtype).str)
+        if key in self.resident:
+            ref, device = self.resident[key]
+            if ref() is array:
+                return device
+
+        device = GAP_DeviceArray(self, np.shape(array), dtype, array)
+        if array.dtype == device.dtype:
+            device.host = array
+
+        resident = self.resident
+        self.resident[key] = (weakref.ref(array, lambda r, k = key: resident.pop(k, None)), device)
+        return device
 
-        self.program = self.context.create_program(txtProgram)
-        self.flag_read = cl.CL_MEM_COPY_HOST_PTR | cl.CL_MEM_READ_ONLY
-        self.flag_write = cl.CL_MEM_COPY_HOST_PTR | cl.CL_MEM_WRITE_ONLY
-        self.flag_both = cl.CL_MEM_COPY_HOST_PTR | cl.CL_MEM_READ_WRITE
+    def Write (self, buffer, host, size, offset = 0):
+        """
+        Copy a host array to a buffer. In asynchronous mode the copy is not blocking, and the host array is kept
+        until a later event is completed (Complete).
+        :param buffer: The buffer
+        :param host: The host array
+        :type host: np.ndarray
+        :param size: amount of bytes to copy
+        :type size: int
+        :param offset: [Optional] offset in the buffer in bytes
+        :type offset: int
+        """
+        if self.asynchronous:
+            with self.lock:
+                self.queue.write_buffer(buffer, host, blocking = False, size = size, offset = offset)
+                self.serial += 1
+                self.staging.append((self.serial, host))
+        else:
+            self.queue.write_buffer(buffer, host, size = size, offset = offset)
+
+    def ToHost (self, array):
+        """
+        Get the host copy of an array
+        :param array: Host array / Device array
+        :return: The host array
+        :rtype: np.ndarray
+        """
+        if isinstance(array, GAP_DeviceArray):
+            return array.Host()
+        return array
+
+    def Scan (self, array, length):
+        """
+        Exclusive prefix sum (in place) on the first items of an int array on the device
+        :param array: The array
+        :type array: GAP_DeviceArray
+        :param length: amount of items to scan
+        :type length: int
+        """
+        local = self.scan_size
+        groups = (length + local - 1) // local
+        sums = GAP_DeviceArray(self, (groups,))
 
-    def Cartesian (self, a, b, join_varsPic):
+        kernel = self.Get_Kernel("SCAN")
+        kernel.set_arg(0, array.buffer)
+        Set_Argument(kernel, 1, length, np.int32)
+        kernel.set_arg(2, sums.buffer)
+        kernel.set_arg(3, None, local * 4)
+        self.queue.execute_kernel(kernel, [groups * local], [local])
+
+        if groups == 1:
+            return
+
+        self.Scan(sums, groups)
+
+        kernel = self.Get_Kernel("SCAN_ADD")
+        kernel.set_arg(0, array.buffer)
+        Set_Argument(kernel, 1, length, np.int32)
+        kernel.set_arg(2, sums.buffer)
+        self.queue.execute_kernel(kernel, [groups * local], [local])
+
+    def Scan_Total (self, array, length):
+        """
+        Exclusive prefix sum on the first items of an int array on the device, that has place for 1 more item.
+        :param array: The array (at least length + 1 items)
+        :type array: GAP_DeviceArray
+        :param length: amount of items to scan
+        :type length: int
+        :return: The total of the items
+        :rtype: int
+        """
+        total, event = self.Scan_Count(array, length)
+        self.Complete(event)
+        return int(total[0])
+
+    def Scan_Count (self, array, length):
+        """
+        Scan_Total without waiting - the total is read to the host in the background.
+        :param array: The array (at least length + 1 items)
+        :type array: GAP_DeviceArray
+        :param length: amount of items to scan
+        :type length: int
+        :return: (host array that will hold the total, the event of the read)
+        :rtype: tuple
+        """
+        self.Write(array.buffer, np.zeros(1, dtype = np.int32), 4, length * 4)
+        self.Scan(array, length + 1)
+
+        with self.lock:
+            mark = self.serial + 1
+
+        total = np.zeros(1, dtype = np.int32)
+        event = self.queue.read_buffer(array.buffer, total, blocking = False, size = 4, offset = length * 4,
+            need_event = True)
+        event.mark = mark
+        self.queue.flush()
+        return total, event
+
+    def Complete (self, event):
+        """
+        Wait for an event, and release the host arrays of the uploads that were enqueued before it
+        :param event: The event (of Scan_Count)
+        """
+        event.wait()
+
+        mark = getattr(event, "mark", 0)
+        with self.lock:
+            while len(self.staging) > 0 and self.staging[0][0] < mark:
+                self.staging.pop(0)
+
+    def Together (self, steps):
+        """
+        Advance some step generators together - every generator yields the list of events it waits for, so the
+        work of all of them is in the queue before the host waits.
+        :param steps: list of step generators
+        :type steps: list
+        :return: generator (yields lists of events, returns the list of results)
+        """
+        results = [None] * len(steps)
+        active = list(range(len(steps)))
+
+        while len(active) > 0:
+            events, waiting = [], []
+
+            for i in active:
+                try:
+                    events += steps[i].send(None)
+                    waiting.append(i)
+                except StopIteration as stop:
+                    results[i] = stop.value
+
+            active = waiting
+            if len(events) > 0:
+                yield events
+
+        return results
+
+    def Wait (self, steps):
+        """
+        Execute step generators until all of them are done
+        :param steps: list of step generators
+        :type steps: list
+        :return: list of results
+        :rtype: list
+        """
+        together = self.Together(steps)
+
+        while True:
+            try:
+                events = together.send(None)
+            except StopIteration as stop:
+                return stop.value
+
+            for event in events:
+                self.Complete(event)
+
+    def Compact (self, array, offsets, total, places):
+        """
+        Stream compaction - write the flagged rows of the array (by scanned flags) with the columns in places
+        :param array: The array
+        :type array: GAP_DeviceArray
+        :param offsets: Scanned flags of the rows (Scan_Total)
+        :type offsets: GAP_DeviceArray
+        :param total: Amount of flagged rows
+        :type total: int
+        :param places: list of columns
+        :type places: list
+        :return: The compacted array
+        :rtype: GAP_DeviceArray
+        """
+        a_row, a_col = array.shape
+        result = GAP_DeviceArray(self, (total, len(places)))
+
+        if total * len(places) == 0:
+            return result
+
+        buffer_places = self.Upload(places)
+
+        kernel = self.Get_Kernel("COMPACT")
+        kernel.set_arg(0, array.buffer)
+        Set_Argument(kernel, 1, a_col, np.int32)
+        kernel.set_arg(2, buffer_places.buffer)
+        Set_Argument(kernel, 3, len(places), np.int32)
+        kernel.set_arg(4, offsets.buffer)
+        kernel.set_arg(5, result.buffer)
+
+        self.queue.execute_kernel(kernel, [a_row], None)
+
+        return result
+
+    def Cartesian (self, a, b, join_varsPic, result_col = None):
         """
         Implement Cartesian Multiplication between relations
         :param a: (Array, Physical Variables Pictures of the array)
@@ -154,6 +527,8 @@ class GAP_OpenCL:
         :param b: (Array, Physical Variables Pictures of the array)
         :param join_varsPic: Physical Variables Pictures of the demanded array
         :type join_varsPic: np.ndarray
+        :param result_col: [Optional] amount of columns of the demanded array [default = Length_VarsPic(join_varsPic)]
+        :type result_col: int
         :return: (Array, join_varsPic)
         :rtype: tuple
         """
@@ -165,30 +540,33 @@ class GAP_OpenCL:
 
         size = np.shape(a_varsPic)[0]
 
-        result = np.zeros((a_row * b_row, Length_VarsPic(join_varsPic)), dtype = np.int32)
+        result = GAP_DeviceArray(self, (a_row * b_row, Length_VarsPic(join_varsPic) if result_col is None else
+            result_col))
 
-        buffer_a_idx = self.context.create_buffer(self.flag_read, a_idx)
-        buffer_b_idx = self.context.create_buffer(self.flag_read, b_idx)
-        buffer_a_varsPic = self.context.create_buffer(self.flag_read, a_varsPic)
-        buffer_b_varsPic = self.context.create_buffer(self.flag_read, b_varsPic)
-        buffer_join_varsPic = self.context.create_buffer(self.flag_read, join_varsPic)
-        buffer_result = self.context.create_buffer(self.flag_write, result)
+        if a_row * b_row == 0:
+            return result, join_varsPic
 
-        kernel = self.program.get_kernel("CARTESIAN")
+        buffer_a, buffer_b = self.Upload(a_idx), self.Upload(b_idx)
+        buffer_a_pic, buffer_b_pic = self.Upload(a_varsPic), self.Upload(b_varsPic)
+        buffer_join_pic = self.Upload(join_varsPic)
 
-        kernel.set_arg(0, buffer_a_idx)
+        kernel = self.Get_Kernel("CARTESIAN")
+
+        kernel.set_arg(0, buffer_a.buffer)
         Set_Argument(kernel, 1, a_col, np.int32)
-        kernel.set_arg(1, buffer_a_varsPic)
+        kernel.set_arg(2, buffer_a_pic.buffer)
 
-        kernel.set_arg(2, buffer_b_idx)
-        Set_Argument(kernel, 3, b_col, np.int32)
-        kernel.set_arg(4, buffer_b_varsPic)
+        kernel.set_arg(3, buffer_b.buffer)
+        Set_Argument(kernel, 4, b_row, np.int32)
+        Set_Argument(kernel, 5, b_col, np.int32)
+        kernel.set_arg(6, buffer_b_pic.buffer)
 
-        kernel.set_arg(5, buffer_result)
-        kernel.set_arg(6, buffer_join_varsPic)
+        kernel.set_arg(7, result.buffer)
+        kernel.set_arg(8, buffer_join_pic.buffer)
+        Set_Argument(kernel, 9, size, np.int32)
+        Set_Argument(kernel, 10, result.shape[1], np.int32)
 
-        self.queue.execute_kernel(kernel, (a_row, b_row, size), None)
-        self.queue.read_buffer(buffer_result, result)
+        self.queue.execute_kernel(kernel, (a_row, b_row), None)
 
         return result, join_varsPic
 
@@ -200,114 +578,79 @@ class GAP_OpenCL:
         :param minValue: the minimum value of items that we demanded
         :type minValue: float
         :return: Indexes Array
-        :rtype: np.ndarray
+        :rtype: GAP_DeviceArray
         """
         a_idx, a_values = data
         a_row, a_col = np.shape(a_idx)
 
-        result_idx = np.zeros(np.shape(a_idx), dtype = np.int32)
-
-        current = np.zeros(1, dtype = np.int32)
-
-        buffer_idx = self.context.create_buffer(self.flag_read, a_idx)
-        buffer_values = self.context.create_buffer(self.flag_read, a_values)
+        if a_row == 0:
+            return GAP_DeviceArray(self, (0, a_col))
 
-        buffer_result_idx = self.context.create_buffer(self.flag_write, result_idx)
+        buffer_idx, buffer_values = self.Upload(a_idx), self.Upload(a_values, np.float32)
+        offsets = GAP_DeviceArray(self, (a_row + 1,))
 
-        buffer_current = self.context.create_buffer(self.flag_both, current)
+        kernel = self.Get_Kernel("SELECT_ABOVE_FLAGS")
 
-        kernel = self.program.get_kernel("SELECT_ABOVE")
-
-        kernel.set_arg(0, buffer_idx)
-        kernel.set_arg(1, buffer_values)
-        Set_Argument(kernel, 2, a_col, np.int32)
-        Set_Argument(kernel, 3, minValue, np.int32)
-
-        kernel.set_arg(4, buffer_result_idx)
-        kernel.set_arg(5, buffer_current)
+        kernel.set_arg(0, buffer_values.buffer)
+        Set_Argument(kernel, 1, minValue, np.float32)
+        kernel.set_arg(2, offsets.buffer)
 
         self.queue.execute_kernel(kernel, [a_row], None)
-        self.queue.read_buffer(buffer_current, current)
-        self.queue.read_buffer(buffer_result_idx, result_idx)
 
-        result_idx = np.resize(result_idx, (current[0], a_col))
+        total = self.Scan_Total(offsets, a_row)
+        return self.Compact(buffer_idx, offsets, total, list(range(a_col)))
 
-        return result_idx
-
-    def Filter (self, a, matches):
+    def Filter (self, a, matches, places = None):
         """
         Implement Selection [List of (Field1 = Field2) connected with AND] {array}
         :param a: (Array, Physical Variables Picture)
         :type a:tuple
         :param matches: list of matches
         :type matches: list
+        :param places: [Optional] the columns that are left (Create_Filter_Places) [default = created by the matches]
+        :type places: list
         :return: (Array, Physical Variables Picture)
         :rtype: tuple
         """
         a_idx, a_varsPic = a
         a_row, a_col = np.shape(a_idx)
-        varsPic_row = np.shape(a_varsPic)[0]
-        varsPic_size = Length_VarsPic(a_varsPic)
-
-        #a_array = np.resize(a_idx, a_row * a_col)
+        if places is None:
+            places = Create_Filter_Places(a_col, matches)
 
-        #matches_array = np.array(matches, dtype = np.int32)
-        #matches_array = np.resize(np.array(matches, dtype = np.int32), 2*len(matches))
+        if a_row == 0:
+            return GAP_DeviceArray(self, (0, len(places))), a_varsPic
 
-        result_idx = np.zeros(a_row * varsPic_size, dtype = np.int32)
-        #current = np.zeros(1, dtype = np.int32)
+        return self.Wait([self.Filter_Steps(self.Upload(a_idx), matches, places)])[0], a_varsPic
 
+    def Filter_Steps (self, buffer_a, matches, places):
         """
-        buffer_a = self.context.create_buffer(self.flag_read, a_array)
-        buffer_places = self.context.create_buffer(self.flag_read, matches_array)
-        buffer_varsPic = self.context.create_buffer(self.flag_read, a_varsPic)
-
-        buffer_result = self.context.create_buffer(self.flag_write, result_idx)
-        buffer_current = self.context.create_buffer(self.flag_both, current)
-
-        kernel = self.program.get_kernel("FILTER")
+        Step generator of Filter (see Together)
+        :param buffer_a: The array
+        :type buffer_a: GAP_DeviceArray
+        :param matches: list of matches
+        :type matches: list
+        :param places: the columns that are left (Create_Filter_Places)
+        :type places: list
+        :return: generator of the filtered array
+        """
+        a_row, a_col = buffer_a.shape
+        buffer_matches = self.Upload(np.array(matches, dtype = np.int32).reshape(2 * len(matches)))
+        offsets = GAP_DeviceArray(self, (a_row + 1,))
 
-        kernel.set_arg(0, buffer_a)
-        Set_Argument(kernel, 1, a_row, np.int32)
+        kernel = self.Get_Kernel("FILTER_FLAGS")
 
-        kernel.set_arg(2, buffer_places)
+        kernel.set_arg(0, buffer_a.buffer)
+        Set_Argument(kernel, 1, a_col, np.int32)
+        kernel.set_arg(2, buffer_matches.buffer)
         Set_Argument(kernel, 3, len(matches), np.int32)
-        kernel.set_arg(4, buffer_varsPic)
-        Set_Argument(kernel, 5, varsPic_row, np.int32)
-
-        kernel.set_arg(6, buffer_current)
-        kernel.set_arg(7, buffer_result)
-        Set_Argument(kernel, 8, varsPic_size)
+        kernel.set_arg(4, offsets.buffer)
 
         self.queue.execute_kernel(kernel, [a_row], None)
-        self.queue.read_buffer(buffer_current, current)
-        self.queue.read_buffer(buffer_result, result_idx)
-
-
-        """
-        count = 0
-        for x in range(a_row):
-            isOk = True
-            i = 0
-            while isOk and i < len(matches):
-                if a_idx[x][matches[i][0]] != a_idx[x][matches[i][1]]:
-                    isOk = False
-                else:
-                    i += 1
-
-            if not isOk:
-                continue
-
-            curr = count
-            count += 1
 
-            for i in range(varsPic_row):
-                if a_varsPic[i] is not -1:
-                    result_idx[curr][a_varsPic[i]] = a_idx[x][a_varsPic[i]]
+        total, event = self.Scan_Count(offsets, a_row)
+        yield [event]
 
-        #result_idx = np.resize(result_idx, (current[0], a_col))
-        result_idx = np.resize(result_idx, (count, varsPic_size))
-        return result_idx, a_varsPic
+        return self.Compact(buffer_a, offsets, int(total[0]), places)
 
     def Projection (self, data, projectionLst):
         """
@@ -317,36 +660,41 @@ class GAP_OpenCL:
         :param projectionLst: List of demanded fields
         :type projectionLst:list
         :return: Array of projected Array (+duplicates)
+        :rtype: GAP_DeviceArray
         """
         data_row, data_col = np.shape(data)
 
-        places = np.array(projectionLst, dtype = np.int32)
-        result = np.zeros((data_row, len(projectionLst)), dtype = np.int32)
+        result = GAP_DeviceArray(self, (data_row, len(projectionLst)))
 
-        buffer_data = self.context.create_buffer(self.flag_read, data)
-        buffer_result = self.context.create_buffer(self.flag_write, result)
-        buffer_places = self.context.create_buffer(self.flag_read, places)
+        if data_row * len(projectionLst) == 0:
+            return result
 
-        kernel = self.program.get_kernel("PROJECTION")
+        buffer_data, buffer_places = self.Upload(data), self.Upload(projectionLst)
 
-        kernel.set_arg(0, buffer_data)
+        kernel = self.Get_Kernel("PROJECTION")
+
+        kernel.set_arg(0, buffer_data.buffer)
         Set_Argument(kernel, 1, data_col, np.int32)
-        kernel.set_arg(2, buffer_result)
+        kernel.set_arg(2, result.buffer)
         Set_Argument(kernel, 3, len(projectionLst), np.int32)
-        kernel.set_arg(4, buffer_places)
+        kernel.set_arg(4, buffer_places.buffer)
 
         self.queue.execute_kernel(kernel, [data_row, len(projectionLst)], None)
-        self.queue.read_buffer(buffer_result, result)
 
         return result
 
-    def SuperJoin (self, a, b):
+    def SuperJoin (self, a, b, join = None):
         """
         Implement Join between two tables.
+        Phase 1 counts the matches of every row in a, the counts are scanned into offsets and phase 2 writes the
+        matches at their offsets - the result is in exact size and in the order of (a, b).
         :param a: (Array, Physical Variables Picture)
         :type a: tuple
         :param b: (Array, Physical Variables Picture)
         :type b: tuple
+        :param join: [Optional] (Joined Physical Variables Picture, list of the joined variables, amount of columns of
+         the result) - precomputed by GAP_PhysicalPlan [default = created by the pictures]
+        :type join: tuple
         :return: (Joined Array, Joined Physical Variables Picture)
         :rtype: tuple
         """
@@ -356,55 +704,631 @@ class GAP_OpenCL:
         a_row, a_col = np.shape(a_idx)
         b_row, b_col = np.shape(b_idx)
 
-        join_varsPic, joinLst = Create_VarsPic_Join(a_varsPic, b_varsPic)
+        if join is None:
+            join_varsPic, joinLst = Create_VarsPic_Join(a_varsPic, b_varsPic)
+            if len(joinLst) == 0:
+                return self.Cartesian(a, b, join_varsPic)
+            result_col = a_col + b_col - len(joinLst)
+        else:
+            join_varsPic, joinLst, result_col = join
+            if len(joinLst) == 0:
+                return self.Cartesian(a, b, join_varsPic, result_col)
+
+        if a_row * b_row == 0:
+            return GAP_DeviceArray(self, (0, result_col)), join_varsPic
+
+        if self.Use_Tiled(a_row, b_row, b_col, len(joinLst), np.shape(a_varsPic)[0]):
+            return self.SuperJoin_Tiled(a, b, join_varsPic, joinLst), join_varsPic
+
+        buffer_a, buffer_b = self.Upload(a_idx), self.Upload(b_idx)
+        buffer_a_pic, buffer_b_pic = self.Upload(a_varsPic), self.Upload(b_varsPic)
+        buffer_joinLst = self.Upload(joinLst)
+
+        offsets = GAP_DeviceArray(self, (a_row + 1,))
+
+        kernel = self.Get_Kernel("SUPER_JOIN_COUNT")
 
-        if len(joinLst) is 0:
-            return self.Cartesian(a, b, join_varsPic)
+        kernel.set_arg(0, buffer_a.buffer)
+        Set_Argument(kernel, 1, a_col, np.int32)
+        kernel.set_arg(2, buffer_a_pic.buffer)
+
+        kernel.set_arg(3, buffer_b.buffer)
+        Set_Argument(kernel, 4, b_row, np.int32)
+        Set_Argument(kernel, 5, b_col, np.int32)
+        kernel.set_arg(6, buffer_b_pic.buffer)
 
-        result = np.zeros((a_row * b_row, a_col + b_col - len(joinLst)), dtype = np.int32)
-        current = np.zeros(1, dtype = np.int32)
+        kernel.set_arg(7, buffer_joinLst.buffer)
+        Set_Argument(kernel, 8, len(joinLst), np.int32)
+        kernel.set_arg(9, offsets.buffer)
 
-        # BUFFERS
-        buffer_a = self.context.create_buffer(self.flag_read, a_idx)
-        buffer_b = self.context.create_buffer(self.flag_read, b_idx)
+        self.queue.execute_kernel(kernel, [a_row], None)
 
-        buffer_a_pic = self.context.create_buffer(self.flag_read, a_varsPic)
-        buffer_b_pic = self.context.create_buffer(self.flag_read, b_varsPic)
-        buffer_join_pic = self.context.create_buffer(self.flag_read, join_varsPic)
+        total = self.Scan_Total(offsets, a_row)
 
-        buffer_joinLst = self.context.create_buffer(self.flag_read, np.asarray(joinLst, dtype = np.int32))
-        buffer_result = self.context.create_buffer(self.flag_write, result)
-        buffer_current = self.context.create_buffer(self.flag_both, current)
+        result = GAP_DeviceArray(self, (total, result_col))
+        if total == 0:
+            return result, join_varsPic
 
-        kernel = self.program.get_kernel("SUPER_JOIN")
+        kernel = self.Get_Kernel("SUPER_JOIN_WRITE")
 
-        kernel.set_arg(0, buffer_a)
+        kernel.set_arg(0, buffer_a.buffer)
         Set_Argument(kernel, 1, a_col, np.int32)
-        kernel.set_arg(2, buffer_a_pic)
+        kernel.set_arg(2, buffer_a_pic.buffer)
 
-        kernel.set_arg(3, buffer_b)
-        Set_Argument(kernel, 4, b_col, np.int32)
-        kernel.set_arg(5, buffer_b_pic)
+        kernel.set_arg(3, buffer_b.buffer)
+        Set_Argument(kernel, 4, b_row, np.int32)
+        Set_Argument(kernel, 5, b_col, np.int32)
+        kernel.set_arg(6, buffer_b_pic.buffer)
 
-        kernel.set_arg(6, buffer_joinLst)
-        Set_Argument(kernel, 7, len(joinLst), np.int32)
+        kernel.set_arg(7, buffer_joinLst.buffer)
+        Set_Argument(kernel, 8, len(joinLst), np.int32)
 
-        kernel.set_arg(8, buffer_join_pic)
-        Set_Argument(kernel, 9, np.shape(a_varsPic)[0], np.int32)
+        kernel.set_arg(9, self.Upload(join_varsPic).buffer)
+        Set_Argument(kernel, 10, np.shape(a_varsPic)[0], np.int32)
 
-        kernel.set_arg(10, buffer_result)
-        kernel.set_arg(11, buffer_current)
+        kernel.set_arg(11, offsets.buffer)
+        kernel.set_arg(12, result.buffer)
+        Set_Argument(kernel, 13, result_col, np.int32)
 
-        self.queue.execute_kernel(kernel, (a_row, b_row), None)
-        self.queue.read_buffer(buffer_result, result)
-        self.queue.read_buffer(buffer_current, current)
+        self.queue.execute_kernel(kernel, [a_row], None)
 
-        result = np.resize(result, (current[0], a_col + b_col - len(joinLst)))
         return result, join_varsPic
 
+    def Use_Tiled (self, a_row, b_row, b_col, joinLst_length, varsPic_size):
+        """
+        Decide if a join runs with the tiled kernels - big enough inputs, and the tile fits in local memory
+        :return: True / False
+        :rtype: bool
+        """
+        if a_row * b_row < self.tiled_threshold or b_row < self.tile_size:
+            return False
+
+        local = (self.tile_size * b_col + 2 * joinLst_length + 3 * varsPic_size) * 4
+        return local <= self.device.local_memsize
+
+    def SuperJoin_Tiled (self, a, b, join_varsPic, joinLst):
+        """
+        Join between two tables with the tiled kernels - every work-group stages blocks of b and the join metadata in
+        local memory. Same phases and result as SuperJoin.
+        :param a: (Array, Physical Variables Picture)
+        :type a: tuple
+        :param b: (Array, Physical Variables Picture)
+        :type b: tuple
+        :param join_varsPic: Joined Physical Variables Picture
+        :type join_varsPic: np.ndarray
+        :param joinLst: list of the joined variables
+        :type joinLst: np.ndarray
+        :return: Joined Array
+        :rtype: GAP_DeviceArray
+        """
+        a_idx, a_varsPic = a
+        b_idx, b_varsPic = b
+
+        a_row, a_col = np.shape(a_idx)
+        b_row, b_col = np.shape(b_idx)
+        size = np.shape(a_varsPic)[0]
+        result_col = a_col + b_col - len(joinLst)
+
+        local = self.tile_size
+        groups = (a_row + local - 1) // local
+        tile_bytes, meta_bytes = local * b_col * 4, (2 * len(joinLst) + 3 * size) * 4
+
+        buffer_a, buffer_b = self.Upload(a_idx), self.Upload(b_idx)
+        buffer_a_pic, buffer_b_pic = self.Upload(a_varsPic), self.Upload(b_varsPic)
+        buffer_joinLst = self.Upload(joinLst)
+
+        offsets = GAP_DeviceArray(self, (a_row + 1,))
+
+        kernel = self.Get_Kernel("SUPER_JOIN_COUNT_TILED")
+
+        kernel.set_arg(0, buffer_a.buffer)
+        Set_Argument(kernel, 1, a_row, np.int32)
+        Set_Argument(kernel, 2, a_col, np.int32)
+        kernel.set_arg(3, buffer_a_pic.buffer)
+
+        kernel.set_arg(4, buffer_b.buffer)
+        Set_Argument(kernel, 5, b_row, np.int32)
+        Set_Argument(kernel, 6, b_col, np.int32)
+        kernel.set_arg(7, buffer_b_pic.buffer)
+
+        kernel.set_arg(8, buffer_joinLst.buffer)
+        Set_Argument(kernel, 9, len(joinLst), np.int32)
+        kernel.set_arg(10, offsets.buffer)
+
+        kernel.set_arg(11, None, tile_bytes)
+        kernel.set_arg(12, None, meta_bytes)
+
+        self.queue.execute_kernel(kernel, [groups * local], [local])
+
+        total = self.Scan_Total(offsets, a_row)
+
+        result = GAP_DeviceArray(self, (total, result_col))
+        if total == 0:
+            return result
+
+        kernel = self.Get_Kernel("SUPER_JOIN_WRITE_TILED")
+
+        kernel.set_arg(0, buffer_a.buffer)
+        Set_Argument(kernel, 1, a_row, np.int32)
+        Set_Argument(kernel, 2, a_col, np.int32)
+        kernel.set_arg(3, buffer_a_pic.buffer)
+
+        kernel.set_arg(4, buffer_b.buffer)
+        Set_Argument(kernel, 5, b_row, np.int32)
+        Set_Argument(kernel, 6, b_col, np.int32)
+        kernel.set_arg(7, buffer_b_pic.buffer)
+
+        kernel.set_arg(8, buffer_joinLst.buffer)
+        Set_Argument(kernel, 9, len(joinLst), np.int32)
+
+        kernel.set_arg(10, self.Upload(join_varsPic).buffer)
+        Set_Argument(kernel, 11, size, np.int32)
+
+        kernel.set_arg(12, offsets.buffer)
+        kernel.set_arg(13, result.buffer)
+        Set_Argument(kernel, 14, result_col, np.int32)
+
+        kernel.set_arg(15, None, tile_bytes)
+        kernel.set_arg(16, None, meta_bytes)
+
+        self.queue.execute_kernel(kernel, [groups * local], [local])
+
+        return result
+
+    def Execute_Plan (self, plan, dataHolder, cache = None):
+        """
+        Execute the "Definition Zone" of a rule (GAP_Plan) with fused kernels :
+        the filters of the blocks are checked in the join probe (no filtered copies), the join writes only the
+        variables columns, and every Select Above block is a single lookup kernel on the joined rows (instead of
+        Projection + Distinct + Select Above + Join).
+        :param plan: The plan of the rule
+        :type plan: GAP_Plan
+        :param dataHolder: The data agent
+        :param cache: [Optional] the joins of the interval that are shared with other rules (GAP_JoinCache)
+        :return: (Array, Physical Variables Picture)
+        :rtype: tuple
+        """
+        return self.Execute_Plans([plan], dataHolder, cache)[0]
+
+    def Execute_Plans (self, plans, dataHolder, cache = None):
+        """
+        Execute the plans of some independent rules together - the kernels of all the plans are enqueued before the
+        host waits for the sizes of the results. In asynchronous mode the results are read to the host in the
+        background, so the host waits only when a rule uses its "Definition Zone".
+        :param plans: list of plans (GAP_Plan)
+        :type plans: list
+        :param dataHolder: The data agent
+        :param cache: [Optional] the joins of the interval that are shared with other rules (GAP_JoinCache) - a join
+         of some plans is done once
+        :return: list of (Array, Physical Variables Picture)
+        :rtype: list
+        """
+        results = self.Wait([self.Plan_Steps(plan, dataHolder, cache) for plan in plans])
+
+        if self.asynchronous:
+            for array, varsPic in results:
+                array.Prefetch()
+            self.queue.flush()
+
+        return results
+
+    def Plan_Steps (self, plan, dataHolder, cache = None):
+        """
+        Step generator of Execute_Plan (see Together)
+        :param plan: The plan of the rule
+        :type plan: GAP_Plan
+        :param dataHolder: The data agent
+        :param cache: [Optional] the joins of the interval that are shared with other rules (GAP_JoinCache)
+        :return: generator of (Array, Physical Variables Picture)
+        """
+        size = plan.Size
+        relations = yield from self.Plan_Join_Steps(plan, dataHolder, 1, cache)
+
+        if relations is None:
+            return GAP_DeviceArray(self, (0, size)), Create_VarsPic_Physical(list(range(size)), size)
+
+        array, cols = yield from self.Plan_Finish_Steps(relations[0], plan, dataHolder)
+        return array, np.array(cols, dtype = np.int32)
+
+    def Plan_Join_Steps (self, plan, dataHolder, count = 1, cache = None):
+        """
+        Step generator of the scans and the joins of a plan
+        :param plan: The plan of the rule
+        :type plan: GAP_Plan
+        :param dataHolder: The data agent
+        :param count: [Optional] join until there are at most count relations [default = 1]
+        :type count: int
+        :param cache: [Optional] the joins of the interval that are shared with other rules (GAP_JoinCache)
+        :return: generator of the list of relations (None if a relation is empty)
+        """
+        relations = []
+
+        for j in range(len(plan.Scans)):
+            predicat, virtual, matches = plan.Scans[j]
+            data = dataHolder.GetData(predicat)
+            if data is None or len(data) == 0:
+                return None
+
+            array = dataHolder.Generate_NDArray(predicat, plan.Minimums[j], plan.Constants[j])
+            if len(array) == 0:
+                return None
+            relations.append((self.Upload(array), plan.Columns(j), matches))
+
+        terms = [[j] for j in range(len(relations))]
+
+        while len(relations) > count:
+            pairs = [self.Shared_Join_Steps(relations[i], relations[i + 1], plan, terms[i] + terms[i + 1], dataHolder,
+                cache) for i in range(0, len(relations) - 1, 2)]
+            rest = relations[len(relations) - len(relations) % 2:]
+
+            terms = [terms[i] + terms[i + 1] for i in range(0, len(terms) - 1, 2)] + terms[len(terms) - len(terms) % 2:]
+            relations = (yield from self.Together(pairs)) + rest
+
+            for res in relations:
+                if len(res[0]) == 0:
+                    return None
+
+        return relations
+
+    def Shared_Join_Steps (self, a, b, plan, terms, dataHolder, cache):
+        """
+        Step generator of a join of the join tree of a plan - the join is taken from the cache if another plan did it
+        in the interval (or waits for it, if it is done now by another plan of Together)
+        :param a: relation
+        :type a: tuple
+        :param b: relation
+        :type b: tuple
+        :param plan: The plan of the rule
+        :type plan: GAP_Plan
+        :param terms: The indexes of the scans of the join
+        :type terms: list
+        :param dataHolder: The data agent
+        :param cache: The join cache (None - no cache)
+        :return: generator of the joined relation
+        """
+        layout = plan.Fused_Join(a[1], b[1])
+        if cache is None:
+            return (yield from self.Fused_Join_Steps(a, b, plan.Size, layout))
+
+        key, variables = plan.Key(terms, dataHolder)
+        entry = cache.Get(key)
+
+        if entry is None:
+            entry = cache.Put(key)
+            try:
+                array, cols, matches = yield from self.Fused_Join_Steps(a, b, plan.Size, layout)
+            except BaseException:
+                cache.Drop(key)
+                raise
+
+            entry[0] = array, [cols[v] for v in variables], matches
+            return array, cols, matches
+
+        while entry[0] is None:
+            yield []
+
+        array, columns, matches = entry[0]
+        cache.rows += len(array)
+
+        cols = [-1] * plan.Size
+        for v, col in zip(variables, columns):
+            cols[v] = col
+        return array, cols, matches
+
+    def Plan_Finish_Steps (self, relation, plan, dataHolder):
+        """
+        Step generator of the last part of a plan - the filters that are left and the Select Above blocks
+        :param relation: The joined relation
+        :type relation: tuple
+        :param plan: The plan of the rule
+        :type plan: GAP_Plan
+        :param dataHolder: The data agent
+        :return: generator of (Array, column of every variable)
+        """
+        array, cols, matches = relation
+        places, cols, lookups = plan.Finish(cols, matches, array.shape[1])
+
+        if places is not None:
+            array = yield from self.Filter_Steps(array, matches, places)
+
+        aboves = [k for k in range(len(plan.Aboves)) if not dataHolder.Indexed(plan.Aboves[k][0])]
+        if len(aboves) > 0 and len(array) > 0:
+            array = yield from self.Select_Aboves_Steps(array, cols, [plan.Aboves[k] for k in aboves], dataHolder,
+                [lookups[k] for k in aboves])
+
+        return array, cols
+
+    def Stream_Plan (self, plan, dataHolder, rows = 1 << 16):
+        """
+        Execute a plan as a stream of batches - the last join is written by ranges of rows of its first relation
+        (by the offsets of its count phase), so only about "rows" rows of the result are in the memory. The next
+        batch is enqueued before the rows of the current batch are used.
+        :param plan: The plan of the rule
+        :type plan: GAP_Plan
+        :param dataHolder: The data agent
+        :param rows: [Optional] amount of rows in a batch [default = 65536]
+        :type rows: int
+        :return: (GAP_Stream, Physical Variables Picture)
+        :rtype: tuple
+        """
+        size = plan.Size
+        relations = self.Wait([self.Plan_Join_Steps(plan, dataHolder, 2)])[0]
+
+        if relations is None:
+            return GAP_Stream(iter([])), Create_VarsPic_Physical(list(range(size)), size)
+
+        if len(relations) == 1:
+            array, cols = self.Wait([self.Plan_Finish_Steps(relations[0], plan, dataHolder)])[0]
+            host = array.Host()
+            return GAP_Stream(host[start:start + rows] for start in range(0, len(host), rows)), np.array(cols,
+                dtype = np.int32)
+
+        join = self.Fused_Join_Count(relations[0], relations[1], size, plan.Fused_Join(relations[0][1],
+            relations[1][1]))
+        cols = join["cols"]
+
+        return GAP_Stream(self.Stream_Batches(join, plan, dataHolder, rows)), np.array(cols, dtype = np.int32)
+
+    def Stream_Batches (self, join, plan, dataHolder, rows):
+        """
+        Generator of the batches of Stream_Plan
+        :param join: the last join after its count phase (Fused_Join_Count)
+        :type join: dict
+        :param plan: The plan of the rule
+        :param dataHolder: The data agent
+        :param rows: amount of rows in a batch
+        :type rows: int
+        :return: generator of arrays
+        """
+        a_row = join["a_row"]
+        if a_row * join["b_row"] == 0:
+            return
+
+        self.Scan_Total(join["offsets"], a_row)
+        offsets = np.array(join["offsets"].Host()[:a_row + 1])
+        pending = None
+
+        first = 0
+        while first < a_row:
+            last = int(np.searchsorted(offsets, offsets[first] + rows, side = "right")) - 1
+            last = min(a_row, max(first + 1, last))
+            total = int(offsets[last] - offsets[first])
+
+            if total > 0:
+                relation = self.Fused_Join_Write(join, first, last, total), join["cols"], []
+                array, cols = self.Wait([self.Plan_Finish_Steps(relation, plan, dataHolder)])[0]
+                array.Prefetch()
+                self.queue.flush()
+
+                if pending is not None:
+                    yield pending
+                pending = array
+
+            first = last
+
+        if pending is not None:
+            yield pending
+
+    def Fused_Join (self, a, b, size, layout = None):
+        """
+        Join of 2 relations of a plan, with the filters of both sides in the probe.
+        A relation is (Array, column of every variable (-1 = not in the relation), matches that are not checked yet)
+        :param a: relation
+        :type a: tuple
+        :param b: relation
+        :type b: tuple
+        :param size: amount of variables in the rule
+        :type size: int
+        :param layout: [Optional] (keys, out, cols) of the join - precomputed by GAP_PhysicalPlan [default = created by
+         the columns of the relations, see Create_Columns_Join]
+        :type layout: tuple
+        :return: The joined relation
+        :rtype: tuple
+        """
+        return self.Wait([self.Fused_Join_Steps(a, b, size, layout)])[0]
+
+    def Fused_Join_Steps (self, a, b, size, layout = None):
+        """
+        Step generator of Fused_Join (see Together)
+        """
+        join = self.Fused_Join_Count(a, b, size, layout)
+        if join["a_row"] * join["b_row"] == 0:
+            return GAP_DeviceArray(self, (0, join["out_length"])), join["cols"], []
+
+        total, event = self.Scan_Count(join["offsets"], join["a_row"])
+        yield [event]
+
+        return self.Fused_Join_Write(join, 0, join["a_row"], int(total[0])), join["cols"], []
+
+    def Fused_Join_Count (self, a, b, size, layout = None):
+        """
+        The count phase of Fused_Join - the amount of joined rows of every row of a (not scanned yet)
+        :param a: relation
+        :type a: tuple
+        :param b: relation
+        :type b: tuple
+        :param size: amount of variables in the rule
+        :type size: int
+        :param layout: [Optional] (keys, out, cols) of the join [default = created by the columns of the relations]
+        :type layout: tuple
+        :return: the join (arrays, buffers and sizes for Fused_Join_Write)
+        :rtype: dict
+        """
+        a_array, a_cols, a_matches = a
+        b_array, b_cols, b_matches = b
+
+        a_row, a_col = a_array.shape
+        b_row, b_col = b_array.shape
+
+        keys, out, cols = Create_Columns_Join(a_cols, b_cols, size) if layout is None else layout
+
+        join = {"a": a_array, "a_row": a_row, "a_col": a_col, "b": b_array, "b_row": b_row, "b_col": b_col,
+            "cols": cols, "out_length": len(out) // 2, "keys_length": len(keys) // 2, "b_matches_length": len(b_matches)}
+
+        if a_row * b_row == 0:
+            return join
+
+        buffer_a_matches = self.Upload(np.array(a_matches, dtype = np.int32).reshape(2 * len(a_matches)))
+        join["b_matches"] = self.Upload(np.array(b_matches, dtype = np.int32).reshape(2 * len(b_matches)))
+        join["keys"], join["out"] = self.Upload(keys), self.Upload(out)
+        join["offsets"] = GAP_DeviceArray(self, (a_row + 1,))
+
+        kernel = self.Get_Kernel("FUSED_JOIN_COUNT")
+
+        kernel.set_arg(0, a_array.buffer)
+        Set_Argument(kernel, 1, a_col, np.int32)
+        kernel.set_arg(2, buffer_a_matches.buffer)
+        Set_Argument(kernel, 3, len(a_matches), np.int32)
+
+        kernel.set_arg(4, b_array.buffer)
+        Set_Argument(kernel, 5, b_row, np.int32)
+        Set_Argument(kernel, 6, b_col, np.int32)
+        kernel.set_arg(7, join["b_matches"].buffer)
+        Set_Argument(kernel, 8, len(b_matches), np.int32)
+
+        kernel.set_arg(9, join["keys"].buffer)
+        Set_Argument(kernel, 10, len(keys) // 2, np.int32)
+        kernel.set_arg(11, join["offsets"].buffer)
+
+        self.queue.execute_kernel(kernel, [a_row], None)
+
+        return join
+
+    def Fused_Join_Write (self, join, first, last, total):
+        """
+        The write phase of Fused_Join for the rows first..last-1 of a (the offsets are scanned)
+        :param join: the join (Fused_Join_Count)
+        :type join: dict
+        :param first: first row of a
+        :type first: int
+        :param last: last row of a (not included)
+        :type last: int
+        :param total: amount of joined rows of the rows first..last-1
+        :type total: int
+        :return: The joined rows
+        :rtype: GAP_DeviceArray
+        """
+        result = GAP_DeviceArray(self, (total, join["out_length"]))
+        if total == 0:
+            return result
+
+        kernel = self.Get_Kernel("FUSED_JOIN_WRITE")
+
+        kernel.set_arg(0, join["a"].buffer)
+        Set_Argument(kernel, 1, join["a_col"], np.int32)
+
+        kernel.set_arg(2, join["b"].buffer)
+        Set_Argument(kernel, 3, join["b_row"], np.int32)
+        Set_Argument(kernel, 4, join["b_col"], np.int32)
+        kernel.set_arg(5, join["b_matches"].buffer)
+        Set_Argument(kernel, 6, join["b_matches_length"], np.int32)
+
+        kernel.set_arg(7, join["keys"].buffer)
+        Set_Argument(kernel, 8, join["keys_length"], np.int32)
+
+        kernel.set_arg(9, join["offsets"].buffer)
+        kernel.set_arg(10, join["out"].buffer)
+        Set_Argument(kernel, 11, join["out_length"], np.int32)
+        kernel.set_arg(12, result.buffer)
+        Set_Argument(kernel, 13, first, np.int32)
+
+        self.queue.execute_kernel(kernel, [last - first], None)
+
+        return result
+
+    def Select_Aboves (self, array, cols, aboves, dataHolder, lookups = None):
+        """
+        Keep the rows of an array that pass all the Select Above blocks of a plan
+        :param array: The array
+        :type array: GAP_DeviceArray
+        :param cols: column of every variable in the array
+        :type cols: list
+        :param aboves: list of (predicat, virtual variables picture, minimum value)
+        :type aboves: list
+        :param dataHolder: The data agent
+        :param lookups: [Optional] the columns of the variables of every block (GAP_Plan.Finish) [default = by cols]
+        :type lookups: list
+        :return: The array
+        :rtype: GAP_DeviceArray
+        """
+        return self.Wait([self.Select_Aboves_Steps(array, cols, aboves, dataHolder, lookups)])[0]
+
+    def Select_Aboves_Steps (self, array, cols, aboves, dataHolder, lookups = None):
+        """
+        Step generator of Select_Aboves (see Together)
+        """
+        a_row, a_col = array.shape
+        flags = GAP_DeviceArray(self, (a_row + 1,))
+        kernel = self.Get_Kernel("SELECT_ABOVE_JOIN_FLAGS")
+
+        for i in range(len(aboves)):
+            predicat, virtual, minValue = aboves[i]
+            keys, values = dataHolder.Generate_Table(predicat)
+
+            places = [cols[ptr] for ptr in virtual] if lookups is None else lookups[i]
+            buffer_places = self.Upload(places)
+            buffer_keys, buffer_values = self.Upload(keys), self.Upload(values, np.float32)
+
+            kernel.set_arg(0, array.buffer)
+            Set_Argument(kernel, 1, a_col, np.int32)
+            kernel.set_arg(2, buffer_places.buffer)
+            Set_Argument(kernel, 3, len(places), np.int32)
+            kernel.set_arg(4, buffer_keys.buffer)
+            Set_Argument(kernel, 5, np.shape(keys)[0], np.int32)
+            kernel.set_arg(6, buffer_values.buffer)
+            Set_Argument(kernel, 7, 1, np.float32)
+            Set_Argument(kernel, 8, minValue, np.float32)
+            Set_Argument(kernel, 9, 1 if i == 0 else 0, np.int32)
+            kernel.set_arg(10, flags.buffer)
+
+            self.queue.execute_kernel(kernel, [a_row], None)
+
+        total, event = self.Scan_Count(flags, a_row)
+        yield [event]
+
+        return self.Compact(array, flags, int(total[0]), list(range(a_col)))
+
+    def Sort (self, array):
+        """
+        Sort the rows of an array (lexicographic) with bitonic sort
+        :param array: The array
+        :type array: GAP_DeviceArray
+        :return: The permutation of the rows (padded to a power of 2)
+        :rtype: GAP_DeviceArray
+        """
+        a_row, a_col = array.shape
+
+        length = 1
+        while length < a_row:
+            length <<= 1
+
+        perm = GAP_DeviceArray(self, (length,))
+
+        kernel = self.Get_Kernel("IOTA")
+        kernel.set_arg(0, perm.buffer)
+        self.queue.execute_kernel(kernel, [length], None)
+
+        kernel = self.Get_Kernel("BITONIC_SORT")
+        kernel.set_arg(0, array.buffer)
+        Set_Argument(kernel, 1, a_col, np.int32)
+        Set_Argument(kernel, 2, a_row, np.int32)
+        kernel.set_arg(3, perm.buffer)
+
+        k = 2
+        while k <= length:
+            j = k >> 1
+            while j > 0:
+                Set_Argument(kernel, 4, j, np.int32)
+                Set_Argument(kernel, 5, k, np.int32)
+                self.queue.execute_kernel(kernel, [length], None)
+                j >>= 1
+            k <<= 1
+
+        return perm
+
     def Distinct (self, array, dictionary = None):
         """
-        Implement Distinct on an array
+        Implement Distinct on an array (sort + unique, the result is sorted)
         :param array: An array
         :type array: np.ndarray
         :param dictionary: [Optional] if dictionary exist, the function will return also the values for the distinct
@@ -413,67 +1337,100 @@ class GAP_OpenCL:
         :return: (Indexes Array, Values Array)
         :rtype: tuple
         """
-        dist = { }
-
-        for item in array:
-            tup = tuple(item)
-
-            if not tup in dist.keys():
-                if dictionary is not None and tup in dictionary.keys():
-                    dist[tup] = dictionary[tup]
-                else:
-                    dist[tup] = 1
+        a_row, a_col = np.shape(array)
 
-        if len(dist) == 0:
-            return np.zeros(0, dtype = np.int32), np.zeros(0, dtype = np.float)
-
-        idx = np.array(list(dist.keys()), dtype = np.int32)
-        if not dictionary == None:
-            values = np.array(list(dist.values()), dtype = np.float)
-        else:
-            values = None
+        if a_row == 0:
+            return np.zeros((0, a_col), dtype = np.int32), np.zeros(0, dtype = np.float32)
 
-        return idx, values
+        buffer_array = self.Upload(array)
+        perm = self.Sort(buffer_array)
+        offsets = GAP_DeviceArray(self, (a_row + 1,))
 
-    """
-    def SetLowerBoundary (self, data:tuple, minValue:float) -> tuple:
-        a_idx, a_values = data
+        kernel = self.Get_Kernel("UNIQUE_FLAGS")
+        kernel.set_arg(0, buffer_array.buffer)
+        Set_Argument(kernel, 1, a_col, np.int32)
+        kernel.set_arg(2, perm.buffer)
+        kernel.set_arg(3, offsets.buffer)
+        self.queue.execute_kernel(kernel, [a_row], None)
 
-        a_row, = np.shape(a_values)
+        total = self.Scan_Total(offsets, a_row)
+        idx = GAP_DeviceArray(self, (total, a_col))
 
-        buffer_values = self.context.create_buffer(self.flag_both, a_values)
+        kernel = self.Get_Kernel("UNIQUE_WRITE")
+        kernel.set_arg(0, buffer_array.buffer)
+        Set_Argument(kernel, 1, a_col, np.int32)
+        kernel.set_arg(2, perm.buffer)
+        kernel.set_arg(3, offsets.buffer)
+        kernel.set_arg(4, idx.buffer)
+        self.queue.execute_kernel(kernel, [a_row], None)
 
-        kernel = self.program.get_kernel("SET_LOWER_BOUNDARY")
+        values = None
+        if dictionary is not None:
+            values = np.array([dictionary.get(tuple(item), 1) for item in idx.Host().tolist()], dtype = np.float32)
 
-        kernel.set_arg(0, buffer_values)
-        Set_Argument(kernel, 1, minValue, np.int32)
+        return idx, values
 
-        self.queue.execute_kernel(kernel, (a_row), None)
-        self.queue.read_buffer(buffer_values, a_values)
+    def Lookup (self, array, table, missing = 1):
+        """
+        Get the annotations of the rows of an array from a sorted table (GAP_Data.Generate_Table)
+        :param array: An array
+        :type array: np.ndarray
+        :param table: (Sorted Indexes Array, Values Array)
+        :type table: tuple
+        :param missing: The value of rows that are not in the table
+        :type missing: float
+        :return: Values Array
+        :rtype: GAP_DeviceArray
+        """
+        a_row, a_col = np.shape(array)
+        keys, values = table
+        result = GAP_DeviceArray(self, (a_row,), np.float32)
+
+        if a_row == 0:
+            return result
+
+        buffer_array = self.Upload(array)
+        buffer_keys, buffer_values = self.Upload(keys), self.Upload(values, np.float32)
+
+        kernel = self.Get_Kernel("LOOKUP")
+        kernel.set_arg(0, buffer_keys.buffer)
+        Set_Argument(kernel, 1, np.shape(keys)[0], np.int32)
+        kernel.set_arg(2, buffer_values.buffer)
+        kernel.set_arg(3, buffer_array.buffer)
+        Set_Argument(kernel, 4, a_col, np.int32)
+        Set_Argument(kernel, 5, missing, np.float32)
+        kernel.set_arg(6, result.buffer)
+        self.queue.execute_kernel(kernel, [a_row], None)
 
-        return a_idx, a_values
-    """
+        return result
 
-    def SelectAbove_Full (self, a, virtual_places, data, minValue, toJoin = False):
+    def SelectAbove_Full (self, a, virtual_places, dataHolder, predicat, minValue, toJoin = False, places = None):
         """
         Execution the Full process of Select Above - Preparation for Select Above + Select Above
+        All the steps run on the device, the annotations are taken from the sorted table of the predicat.
         :param a: (Array, Physical Variables Picture)
         :param virtual_places:
-        :param data: The Dictionary to get the data from.
+        :param dataHolder: The data agent to get the data from.
+        :param predicat: The predicat of the block
         :param minValue: The minimum value
         :param toJoin: [Optional] if to join to the original array [default = FALSE]
+        :param places: [Optional] (physical places, Physical Variables Picture of the places, metadata of the join) -
+         precomputed by GAP_PhysicalPlan [default = created by the pictures]
         :return:
         """
         a_array, a_valsPic = a
-        physical_places, places_valsPic = Create_VarsPic_Virtual(a_valsPic, virtual_places), Create_VarsPic_Physical(
-            virtual_places, np.shape(a_valsPic)[0])
+        if places is None:
+            places = Create_VarsPic_Places(a_valsPic, virtual_places), Create_VarsPic_Physical(virtual_places,
+                np.shape(a_valsPic)[0]), None
+        physical_places, places_valsPic, join = places
 
         projection_array = self.Projection(a_array, physical_places)
-        distinct_array = self.Distinct(projection_array, data)
-        select_idx = self.SelectAbove(distinct_array, minValue)
+        distinct_idx, _vals = self.Distinct(projection_array)
+        distinct_values = self.Lookup(distinct_idx, dataHolder.Generate_Table(predicat))
+        select_idx = self.SelectAbove((distinct_idx, distinct_values), minValue)
 
         if toJoin:
-            return self.SuperJoin(a, (select_idx, places_valsPic))
+            return self.SuperJoin(a, (select_idx, places_valsPic), join)
         return select_idx, places_valsPic
 
 #endregion
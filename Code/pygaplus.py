@@ -1,13 +1,16 @@
 __author__ = "Bar Bokovza"
 
 #region Imports
+import os
+
 import numpy as np
 
 import Code.compiler as com
 import Code.dataHolder as holder
+from Code.basic import GAP_Stream
+from Code.worklist import GAP_Worklist
+from Code.magic import GAP_Magic, _Parse_Atom
 
-#from Code.basic import GAP_Basic
-from Code.opencl import GAP_OpenCL
 import sys
 #import time
 #import gc
@@ -21,8 +24,26 @@ comp = com.GAP_Compiler()
 intervals = 0
 MainDict = { }
 
-gpu = GAP_OpenCL("../External/OpenCL/Commands.cl")
-#gpu = GAP_Basic()
+gpu = None  ## created on the first use - Get_Backend()
+config = {
+    "backend": os.environ.get("GAPLUS_BACKEND", "opencl"),
+    "path": os.environ.get("GAPLUS_CL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+        "External", "OpenCL", "Commands.cl")),
+    "platform": int(os.environ.get("GAPLUS_CL_PLATFORM", "0")),
+    "device": int(os.environ["GAPLUS_CL_DEVICE"]) if "GAPLUS_CL_DEVICE" in os.environ else None,
+    "cache": os.environ.get("GAPLUS_CL_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "gaplus")),
+    "asynchronous": os.environ.get("GAPLUS_CL_ASYNC", "0") == "1",
+    "memory": int(os.environ["GAPLUS_MEMORY"]) if "GAPLUS_MEMORY" in os.environ else None,
+    "stream": int(os.environ.get("GAPLUS_STREAM", "0")),  ## rows in a batch of a streamed definition zone, 0 = off
+    "mode": os.environ.get("GAPLUS_MODE", "gauss"),       ## "gauss" (in place) / "jacobi" (double buffered) / "worklist"
+    "batch": int(os.environ.get("GAPLUS_BATCH", "1024")), ## atoms in a step of the worklist
+    "families": os.environ.get("GAPLUS_FAMILIES", "1") == "1",  ## evaluate the rule families together (GAP_Family)
+    "share": os.environ.get("GAPLUS_SHARE", "1") == "1",        ## share the joins of the rules in an interval
+    "rules": os.environ.get("GAPLUS_RULES_CACHE", ""),    ## directory of the compiled rules cache, "" = off
+}
+comp.Workers = int(os.environ.get("GAPLUS_WORKERS", "0"))  ## threads for the blocks and the joins of a rule
+comp.Processes = int(os.environ.get("GAPLUS_PROCESSES", "0"))  ## processes that compile the rules (PreRun)
+comp.Cache = com.GAP_RuleCache(config["rules"]) if config["rules"] else None  ## compiled rules ("" - no cache)
 
 #addedLst, changedLst = [], [] ## for predicats
 #toDefZone, toRun = [], []     ## for rules
@@ -31,36 +52,96 @@ add_fix_point = False
 changeSet = []
 
 def_zones = []
+worklist = None     ## GAP_Worklist - created when no atoms are added (worklist mode)
+seeds = { }         ## predicat -> improved atoms of the last interval (worklist mode)
+evaluations = 0     ## amount of rows of "Definition Zones" that the rules were executed on
 #endregion
 
 #region Help Commands
-print("GAPlus - GAP Compiler using OpenCL - By Bar Bokovza")
-print("===================================================")
-print("Commands :")
-print("===================================================")
-print("Load_Data(path:string)   - Load data to the Data Holder")
-print("Load_Rules(path:string)  - Load the rules from file")
-print("---------------------------------------------------")
-print("Add(rule:str)            - Add a rule to the compiler")
-print("---------------------------------------------------")
-print("Run()                    - Execute 1 times the GAP Rules")
-print("Run_FixPoint()           - Run until fix")
-print("---------------------------------------------------")
-print("Export_Data(path:str)    - Export the data from the engine to a csv file")
-print("Export_Rules([path:str]) - Export the compiled code from the engine to a file")
-print("Export_Rules()           - Prints the compiled")
-print("---------------------------------------------------")
-print("Reset()                  - Reset all the console")
-print("Reset_Data()             - Reset only the data from the console")
-print("Reset_Rules()            - Reset only the GAP rules from the console")
-print("---------------------------------------------------")
-print("Exit()                   - Close the prompt.")
-print("---------------------------------------------------")
-print("<command>                - Any accepted python 2.7.x command.")
-print("===================================================")
+def Print_Help ():
+    """
+    Print the commands of the console.
+    """
+    print("GAPlus - GAP Compiler using OpenCL - By Bar Bokovza")
+    print("===================================================")
+    print("Commands :")
+    print("===================================================")
+    print("Load_Data(path:string)   - Load data to the Data Holder")
+    print("Load_Rules(path:string)  - Load the rules from file")
+    print("Insert_Data(path:string) - Insert new facts after running, the next run continues from them")
+    print("Retract_Data(path:string)- Decrease / delete (annotation 0) facts, the next run derives the atoms again")
+    print("---------------------------------------------------")
+    print("Set_Backend(name[, platform:int, device:int]) - Choose \"opencl\" / \"basic\" / \"auto\" and the OpenCL device")
+    print("---------------------------------------------------")
+    print("Add(rule:str)            - Add a rule to the compiler")
+    print("---------------------------------------------------")
+    print("Run()                    - Execute 1 times the GAP Rules")
+    print("Run_FixPoint()           - Run until fix")
+    print("TopK(predicat:str, k:int[, maintain:bool]) - The k atoms with the highest annotations of the predicat")
+    print("Range(predicat:str, low:float[, high:float, index:bool]) - The atoms with annotations in [low, high]")
+    print("Query(atoms)             - Annotation of ground atoms, e.g. Query(\"g1_member(42)\") (without a full run)")
+    print("Set_Mode(mode:str)       - \"gauss\" (rules see the atoms of this interval) / \"jacobi\" / \"worklist\"")
+    print("Join_Statistics()        - The reuse of the joins that are shared by the rules in an interval")
+    print("---------------------------------------------------")
+    print("Export_Data(path:str)    - Export the data from the engine to a csv file")
+    print("Export_Rules([path:str]) - Export the compiled code from the engine to a file")
+    print("Export_Rules()           - Prints the compiled")
+    print("---------------------------------------------------")
+    print("Reset()                  - Reset all the console")
+    print("Reset_Data()             - Reset only the data from the console")
+    print("Reset_Rules()            - Reset only the GAP rules from the console")
+    print("---------------------------------------------------")
+    print("Exit()                   - Close the prompt.")
+    print("---------------------------------------------------")
+    print("<command>                - Any accepted python 2.7.x command.")
+    print("===================================================")
 #endregion
 
 #region Functions
+def Get_Backend ():
+    """
+    Get the execution agent for the relational functions - it is created (and the OpenCL program is built) only
+    in the first use.
+    :return: GAP_OpenCL / GAP_Basic / GAP_Dispatch
+    """
+    global gpu
+
+    if gpu is None:
+        if config["backend"] == "basic":
+            from Code.basic import GAP_Basic
+            gpu = GAP_Basic(config["memory"])
+        elif config["backend"] == "auto":
+            from Code.basic import GAP_Basic
+            from Code.opencl import GAP_OpenCL
+            from Code.dispatch import GAP_Dispatch
+            gpu = GAP_Dispatch(GAP_Basic(config["memory"]), GAP_OpenCL(config["path"], config["platform"], config["device"],
+                config["cache"], config["asynchronous"]))
+        else:
+            from Code.opencl import GAP_OpenCL
+            gpu = GAP_OpenCL(config["path"], config["platform"], config["device"], config["cache"],
+                config["asynchronous"])
+
+    return gpu
+
+def Set_Backend (name = "opencl", platform = 0, device = None, asynchronous = False):
+    """
+    Choose the execution agent, it will be created in the next use.
+    :type name: str
+    :param name: "opencl" / "basic" / "auto" (every function on the cheaper of both)
+    :type platform: int
+    :param platform: index of the OpenCL platform
+    :type device: int
+    :param device: [Optional] index of the OpenCL device [default = the first GPU]
+    :type asynchronous: bool
+    :param asynchronous: [Optional] non-blocking OpenCL uploads and reads [default = False]
+    :rtype: void
+    """
+    global gpu
+
+    config["backend"], config["platform"], config["device"] = name, platform, device
+    config["asynchronous"] = asynchronous
+    gpu = None
+
 def Load_Data (path):
     """
     Loaded the csv file in the path to the data holder.
@@ -70,6 +151,54 @@ def Load_Data (path):
     """
     dataHold.Load(path)
 
+def Insert_Data (path):
+    """
+    Insert the facts in the csv file to the data holder. If the rules were already executed, the next Run /
+    Run_FixPoint continues from the current atoms, and executes only the rows of the "Definition Zones" of the new
+    facts (and of the atoms that they improve) - using the worklist.
+    :type path: str
+    :param path: csv file path that contains the new facts
+    :rtype: void
+    """
+    global fix_point
+
+    inserted = dataHold.Insert(path)
+    if intervals == 0 and not fix_point:  ## the rules were not executed (a first interval can reach a fix point)
+        return
+
+    lst = Get_Worklist()
+    for predicat, (added, changes) in inserted.items():
+        if added > 0:
+            lst.Grow(predicat)
+        lst.Push(predicat, changes)
+
+    fix_point = False
+
+def Retract_Data (path):
+    """
+    Decrease / delete (annotation 0) the facts in the csv file (DRed). If the rules were already executed, all the atoms
+    that were derived from the facts are deleted (over deletion), and the next Run / Run_FixPoint derives them again
+    from the remaining atoms - only the rows of the deleted atoms are executed (using the worklist).
+    :type path: str
+    :param path: csv file path that contains the facts with their new annotations
+    :rtype: void
+    """
+    global fix_point, worklist
+
+    retracted = dataHold.Retract(path)
+    if intervals == 0 and not fix_point:
+        dataHold.Rollback(retracted)
+        return
+
+    deleted = Get_Worklist().Reach(retracted)
+    dataHold.Rollback(deleted)
+
+    batch = list(range(len(comp.Rules)))
+    worklist = GAP_Worklist(comp.Rules, comp.Create_DefinitionZones(batch, dataHold, Get_Backend()), config["batch"])
+    worklist.Mark(deleted)
+
+    fix_point = False
+
 def Load_Rules (path):
     """
     Load the rules in the GAP file to the console.
@@ -102,12 +231,33 @@ def PreRun ():
     global MainDict
 
     MainDict = dataHold.data
-    for i in range(len(comp.Rules)):
-        rule = comp.Rules[i]
+    for predicat in comp.GetPredicats():  ## the compiled code reads the dictionaries of all the predicats
+        if not predicat in MainDict:
+            MainDict[predicat] = { }
+    comp.PreRun()
+
+    for rule in comp.Rules:
         changeSet.append((0, 0))
-        rule.Arrange_Execution(i, 0)
         def_zones.append((np.zeros(0, dtype = np.int32), np.zeros(0, dtype = np.int32)))
         exec(rule.Code_Run, globals())
+        exec(rule.Code_Jacobi, globals())
+
+    if config["families"]:
+        comp.Create_Families()
+    else:
+        comp.Families.clear()
+    comp.Joins = com.GAP_JoinCache() if config["share"] else None
+
+def Set_Mode (mode = "gauss"):
+    """
+    Choose how an interval executes the rules.
+    :type mode: str
+    :param mode: "gauss" - every rule sees the atoms of the rules before it in the interval /
+     "jacobi" - every rule sees only the atoms of the previous interval, and the rules can run in parallel /
+     "worklist" - like "gauss" until no atoms are added, then only the rows of the improved atoms are executed
+    :rtype: void
+    """
+    config["mode"] = mode
 
 def Interval ():
     """
@@ -117,21 +267,54 @@ def Interval ():
     global comp
     global dataHolder
     global fix_point, add_fix_point
-    global intervals
+    global intervals, evaluations
+
+    if worklist is not None:  ## after Insert_Data / Retract_Data (in every mode) - only the rows of the changes
+        return Interval_Worklist()
+    if config["mode"] == "jacobi":
+        return Interval_Jacobi()
+    if config["mode"] == "worklist" and add_fix_point:
+        return Interval_Worklist()
 
     #toDefZone.clear(), toRun.clear(), addedLst.clear(), changedLst.clear()
 
     added, changed = 0, 0
-
-    for i in range(len(comp.Rules)):
-        rule = comp.Rules[i]
-        if not add_fix_point:
-            def_zones[i] = rule.Create_DefinitionZone(dataHold, gpu)
-        exec(compile("Rule_{0}(def_zones[{0}], changeSet, {0})".format(i), "<string>", "exec"))
-        add, change = changeSet[i]
-        #print("#{0} -> {1},{2}".format(i, added, changed))
-        added += add
-        changed += changed
+    seeds.clear()
+    Clear_Joins()
+    families = {family.Indexes[0]: family for family in comp.Families} if config["stream"] == 0 else { }
+    members = set(i for family in families.values() for i in family.Indexes[1:])
+
+    for batch in comp.Create_Batches():
+        if config["stream"] > 0:
+            pass  ## a stream is used once - it is created right before the rule
+        elif not add_fix_point:
+            zones = comp.Create_DefinitionZones(batch, dataHold, Get_Backend())
+            for i, zone in zip(batch, zones):
+                def_zones[i] = zone
+
+        for i in batch:
+            rule = comp.Rules[i]
+            if config["stream"] > 0:
+                def_zones[i] = rule.Stream_DefinitionZone(dataHold, Get_Backend(), config["stream"], comp.Get_Pool())
+            if i in families:
+                Execute_Family(families[i])
+            elif i in members:
+                pass  ## executed with the first rule of its family
+            elif config["mode"] == "worklist" or dataHold.Watched(rule.Header.Predicat):
+                changes = seeds.setdefault(rule.Header.Predicat, [])
+                start = len(changes)
+                globals()["Rule_{0}".format(i)](def_zones[i], changeSet, i, changes)
+                dataHold.Raise(rule.Header.Predicat, changes[start:])
+            else:
+                exec(compile("Rule_{0}(def_zones[{0}], changeSet, {0})".format(i), "<string>", "exec"))
+            evaluations += _Rows(def_zones[i])
+            add, change = changeSet[i]
+            #print("#{0} -> {1},{2}".format(i, added, changed))
+            added += add
+            changed += change
+
+            if add + change > 0:
+                dataHold.Touch(rule.Header.Predicat)
 
     if added == 0:
         if changed == 0:
@@ -201,11 +384,155 @@ def Interval ():
     intervals += 1
 """
 
+def Execute_Family (family):
+    """
+    Execute the rules of a family together (GAP_Family) - the results are in changeSet by the indexes of the rules
+    :param family: The family
+    :type family: com.GAP_Family
+    :return: void
+    """
+    predicats = [header.Predicat for header in family.Headers]
+
+    if config["mode"] == "worklist":
+        results = family.Execute(dataHold, comp.e, [seeds.setdefault(predicat, []) for predicat in predicats])
+    else:
+        results = family.Execute(dataHold, comp.e)
+
+    for i, result in zip(family.Indexes, results):
+        changeSet[i] = result
+
+def Clear_Joins ():
+    """
+    Start a new interval of the shared joins (GAP_JoinCache)
+    :return: void
+    """
+    if comp.Joins is not None:
+        comp.Joins.Clear()
+
+def Join_Statistics ():
+    """
+    The reuse of the joins that are shared by the rules (GAP_JoinCache) since the first interval.
+    :return: {"hits": joins that were reused, "misses": joins that were computed, "rows": rows that were reused,
+     "reuse": rate of the reused joins}
+    :rtype: dict
+    """
+    if comp.Joins is None:
+        return {"hits": 0, "misses": 0, "rows": 0, "reuse": 0.0}
+    return comp.Joins.Statistics()
+
+def Interval_Jacobi ():
+    """
+    Execute all the rules in the compiler once, on the data of the previous interval - every rule writes to its own
+    delta, and the deltas are merged (max) at the end of the interval.
+    :return: void
+    """
+    global fix_point, add_fix_point
+    global intervals, evaluations
+
+    batch = list(range(len(comp.Rules)))
+    deltas = [{ } for i in batch]
+    Clear_Joins()
+
+    if config["stream"] > 0:
+        for i in batch:
+            def_zones[i] = comp.Rules[i].Stream_DefinitionZone(dataHold, Get_Backend(), config["stream"],
+                comp.Get_Pool())
+    elif not add_fix_point:
+        zones = comp.Create_DefinitionZones(batch, dataHold, Get_Backend())
+        for i, zone in zip(batch, zones):
+            def_zones[i] = zone
+
+    def Execute (i):
+        globals()["Jacobi_{0}".format(i)](def_zones[i], changeSet, i, deltas[i])
+
+    pool = comp.Get_Pool()
+    if pool is not None:
+        list(pool.map(Execute, batch))
+    else:
+        for i in batch:
+            Execute(i)
+    evaluations += sum(_Rows(def_zones[i]) for i in batch)
+
+    added, changed, predicats = comp.Merge_Deltas(dataHold, deltas)
+
+    if added == 0:
+        if changed == 0:
+            fix_point = True
+            return
+        else:
+            add_fix_point = True
+
+    intervals += 1
+
+def Get_Worklist ():
+    """
+    Get the worklist - it is created on the "Definition Zones" of the last interval, with the improved atoms of the
+    last interval.
+    :return: GAP_Worklist
+    """
+    global worklist
+
+    if worklist is None:
+        if config["stream"] > 0:  ## the streams were used, the worklist needs the rows
+            zones = comp.Create_DefinitionZones(list(range(len(comp.Rules))), dataHold, Get_Backend())
+        else:
+            zones = def_zones
+
+        worklist = GAP_Worklist(comp.Rules, zones, config["batch"])
+        for predicat, changes in seeds.items():
+            worklist.Push(predicat, changes)
+        seeds.clear()
+
+    return worklist
+
+def Interval_Worklist ():
+    """
+    Execute a single step of the worklist - the new rows of the "Definition Zones" (if atoms were added), or the rows
+    of the atoms with the largest improvements.
+    :return: void
+    """
+    global fix_point
+    global intervals, evaluations
+
+    lst = Get_Worklist()
+    if lst.Empty():
+        fix_point = True
+        return
+
+    def Execute (i, zone, changes):
+        globals()["Rule_{0}".format(i)](zone, changeSet, i, changes)
+        dataHold.Raise(comp.Rules[i].Header.Predicat, changes)
+        return changeSet[i]
+
+    def Create (batch):
+        Clear_Joins()
+        return comp.Create_DefinitionZones(batch, dataHold, Get_Backend())
+
+    before = lst.evaluations
+    added, changed, predicats = lst.Step(Execute, Create)
+    evaluations += lst.evaluations - before
+
+    for predicat in predicats:
+        dataHold.Touch(predicat)
+
+    intervals += 1
+
+def _Rows (zone):
+    """
+    :param zone: "Definition Zone" (Array / GAP_Stream, Physical Variables Picture)
+    :type zone: tuple
+    :return: amount of rows in the "Definition Zone" (of a stream - the rows that were used)
+    :rtype: int
+    """
+    if isinstance(zone[0], GAP_Stream):
+        return zone[0].rows
+    return int(np.shape(zone[0])[0])
+
 def Run ():
     """
     Execute Single Interval
     """
-    if intervals is 0:
+    if intervals is 0 and worklist is None:
         PreRun()
 
     Interval()
@@ -214,12 +541,70 @@ def Run_FixPoint ():
     """
     Run the GAP rules until reaching a fix point
     """
-    if intervals is 0:
+    if intervals is 0 and worklist is None:
         PreRun()
 
     while not fix_point:
         Interval()
 
+def TopK (predicat, k, maintain = False):
+    """
+    Get the k atoms with the highest annotations of a predicat.
+    :type predicat: str
+    :param predicat: the predicat
+    :type k: int
+    :param k: amount of atoms
+    :type maintain: bool
+    :param maintain: [Optional] keep a heap of the k atoms, that is updated by the rules [default = False]
+    :return: list of (key, annotation), from the highest
+    :rtype: list
+    """
+    if maintain and (predicat not in dataHold.heaps or dataHold.heaps[predicat].k < k):
+        dataHold.Maintain_TopK(predicat, k)
+
+    keys, values = dataHold.TopK(predicat, k)
+    return list(zip(map(tuple, keys.tolist()), values.tolist()))
+
+def Range (predicat, low, high = None, index = False):
+    """
+    Get the atoms of a predicat with annotations in [low, high].
+    :type predicat: str
+    :param predicat: the predicat
+    :type low: float
+    :param low: the minimum annotation
+    :type high: float
+    :param high: [Optional] the maximum annotation [default = no maximum]
+    :type index: bool
+    :param index: [Optional] keep an annotation index of the predicat (binary search in the next queries, and in the
+     Select Above blocks of the rules) [default = False]
+    :return: list of (key, annotation), sorted by the annotations
+    :rtype: list
+    """
+    if index and not dataHold.Indexed(predicat):
+        dataHold.Index_Annotations(predicat)
+
+    keys, values = dataHold.Range(predicat, low, high)
+    return list(zip(map(tuple, keys.tolist()), values.tolist()))
+
+def Query (atoms):
+    """
+    Get the annotations of ground atoms. After a fix point they are taken from the data, else only the atoms that
+    are relevant to them are derived (magic sets) - without running all the rules and without changing the console.
+    :type atoms: str / list
+    :param atoms: ground atom (for example : "g1_member(42)") or list of ground atoms
+    :return: the annotation (0 if the atom is not derived) / list of the annotations
+    """
+    lst = [atoms] if isinstance(atoms, str) else list(atoms)
+
+    if intervals > 0 and fix_point:
+        result = []
+        for predicat, key in map(_Parse_Atom, lst):
+            result.append(MainDict[predicat].get(key, 0.0) if predicat in MainDict else 0.0)
+    else:
+        result = GAP_Magic(comp).Query(lst, dataHold, Get_Backend(), config["families"], config["share"])
+
+    return result[0] if isinstance(atoms, str) else result
+
 def Reset ():
     """
     Clean all the console from all the rules and data.
@@ -244,20 +629,21 @@ def Reset_Data ():
     """
     Clear the data holder.
     """
-    global intervals, def_zones, changeSet
+    global intervals, def_zones, changeSet, evaluations, worklist
     dataHold.Reset()
     MainDict.clear()
     def_zones.clear()
     changeSet.clear()
-    intervals = 0
+    seeds.clear()
+    intervals, evaluations, worklist = 0, 0, None
 
 def Reset_Rules ():
     """
     Clear the compiler from GAP Rules
     """
-    global intervals
+    global intervals, worklist
     comp.Reset()
-    intervals = 0
+    intervals, worklist = 0, None
 
 def Exit ():
     """
@@ -305,11 +691,14 @@ def Benchmark (dataPath:str = "../External/Data/fb-net1.csv", rulesPath:str = ".
 
 #Benchmark(max = 100)
 
-while True:
-    command = sys.stdin.readline()
-    try:
-        exec(command)
-    except Exception as e:
-        print("> Exception : {0}".format(e))
-    finally:
-        print("> Done !")
+if __name__ == "__main__":
+    Print_Help()
+
+    while True:
+        command = sys.stdin.readline()
+        try:
+            exec(command)
+        except Exception as e:
+            print("> Exception : {0}".format(e))
+        finally:
+            print("> Done !")
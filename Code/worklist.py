@@ -0,0 +1,253 @@
+__author__ = "Bar Bokovza"
+
+#region Imports
+import heapq
+
+import numpy as np
+
+from Code.basic import Group_Rows
+from Code.compiler import BlockType
+#endregion
+
+#region Private Functions
+def _Canonical (zone, total):
+    """
+    The rows of a "Definition Zone" with the columns in the order of the variables of the rule
+    :param zone: (Array, Physical Variables Picture)
+    :type zone: tuple
+    :param total: amount of variables of the rule
+    :type total: int
+    :return: Array (rows x total)
+    :rtype: np.ndarray
+    """
+    assigns = np.asarray(zone[0])
+    if np.shape(assigns)[0] == 0:
+        return np.zeros((0, total), dtype = np.int32)
+
+    return np.ascontiguousarray(assigns[:, [zone[1][i] for i in range(total)]], dtype = np.int32)
+
+#endregion
+
+#region GAP Worklist
+class GAP_Worklist:
+    """
+    Priority worklist of the atoms whose annotations were improved.
+    Every row of the "Definition Zones" of the rules is indexed by the atoms of its annotation blocks. Every step takes
+    the atoms with the largest improvements (Dijkstra-like) and executes the rules only on the rows that read them - the
+    improvements of the header atoms are pushed back to the worklist.
+    When atoms are added, the zones of the rules that use their predicats are created again and only the new rows are
+    executed (and indexed). When atoms are deleted (DRed), the atoms that were derived from them are found by the
+    indexes and only the rows of these atoms are executed again.
+    """
+
+    def __init__ (self, rules, zones, batch = 1024):
+        """
+        Initialization
+        :param rules: The rules of the compiler
+        :type rules: list
+        :param zones: The "Definition Zones" of the rules (Array, Physical Variables Picture)
+        :type zones: list
+        :param batch: [Optional] amount of atoms in a step [default = 1024]
+        :type batch: int
+        """
+        self.rules, self.batch = rules, batch
+        self.zones, self.rows, self.indexes = [], [], { }
+        self.heap, self.pending, self.growing, self.marked = [], { }, [], { }
+        self.count, self.evaluations = 0, 0
+
+        for i in range(len(rules)):
+            total = len(rules[i].Dictionary)
+            self.zones.append((np.zeros((0, total), dtype = np.int32), np.arange(total, dtype = np.int32)))
+            self.rows.append(set())
+
+            for block in rules[i].Body:
+                self.indexes.setdefault(block.Predicat, []).append((i, block, { },
+                    block.Type == BlockType.ANNOTATION))
+
+            self.Extend(i, zones[i])
+
+    def Extend (self, i, zone):
+        """
+        Add the new rows of a "Definition Zone" of a rule to the worklist (and to the indexes)
+        :param i: the index of the rule
+        :type i: int
+        :param zone: The "Definition Zone" of the rule (Array, Physical Variables Picture)
+        :type zone: tuple
+        :return: Array of the new rows (in the order of the variables of the rule)
+        :rtype: np.ndarray
+        """
+        assigns, varsPic = self.zones[i]
+        rows, seen = _Canonical(zone, len(varsPic)), self.rows[i]
+
+        new = [r for r, row in enumerate(map(tuple, rows.tolist())) if row not in seen and not seen.add(row)]
+        rows = rows[new]
+        if np.shape(rows)[0] == 0:
+            return rows
+
+        offset = np.shape(assigns)[0]
+        self.zones[i] = np.concatenate([assigns, rows]), varsPic
+
+        for predicat, lst in self.indexes.items():
+            for rule, block, index, annotation in lst:
+                if rule != i:
+                    continue
+
+                for key, found in Group_Rows(block.Create_Keys(rows)).items():
+                    found = found + offset
+                    index[key] = found if key not in index else np.concatenate([index[key], found])
+
+        return rows
+
+    def Grow (self, predicat):
+        """
+        Mark that atoms were added to a predicat - the next step extends the zones of the rules that use it
+        :param predicat: The predicat
+        :type predicat: str
+        """
+        if predicat not in self.growing:
+            self.growing.append(predicat)
+
+    def Reach (self, atoms):
+        """
+        Find all the atoms that were derived (directly or not) from atoms - the over deletion of DRed
+        :param atoms: dict {predicat: set of keys}
+        :type atoms: dict
+        :return: dict {predicat: set of keys} - the atoms and all the atoms that were derived from them
+        :rtype: dict
+        """
+        result = {predicat: set(keys) for predicat, keys in atoms.items()}
+        queue = [(predicat, key) for predicat, keys in atoms.items() for key in keys]
+
+        while len(queue) > 0:
+            predicat, key = queue.pop()
+
+            for i, block, index, annotation in self.indexes.get(predicat, []):
+                found = index.get(key)
+                if found is None:
+                    continue
+
+                header = self.rules[i].Header
+                reached = result.setdefault(header.Predicat, set())
+
+                for head in map(tuple, header.Create_Keys(self.zones[i][0][found]).tolist()):
+                    if head not in reached:
+                        reached.add(head)
+                        queue.append((header.Predicat, head))
+
+        return result
+
+    def Mark (self, atoms):
+        """
+        Mark atoms to derive again - the next step executes the rows of their header atoms
+        :param atoms: dict {predicat: set of keys}
+        :type atoms: dict
+        """
+        for predicat, keys in atoms.items():
+            self.marked.setdefault(predicat, set()).update(keys)
+
+    def Push (self, predicat, changes):
+        """
+        Add improved atoms to the worklist
+        :param predicat: The predicat of the atoms
+        :type predicat: str
+        :param changes: list of (key, improvement)
+        :type changes: list
+        """
+        if predicat not in self.indexes:
+            return
+
+        for key, improvement in changes:
+            item = predicat, tuple(map(int, key))
+            improvement += self.pending.get(item, 0.0)
+            self.pending[item] = improvement
+
+            self.count += 1
+            heapq.heappush(self.heap, (-improvement, self.count, item))
+
+    def Pop (self):
+        """
+        Take the atoms with the largest improvements (a single batch)
+        :return: {index of rule: array of the indexes of the rows to execute}
+        :rtype: dict
+        """
+        rows = { }
+        taken = 0
+
+        while len(self.heap) > 0 and taken < self.batch:
+            improvement, count, item = heapq.heappop(self.heap)
+            if self.pending.get(item) != -improvement:
+                continue  ## an older entry of the atom
+
+            del self.pending[item]
+            taken += 1
+
+            predicat, key = item
+            for i, block, index, annotation in self.indexes[predicat]:
+                found = index.get(key) if annotation else None
+                if found is not None:
+                    rows.setdefault(i, []).append(found)
+
+        return {i: np.unique(np.concatenate(lst)) for i, lst in rows.items()}
+
+    def Step (self, execute, create):
+        """
+        Execute the rules on the new rows of the zones (if atoms were added), on the rows of the marked atoms (if atoms
+        were deleted) or on the rows of the atoms with the largest improvements
+        :param execute: function (index of rule, "Definition Zone", changes list) -> (amount of added atoms,
+         amount of changed atoms)
+        :param create: function (list of indexes of rules) -> list of their "Definition Zones"
+        :return: (amount of added atoms, amount of changed atoms, list of changed predicats)
+        :rtype: tuple
+        """
+        added, changed, predicats = 0, 0, []
+
+        if len(self.growing) > 0:
+            growing, self.growing = self.growing, []
+            batch = [i for i in range(len(self.rules)) if any(scan[0] in growing for scan in self.rules[i].Plan.Scans)]
+            rows = {i: self.Extend(i, zone) for i, zone in zip(batch, create(batch))}
+            zones = {i: (rows[i], self.zones[i][1]) for i in batch}
+        elif len(self.marked) > 0:
+            marked, self.marked = self.marked, { }
+            rows = { }
+
+            for i in range(len(self.rules)):
+                header = self.rules[i].Header
+                keys = marked.get(header.Predicat)
+                if keys is None:
+                    continue
+
+                heads = header.Create_Keys(self.zones[i][0]).tolist()
+                rows[i] = np.array([r for r, head in enumerate(heads) if tuple(head) in keys], dtype = np.int64)
+
+            zones = {i: (self.zones[i][0][rows[i]], self.zones[i][1]) for i in rows.keys()}
+        else:
+            rows = self.Pop()
+            zones = {i: (self.zones[i][0][rows[i]], self.zones[i][1]) for i in rows.keys()}
+
+        for i in sorted(zones.keys()):
+            if len(rows[i]) == 0:
+                continue
+
+            changes = []
+            add, change = execute(i, zones[i], changes)
+            self.evaluations += len(rows[i])
+            added, changed = added + add, changed + change
+
+            predicat = self.rules[i].Header.Predicat
+            if add > 0:
+                self.Grow(predicat)
+            if len(changes) > 0:
+                self.Push(predicat, changes)
+                if predicat not in predicats:
+                    predicats.append(predicat)
+
+        return added, changed, predicats
+
+    def Empty (self):
+        """
+        :return: True if there are no improved atoms, no added atoms and no marked atoms in the worklist
+        :rtype: bool
+        """
+        return len(self.pending) == 0 and len(self.growing) == 0 and len(self.marked) == 0
+
+#endregion
@@ -3,56 +3,337 @@
 #pragma OPENCL EXTENSION cl_khr_global_int32_extended_atomics : enable
 #pragma OPENCL EXTENSION cl_khr_local_int32_extended_atomics : enable
 
+/// Cartesian product - row (x, y) of the result is written to x * b_row + y
 __kernel
 void CARTESIAN(__global const int* a, int a_col, __global const int* a_varsPic,
-               __global const int* b, int b_col, __global const int* b_varsPic,
-               __global int* target, __global const int* join_varsPic)
+               __global const int* b, int b_row, int b_col, __global const int* b_varsPic,
+               __global int* target, __global const int* join_varsPic, int varsPic_size, int target_col)
 {
-    int x = get_global_id(0), y = get_global_id(1), z = get_global_id(2);
-    int rowPosition = x * b_col + y, i;
-    
-    if (join_varsPic[z] != -1)
+    int x = get_global_id(0), y = get_global_id(1), z;
+    int rowPosition = (x * b_row + y) * target_col;
+
+    for (z = 0; z < varsPic_size; z++)
     {
-        if(a_varsPic[z] != -1)
-            target[rowPosition * (a_col + b_col) + join_varsPic[z]] = a[x * a_col + a_varsPic[z]];
-        else
-            target[rowPosition * (a_col + b_col) + join_varsPic[z]] = b[y * b_col + b_varsPic[z]];
+        if (join_varsPic[z] != -1)
+        {
+            if(a_varsPic[z] != -1)
+                target[rowPosition + join_varsPic[z]] = a[x * a_col + a_varsPic[z]];
+            else
+                target[rowPosition + join_varsPic[z]] = b[y * b_col + b_varsPic[z]];
+        }
     }
 }
 
-__kernel
-void SUPER_JOIN(__global const int* a, const int a_col, __global const int* a_varsPic,
-          __global const int* b, const int b_col, __global const int* b_varsPic,
-          __global const int* joinLst, const int joinLst_length,
-          __global const int* join_varsPic, const int varsPic_size,
-          __global int* result, __global int* current)
+int IsJoined(__global const int* a, const int a_col, __global const int* a_varsPic,
+             __global const int* b, const int b_col, __global const int* b_varsPic,
+             __global const int* joinLst, const int joinLst_length, int x, int y)
 {
-    int x = get_global_id(0), y = get_global_id(1);
-    int array_size = a_col + b_col - joinLst_length;
-        
-    int isOk = 1, i = 0;
-    for (i = 0;i < joinLst_length; i++) {
+    for (int i = 0; i < joinLst_length; i++) {
         int join = joinLst[i];
-        if (a[x*a_col + a_varsPic[join]] != b[y*b_col+b_varsPic[join]])
-        {
-            isOk = 0;
-        }
+        if (a[x*a_col + a_varsPic[join]] != b[y*b_col + b_varsPic[join]])
+            return 0;
     }
-    
-    if (isOk == 1){
-        int curr  = atomic_add(current, 1), count = 0;
-        
-        for(i = 0; i < varsPic_size; i++){
+    return 1;
+}
+
+/// Join - phase 1 : counts[x] = amount of rows in b that match row x in a
+__kernel
+void SUPER_JOIN_COUNT(__global const int* a, const int a_col, __global const int* a_varsPic,
+                      __global const int* b, const int b_row, const int b_col, __global const int* b_varsPic,
+                      __global const int* joinLst, const int joinLst_length, __global int* counts)
+{
+    int x = get_global_id(0), y, count = 0;
+
+    for (y = 0; y < b_row; y++)
+        count += IsJoined(a, a_col, a_varsPic, b, b_col, b_varsPic, joinLst, joinLst_length, x, y);
+
+    counts[x] = count;
+}
+
+/// Join - phase 2 : the matches of row x in a are written (in the order of b) from offsets[x]
+__kernel
+void SUPER_JOIN_WRITE(__global const int* a, const int a_col, __global const int* a_varsPic,
+                      __global const int* b, const int b_row, const int b_col, __global const int* b_varsPic,
+                      __global const int* joinLst, const int joinLst_length,
+                      __global const int* join_varsPic, const int varsPic_size,
+                      __global const int* offsets, __global int* result, const int result_col)
+{
+    int x = get_global_id(0), y, i;
+    int curr = offsets[x];
+
+    for (y = 0; y < b_row; y++) {
+        if (IsJoined(a, a_col, a_varsPic, b, b_col, b_varsPic, joinLst, joinLst_length, x, y) == 0)
+            continue;
+
+        for (i = 0; i < varsPic_size; i++) {
             if (join_varsPic[i] >= 0)
             {
-                if(a_varsPic[i] >= 0)
-                    result[curr*array_size + join_varsPic[i]] = a[x*a_col + a_varsPic[i]];
+                if (a_varsPic[i] >= 0)
+                    result[curr*result_col + join_varsPic[i]] = a[x*a_col + a_varsPic[i]];
                 else
-                    result[curr*array_size + join_varsPic[i]] = b[y*b_col + b_varsPic[i]];
+                    result[curr*result_col + join_varsPic[i]] = b[y*b_col + b_varsPic[i]];
             }
         }
+        curr++;
     }
-    
+}
+
+/// Tiled join - the work-group copies blocks of b (tile) and the metadata (meta) to local memory.
+/// meta : [0, J) - join columns of a, [J, 2J) - join columns of b, and in the write phase
+/// [2J, 2J+V) - a_varsPic, [2J+V, 2J+2V) - b_varsPic, [2J+2V, 2J+3V) - join_varsPic
+void Load_Join_Meta(__global const int* a_varsPic, __global const int* b_varsPic, __global const int* joinLst,
+                    const int joinLst_length, __local int* meta)
+{
+    int lid = get_local_id(0), size = get_local_size(0), i;
+
+    for (i = lid; i < joinLst_length; i += size) {
+        meta[i] = a_varsPic[joinLst[i]];
+        meta[joinLst_length + i] = b_varsPic[joinLst[i]];
+    }
+}
+
+int Load_Tile(__global const int* b, const int b_row, const int b_col, int base, __local int* tile)
+{
+    int lid = get_local_id(0), size = get_local_size(0), i;
+    int rows = min(size, b_row - base);
+
+    for (i = lid; i < rows * b_col; i += size)
+        tile[i] = b[base * b_col + i];
+
+    return rows;
+}
+
+int IsJoined_Tile(__global const int* a, const int a_col, int x, __local const int* tile, const int b_col, int y,
+                  __local const int* meta, const int joinLst_length)
+{
+    for (int i = 0; i < joinLst_length; i++) {
+        if (a[x*a_col + meta[i]] != tile[y*b_col + meta[joinLst_length + i]])
+            return 0;
+    }
+    return 1;
+}
+
+__kernel
+void SUPER_JOIN_COUNT_TILED(__global const int* a, const int a_row, const int a_col, __global const int* a_varsPic,
+                            __global const int* b, const int b_row, const int b_col, __global const int* b_varsPic,
+                            __global const int* joinLst, const int joinLst_length, __global int* counts,
+                            __local int* tile, __local int* meta)
+{
+    int x = get_global_id(0), base, y, rows, count = 0;
+
+    Load_Join_Meta(a_varsPic, b_varsPic, joinLst, joinLst_length, meta);
+
+    for (base = 0; base < b_row; base += get_local_size(0)) {
+        barrier(CLK_LOCAL_MEM_FENCE);
+        rows = Load_Tile(b, b_row, b_col, base, tile);
+        barrier(CLK_LOCAL_MEM_FENCE);
+
+        if (x < a_row) {
+            for (y = 0; y < rows; y++)
+                count += IsJoined_Tile(a, a_col, x, tile, b_col, y, meta, joinLst_length);
+        }
+    }
+
+    if (x < a_row)
+        counts[x] = count;
+}
+
+__kernel
+void SUPER_JOIN_WRITE_TILED(__global const int* a, const int a_row, const int a_col, __global const int* a_varsPic,
+                            __global const int* b, const int b_row, const int b_col, __global const int* b_varsPic,
+                            __global const int* joinLst, const int joinLst_length,
+                            __global const int* join_varsPic, const int varsPic_size,
+                            __global const int* offsets, __global int* result, const int result_col,
+                            __local int* tile, __local int* meta)
+{
+    int x = get_global_id(0), lid = get_local_id(0), base, y, i, rows, curr = 0;
+    __local int* m_a = meta + 2 * joinLst_length;
+    __local int* m_b = m_a + varsPic_size;
+    __local int* m_join = m_b + varsPic_size;
+
+    Load_Join_Meta(a_varsPic, b_varsPic, joinLst, joinLst_length, meta);
+    for (i = lid; i < varsPic_size; i += get_local_size(0)) {
+        m_a[i] = a_varsPic[i];
+        m_b[i] = b_varsPic[i];
+        m_join[i] = join_varsPic[i];
+    }
+
+    if (x < a_row)
+        curr = offsets[x];
+
+    for (base = 0; base < b_row; base += get_local_size(0)) {
+        barrier(CLK_LOCAL_MEM_FENCE);
+        rows = Load_Tile(b, b_row, b_col, base, tile);
+        barrier(CLK_LOCAL_MEM_FENCE);
+
+        if (x >= a_row)
+            continue;
+
+        for (y = 0; y < rows; y++) {
+            if (IsJoined_Tile(a, a_col, x, tile, b_col, y, meta, joinLst_length) == 0)
+                continue;
+
+            for (i = 0; i < varsPic_size; i++) {
+                if (m_join[i] >= 0)
+                {
+                    if (m_a[i] >= 0)
+                        result[curr*result_col + m_join[i]] = a[x*a_col + m_a[i]];
+                    else
+                        result[curr*result_col + m_join[i]] = tile[y*b_col + m_b[i]];
+                }
+            }
+            curr++;
+        }
+    }
+}
+
+int ToFilter(__global const int* a, const int a_col, __global const int* places, const int places_row, int x)
+{
+    for(int i = 0; i < places_row; i++) {
+        if (a[x*a_col + places[2*i]] != a[x*a_col + places[2*i+1]])
+            return 0;
+    }
+    return 1;
+}
+
+/// Fused join - the filters of both sides (pairs of equal columns) are checked in the probe, the join keys are
+/// pairs of (column in a, column in b) and every output column is a pair of (side : 0 = a / 1 = b, column).
+int IsJoined_Fused(__global const int* a, const int a_col, int x, __global const int* b, const int b_col, int y,
+                   __global const int* keys, const int keys_length)
+{
+    for (int i = 0; i < keys_length; i++) {
+        if (a[x*a_col + keys[2*i]] != b[y*b_col + keys[2*i+1]])
+            return 0;
+    }
+    return 1;
+}
+
+__kernel
+void FUSED_JOIN_COUNT(__global const int* a, const int a_col, __global const int* a_matches, const int a_matches_length,
+                      __global const int* b, const int b_row, const int b_col,
+                      __global const int* b_matches, const int b_matches_length,
+                      __global const int* keys, const int keys_length, __global int* counts)
+{
+    int x = get_global_id(0), y, count = 0;
+
+    if (ToFilter(a, a_col, a_matches, a_matches_length, x) == 1) {
+        for (y = 0; y < b_row; y++) {
+            if (IsJoined_Fused(a, a_col, x, b, b_col, y, keys, keys_length) == 1 &&
+                ToFilter(b, b_col, b_matches, b_matches_length, y) == 1)
+                count++;
+        }
+    }
+
+    counts[x] = count;
+}
+
+/// Write the joined rows of the rows first..first+global size of a (the result starts at the offset of row first)
+__kernel
+void FUSED_JOIN_WRITE(__global const int* a, const int a_col,
+                      __global const int* b, const int b_row, const int b_col,
+                      __global const int* b_matches, const int b_matches_length,
+                      __global const int* keys, const int keys_length,
+                      __global const int* offsets, __global const int* out, const int out_length,
+                      __global int* result, const int first)
+{
+    int x = get_global_id(0) + first, y, i;
+    int curr = offsets[x] - offsets[first];
+
+    if (offsets[x + 1] == curr)
+        return;
+
+    for (y = 0; y < b_row; y++) {
+        if (IsJoined_Fused(a, a_col, x, b, b_col, y, keys, keys_length) == 0 ||
+            ToFilter(b, b_col, b_matches, b_matches_length, y) == 0)
+            continue;
+
+        for (i = 0; i < out_length; i++) {
+            if (out[2*i] == 0)
+                result[curr*out_length + i] = a[x*a_col + out[2*i+1]];
+            else
+                result[curr*out_length + i] = b[y*b_col + out[2*i+1]];
+        }
+        curr++;
+    }
+}
+
+int Compare_Key(__global const int* keys, int y, __global const int* a, const int a_col, int x,
+                __global const int* places, const int places_length)
+{
+    for (int i = 0; i < places_length; i++) {
+        int key = keys[y*places_length + i], value = a[x*a_col + places[i]];
+        if (key < value)
+            return -1;
+        if (key > value)
+            return 1;
+    }
+    return 0;
+}
+
+/// Fused Select Above - the columns in places of row x are looked up in the sorted table of the predicat, and the
+/// row is kept if its annotation is >= minVal (the flags of the previous blocks are kept when first == 0)
+__kernel
+void SELECT_ABOVE_JOIN_FLAGS(__global const int* a, const int a_col, __global const int* places,
+                             const int places_length, __global const int* keys, const int keys_row,
+                             __global const float* values, const float missing, const float minVal,
+                             const int first, __global int* flags)
+{
+    int x = get_global_id(0), low = 0, high = keys_row - 1;
+    float value = missing;
+
+    if (first == 0 && flags[x] == 0)
+        return;
+
+    while (low <= high) {
+        int middle = (low + high) / 2;
+        int cmp = Compare_Key(keys, middle, a, a_col, x, places, places_length);
+
+        if (cmp == 0) {
+            value = values[middle];
+            break;
+        }
+
+        if (cmp < 0)
+            low = middle + 1;
+        else
+            high = middle - 1;
+    }
+
+    flags[x] = value >= minVal ? 1 : 0;
+}
+
+/// Exclusive prefix sum of every block of the array, the total of each block is written to sums
+__kernel
+void SCAN(__global int* data, const int length, __global int* sums, __local int* temp)
+{
+    int gid = get_global_id(0), lid = get_local_id(0), size = get_local_size(0), offset;
+    int value = gid < length ? data[gid] : 0;
+
+    temp[lid] = value;
+    barrier(CLK_LOCAL_MEM_FENCE);
+
+    for (offset = 1; offset < size; offset <<= 1) {
+        int other = lid >= offset ? temp[lid - offset] : 0;
+        barrier(CLK_LOCAL_MEM_FENCE);
+        temp[lid] += other;
+        barrier(CLK_LOCAL_MEM_FENCE);
+    }
+
+    if (gid < length)
+        data[gid] = temp[lid] - value;
+
+    if (lid == size - 1)
+        sums[get_group_id(0)] = temp[lid];
+}
+
+/// Add the (scanned) total of the previous blocks to every item of the block
+__kernel
+void SCAN_ADD(__global int* data, const int length, __global const int* sums)
+{
+    int gid = get_global_id(0);
+
+    if (gid < length)
+        data[gid] += sums[get_group_id(0)];
 }
 
 /// this function return all the rows from a table that have same value for 2 variables
@@ -74,48 +355,131 @@ void SIMPLE_FILTER(__global const int* a, __global const float* a_vals, int a_co
     }
 }
 
-int ToFilter(__global int* a, const int a_col, __global int* places, const int places_row, int x)
+/// flags[x] = 1 if all the pairs of columns in places are equal in row x
+__kernel
+void FILTER_FLAGS(__global const int* a, const int a_col, __global const int* places, const int places_row,
+                  __global int* flags)
 {
-    for(int i = 0; i < places_row; i++) {
-        if (a[x*a_col + places[2*i]] != a[x*a_col + places[2*i+1]])
-            return 0;
-    }
-    return 1;
+    int x = get_global_id(0);
+    flags[x] = ToFilter(a, a_col, places, places_row, x);
 }
 
+/// Stream compaction - the flagged rows (offsets[x] != offsets[x+1]) are written from offsets[x] with the
+/// columns in places
 __kernel
-void FILTER(__global int* a, const int a_col, __global int* places, const int places_row,
-            __global int* varsPic, const int varsPic_row, __global int* current, __global int* result, const int result_col) {
-                
-            int x = get_global_id(0), i, isOk = 1;
-            
-            if(ToFilter(a, a_col, places, places_row, x) == 1) {
-                int curr = atomic_add(current,1);
-                
-                for(i = 0; i < varsPic_row; i++) {
-                    if(varsPic[i] != -1) {
-                        result[curr*result_col + varsPic[i]] = a[x*a_col + varsPic[i]];
-                    }
-                }
-            }
-}        
+void COMPACT(__global const int* a, const int a_col, __global const int* places, const int places_length,
+             __global const int* offsets, __global int* result)
+{
+    int x = get_global_id(0), i;
+    int curr = offsets[x];
 
-/// This function return all the rows from the table that have value >= minVal
+    if (offsets[x + 1] == curr)
+        return;
+
+    for (i = 0; i < places_length; i++)
+        result[curr*places_length + i] = a[x*a_col + places[i]];
+}
+
+/// flags[x] = 1 if the value of row x is >= minVal
 __kernel
-void SELECT_ABOVE(__global const int* args, __global const float* values, int a_col, int minVal,
-                  __global int* buffer_args, __global int* current)
+void SELECT_ABOVE_FLAGS(__global const float* values, const float minVal, __global int* flags)
 {
     int x = get_global_id(0);
-    
-    if(values[x] >= minVal)
-    {
-        int curr = atom_add(current, 1);
+    flags[x] = values[x] >= minVal ? 1 : 0;
+}
 
-        int i;
-        for(int i=0; i < a_col; i++)
-            buffer_args[curr*a_col+i] = args[x*a_col+i];
+int Compare_Rows(__global const int* a, int x, __global const int* b, int y, const int col)
+{
+    for (int i = 0; i < col; i++) {
+        if (a[x*col + i] < b[y*col + i])
+            return -1;
+        if (a[x*col + i] > b[y*col + i])
+            return 1;
+    }
+    return 0;
+}
+
+__kernel
+void IOTA(__global int* data)
+{
+    int i = get_global_id(0);
+    data[i] = i;
+}
+
+/// Single step (k, j) of bitonic sort over the permutation of the rows. The permutation is padded to a power
+/// of 2, the padding indexes (>= a_row) are greater than all the rows.
+__kernel
+void BITONIC_SORT(__global const int* a, const int a_col, const int a_row, __global int* perm,
+                  const int j, const int k)
+{
+    int i = get_global_id(0), ixj = i ^ j, cmp;
+
+    if (ixj <= i)
+        return;
+
+    int p = perm[i], q = perm[ixj];
+
+    if (p >= a_row)
+        cmp = q >= a_row ? 0 : 1;
+    else if (q >= a_row)
+        cmp = -1;
+    else
+        cmp = Compare_Rows(a, p, a, q, a_col);
+
+    if (((i & k) == 0 && cmp > 0) || ((i & k) != 0 && cmp < 0)) {
+        perm[i] = q;
+        perm[ixj] = p;
     }
 }
+
+/// flags[i] = 1 if the i-th row in the sorted order is different from the row before it
+__kernel
+void UNIQUE_FLAGS(__global const int* a, const int a_col, __global const int* perm, __global int* flags)
+{
+    int i = get_global_id(0);
+    flags[i] = (i == 0 || Compare_Rows(a, perm[i], a, perm[i-1], a_col) != 0) ? 1 : 0;
+}
+
+__kernel
+void UNIQUE_WRITE(__global const int* a, const int a_col, __global const int* perm,
+                  __global const int* offsets, __global int* result)
+{
+    int i = get_global_id(0), c;
+    int curr = offsets[i];
+
+    if (offsets[i + 1] == curr)
+        return;
+
+    for (c = 0; c < a_col; c++)
+        result[curr*a_col + c] = a[perm[i]*a_col + c];
+}
+
+/// Annotation of every query row, by binary search in a table of sorted keys (missing if not found)
+__kernel
+void LOOKUP(__global const int* keys, const int keys_row, __global const float* values,
+            __global const int* queries, const int col, const float missing, __global float* result)
+{
+    int x = get_global_id(0), low = 0, high = keys_row - 1;
+    float value = missing;
+
+    while (low <= high) {
+        int middle = (low + high) / 2;
+        int cmp = Compare_Rows(keys, middle, queries, x, col);
+
+        if (cmp == 0) {
+            value = values[middle];
+            break;
+        }
+
+        if (cmp < 0)
+            low = middle + 1;
+        else
+            high = middle - 1;
+    }
+
+    result[x] = value;
+}
+
 // This function make sure to have all values >= minValue
 __kernel
 void SET_LOWER_BOUNDARY(__global int* values, int minValue)
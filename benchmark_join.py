@@ -0,0 +1,47 @@
+__author__ = "Bar Bokovza"
+
+#region IMPORTS
+import sys
+import numpy as np
+from Code.opencl import GAP_OpenCL
+from time import time
+#endregion
+
+# Compare the SUPER_JOIN kernels with the tiled (local memory) kernels on the first device of the platform.
+# usage : python benchmark_join.py [platform] [device]
+platform = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+device = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+gpu = GAP_OpenCL("External/OpenCL/Commands.cl", platform, device)
+print("# DEVICE : {0}".format(gpu.device.name))
+
+random = np.random.RandomState(0)
+a_varsPic, b_varsPic = np.array([0, 1, -1], dtype = np.int32), np.array([-1, 0, 1], dtype = np.int32)
+
+def Measure (a, b, threshold, count = 3):
+    gpu.tiled_threshold = threshold
+    best = None
+
+    for i in range(count):
+        start = time()
+        result, varsPic = gpu.SuperJoin((a, a_varsPic), (b, b_varsPic))
+        gpu.queue.finish()
+        end = time()
+
+        if best is None or end - start < best:
+            best = end - start
+
+    return best, len(result)
+
+print("rows,result,plain,tiled")
+for rows in [1024, 4096, 16384, 32768]:
+    a = random.randint(0, rows, (rows, 2)).astype(np.int32)
+    b = random.randint(0, rows, (rows, 2)).astype(np.int32)
+
+    Measure(a, b, 0, 1)
+    t_plain, size = Measure(a, b, 1 << 62)
+    t_tiled, size = Measure(a, b, 0)
+
+    print("{0},{1},{2},{3}".format(rows, size, t_plain, t_tiled))
+
+print("# END")
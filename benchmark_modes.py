@@ -0,0 +1,35 @@
+__author__ = "Bar Bokovza"
+
+#region IMPORTS
+import sys
+import Code.pygaplus as gap
+from time import time
+#endregion
+
+# Compare the interval modes (Gauss-Seidel / Jacobi / Worklist) - amount of intervals, executed rows of
+# "Definition Zones", time until the fix point and the rate of the shared joins that were reused.
+# usage : python benchmark_modes.py <data.csv> <rules.gap> [backend] [workers]
+path_data, path_rules = sys.argv[1], sys.argv[2]
+backend = sys.argv[3] if len(sys.argv) > 3 else "opencl"
+workers = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+
+gap.Set_Backend(backend)
+gap.comp.Workers = workers
+
+print("# BACKEND : {0}, WORKERS : {1}".format(backend, workers))
+print("mode,intervals,evaluations,seconds,atoms,reuse")
+for mode in ["gauss", "jacobi", "worklist"]:
+    gap.Reset()
+    gap.Set_Mode(mode)
+    gap.Load_Data(path_data)
+    gap.Load_Rules(path_rules)
+
+    start = time()
+    gap.Run_FixPoint()
+    end = time()
+
+    atoms = sum(len(gap.MainDict[predicat]) for predicat in gap.MainDict.keys())
+    print("{0},{1},{2},{3},{4},{5}".format(mode, gap.intervals, gap.evaluations, end - start, atoms,
+        gap.Join_Statistics()["reuse"]))
+
+print("# END")
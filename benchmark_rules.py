@@ -0,0 +1,52 @@
+__author__ = "Bar Bokovza"
+
+#region IMPORTS
+import os
+import sys
+import tempfile
+import Code.compiler as com
+from time import time
+#endregion
+
+# Load (and compile) generated rule files of growing sizes - the time per rule should not grow with the size.
+# Every rule has its own predicat and the rules have 9 shapes (GAP_Parser.Shapes) - only the first rule of a shape is
+# parsed, the other rules are its copies, and their other blocks are shared.
+# usage : python benchmark_rules.py [sizes] [prerun] [processes]
+# for example : python benchmark_rules.py 10000,100000,1000000 0
+sizes = [int(size) for size in sys.argv[1].split(",")] if len(sys.argv) > 1 else [10000, 100000, 1000000]
+prerun = sys.argv[2] == "1" if len(sys.argv) > 2 else False
+processes = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+def Generate (path, count):
+    filer = open(path, "w")
+    for i in range(count):
+        filer.write("g{0}_member(X):0.{1}*a*b<-g{0}_member(Y):b&p(Y):1&friend(Y,X):a&q{2}(X):1\n".format(i % 2 + 1,
+            i % 9 + 1, i))
+    filer.close()
+
+print("# PRERUN : {0}, PROCESSES : {1}".format(prerun, processes))
+print("rules,load,us_per_rule,predicats,prerun,us_per_rule")
+for size in sizes:
+    path = os.path.join(tempfile.gettempdir(), "gaplus_rules_{0}.gap".format(size))
+    Generate(path, size)
+
+    comp = com.GAP_Compiler(processes = processes)
+    start = time()
+    comp.Load(path)
+    load = time() - start
+
+    start = time()
+    predicats = len(comp.GetPredicats())
+    predicats_time = time() - start
+
+    compile_time = 0.0
+    if prerun:
+        start = time()
+        comp.PreRun()
+        compile_time = time() - start
+
+    print("{0},{1:.3f},{2:.1f},{3:.3f},{4:.3f},{5:.1f}".format(size, load, load * 1e6 / size, predicats_time,
+        compile_time, compile_time * 1e6 / size))
+    os.remove(path)
+
+print("# END")
@@ -0,0 +1,137 @@
+__author__ = "Bar Bokovza"
+
+#region Imports
+import os
+import random
+
+import pytest
+#endregion
+
+#region Data
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+CL_PATH = os.path.join(ROOT, "External", "OpenCL", "Commands.cl")
+RULES = os.path.join(ROOT, "External", "Rules", "Pi.gap")
+MODES = ["gauss", "jacobi", "worklist"]
+#endregion
+
+#region Functions
+def Create_Backend (name):
+    """
+    Create an execution agent - the test is skipped if OpenCL is not available.
+    :param name: "basic" / "opencl" / "auto"
+    :type name: str
+    :return: GAP_Basic / GAP_OpenCL / GAP_Dispatch
+    """
+    from Code.basic import GAP_Basic
+    if name == "basic":
+        return GAP_Basic()
+
+    try:
+        from Code.opencl import GAP_OpenCL
+        gpu = GAP_OpenCL(CL_PATH)
+    except Exception as e:
+        pytest.skip("OpenCL is not available ({0})".format(e))
+
+    if name == "auto":
+        from Code.dispatch import GAP_Dispatch
+        return GAP_Dispatch(GAP_Basic(), gpu)
+    return gpu
+
+@pytest.fixture(params = ["basic", "opencl", "auto"])
+def backend (request):
+    """
+    The execution agents
+    """
+    return Create_Backend(request.param)
+
+@pytest.fixture
+def opencl ():
+    """
+    The OpenCL execution agent
+    """
+    return Create_Backend("opencl")
+
+def Create_Facts (n = 60, edges = 300, seed = 1):
+    """
+    Random facts of the predicats of Pi.gap
+    :param n: amount of nodes
+    :param edges: amount of friend edges
+    :param seed: the seed of the facts
+    :return: list of csv lines
+    :rtype: list
+    """
+    rnd = random.Random(seed)
+    lines = []
+
+    for i in range(n):
+        if rnd.random() < 0.5:
+            lines.append("p,1,{0}".format(i))
+        if rnd.random() < 0.5:
+            lines.append("q,1,{0}".format(i))
+    for name in ["g1_member", "g2_member"]:
+        for i in rnd.sample(range(n), 5):
+            lines.append("{0},{1:.3f},{2}".format(name, 0.001 + 0.999 * rnd.random(), i))
+    for i in range(edges):
+        lines.append("friend,{0:.3f},{1},{2}".format(0.001 + 0.999 * rnd.random(), rnd.randrange(n), rnd.randrange(n)))
+
+    return lines
+
+def Write_Facts (path, lines):
+    """
+    Write csv lines to a file
+    :return: the path
+    :rtype: str
+    """
+    with open(str(path), "w") as filer:
+        filer.write("\n".join(lines) + "\n")
+    return str(path)
+
+def Snapshot (console):
+    """
+    :return: a copy of the data of the console {predicat: {key: annotation}}
+    :rtype: dict
+    """
+    return {predicat: dict(atoms) for predicat, atoms in console.MainDict.items()}
+
+def Differences (a, b, eps = 1e-4):
+    """
+    :return: list of (predicat, key) of the atoms whose annotations differ by more than eps (0 - a missing atom)
+    :rtype: list
+    """
+    result = []
+    for predicat in set(a) | set(b):
+        x, y = a.get(predicat, { }), b.get(predicat, { })
+        result.extend((predicat, key) for key in set(x) | set(y) if abs(x.get(key, 0) - y.get(key, 0)) > eps)
+    return result
+
+def Run_Console (console, data, rules = RULES, mode = "gauss"):
+    """
+    Run a console to a fix point from a clean state
+    :return: the data of the console
+    :rtype: dict
+    """
+    console.Reset()
+    console.Set_Mode(mode)
+    console.Load_Data(data)
+    console.Load_Rules(rules)
+    console.Run_FixPoint()
+    return Snapshot(console)
+
+@pytest.fixture
+def console ():
+    """
+    The console (Code.pygaplus) on the basic backend, without the compiled rules cache
+    """
+    import Code.pygaplus as gap
+
+    cache = gap.comp.Cache
+    gap.Set_Backend("basic")
+    gap.comp.Cache = None
+    gap.Reset()
+
+    yield gap
+
+    gap.Reset()
+    gap.Set_Mode("gauss")
+    gap.comp.Cache = cache
+#endregion
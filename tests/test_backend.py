@@ -0,0 +1,66 @@
+__author__ = "Bar Bokovza"
+
+#region Imports
+import os
+
+import numpy as np
+import pytest
+
+from Code.basic import GAP_Basic
+from tests.conftest import ROOT, CL_PATH
+#endregion
+
+#region Tests
+def test_lazy_backend (tmp_path):
+    import Code.pygaplus as gap
+
+    data = tmp_path / "data.csv"
+    data.write_text("friend,0.5,1,2\ng1_member,0.7,1\n")
+    default = dict(gap.config)
+
+    try:
+        gap.Set_Backend("opencl")
+        gap.config["path"] = str(tmp_path / "missing.cl")  ## fails only if the agent is created
+        gap.Reset()
+        gap.Load_Data(str(data))
+        gap.Load_Rules(os.path.join(ROOT, "External", "Rules", "Pi.gap"))
+        assert gap.gpu is None
+
+        gap.Set_Backend("basic")
+        gpu = gap.Get_Backend()
+        assert isinstance(gpu, GAP_Basic)
+        assert gap.Get_Backend() is gpu
+    finally:
+        gap.config.update(default)
+        gap.gpu = None
+        gap.Reset()
+
+def Create_OpenCL (cache):
+    try:
+        from Code.opencl import GAP_OpenCL
+        return GAP_OpenCL(CL_PATH, cache = cache)
+    except Exception as e:
+        pytest.skip("OpenCL is not available ({0})".format(e))
+
+def Distinct_Rows (gpu):
+    idx, values = gpu.Distinct(np.array([[1, 2], [0, 5], [1, 2]], dtype = np.int32))
+    return sorted(tuple(row) for row in np.asarray(idx).tolist())
+
+def test_program_cache (tmp_path):
+    cache = str(tmp_path / "cache")
+    assert Distinct_Rows(Create_OpenCL(cache)) == [(0, 5), (1, 2)]
+
+    binaries = os.listdir(cache)
+    assert len(binaries) == 1 and binaries[0].endswith(".bin")
+    path = os.path.join(cache, binaries[0])
+    stat = os.stat(path)
+
+    assert Distinct_Rows(Create_OpenCL(cache)) == [(0, 5), (1, 2)]
+    after = os.stat(path)
+    assert (after.st_ino, after.st_mtime_ns) == (stat.st_ino, stat.st_mtime_ns)  ## built from the binary
+
+    with open(path, "wb") as filer:
+        filer.write(b"broken")
+    assert Distinct_Rows(Create_OpenCL(cache)) == [(0, 5), (1, 2)]  ## rebuilt from the source
+    assert os.path.getsize(path) > len(b"broken")
+#endregion
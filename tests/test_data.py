@@ -0,0 +1,148 @@
+__author__ = "Bar Bokovza"
+
+#region Imports
+import numpy as np
+import pytest
+
+from Code.dataHolder import GAP_Data, GAP_AnnotationIndex
+from tests.conftest import RULES, MODES, Create_Facts, Write_Facts, Run_Console, Differences
+#endregion
+
+#region Data
+ABOVE = ["mid(X,Y):0.5*a <- friend(X,Y):a", "deep(X,Y):1 <- mid(X,Y):0.3 & p(X):1"]
+#endregion
+
+#region Tests
+def Highest (atoms, k):
+    """
+    :return: the k highest annotations of a {key: annotation} dictionary, from the highest
+    :rtype: list
+    """
+    return sorted(atoms.values(), reverse = True)[:k]
+
+@pytest.mark.parametrize("k", [0, 1, 7, 300, 1000])
+def test_top_k (tmp_path, k):
+    data = GAP_Data()
+    data.Load(Write_Facts(tmp_path / "data.csv", Create_Facts()))
+    friend = data.data["friend"]
+
+    keys, values = data.TopK("friend", k)
+    assert values.tolist() == Highest(friend, k)
+    assert [friend[tuple(key)] for key in keys.tolist()] == values.tolist()
+
+    data.Maintain_TopK("friend", k)  ## the heap gives the same atoms
+    keys, values = data.TopK("friend", k)
+    assert values.tolist() == Highest(friend, k)
+
+def test_top_k_zero (console, tmp_path):
+    console.Reset()
+    console.Load_Data(Write_Facts(tmp_path / "data.csv", Create_Facts()))
+    console.Load_Rules(RULES)
+
+    assert console.TopK("g1_member", 0, maintain = True) == []
+    console.Run_FixPoint()  ## the rules raise atoms into a heap of 0 atoms
+    assert console.TopK("g1_member", 0) == []
+    assert console.TopK("missing", 3) == []
+
+@pytest.mark.parametrize("mode", MODES)
+def test_maintained_top_k (console, tmp_path, mode):
+    console.Reset()
+    console.Set_Mode(mode)
+    console.Load_Data(Write_Facts(tmp_path / "data.csv", Create_Facts(seed = 3)))
+    console.Load_Rules(RULES)
+
+    assert len(console.TopK("g1_member", 5, maintain = True)) == 5
+    console.Run_FixPoint()  ## the heap is updated by the atoms that the rules raise
+
+    heap = console.dataHold.heaps["g1_member"]
+    assert sorted(heap.members.values(), reverse = True) == Highest(console.MainDict["g1_member"], 5)
+    assert [value for key, value in console.TopK("g1_member", 5)] == Highest(console.MainDict["g1_member"], 5)
+
+    console.Insert_Data(Write_Facts(tmp_path / "insert.csv", ["g1_member,0.999,{0}".format(i) for i in range(3)]))
+    console.Run_FixPoint()
+    assert [value for key, value in console.TopK("g1_member", 5)] == Highest(console.MainDict["g1_member"], 5)
+
+def test_range (tmp_path):
+    data = GAP_Data()
+    data.Load(Write_Facts(tmp_path / "data.csv", Create_Facts()))
+    friend = data.data["friend"]
+
+    keys, values = data.Range("friend", 0.2, 0.6)  ## scan
+    assert dict(zip(map(tuple, keys.tolist()), values.tolist())) == {k: v for k, v in friend.items() if 0.2 <= v <= 0.6}
+
+    data.Index_Annotations("friend")
+    for i in range(2000):  ## buffered raises, merged when the buffer grows
+        key = (i % 60, i // 60)
+        friend[key] = max(friend.get(key, 0.0), 0.3 + i / 10000.0)
+        data.Raise("friend", [(key,)])
+    keys, values = data.Range("friend", 0.2, 0.6)
+    assert dict(zip(map(tuple, keys.tolist()), values.tolist())) == {k: v for k, v in friend.items() if 0.2 <= v <= 0.6}
+    assert values.tolist() == sorted(values.tolist())
+
+def test_empty_index ():
+    index = GAP_AnnotationIndex({ })
+    keys, values = index.Range(0)
+    assert keys.shape == (0, 0) and len(values) == 0
+
+    index.Raise((1, 2), 0.5)  ## the first atom gives the arity
+    index.Raise((3, 4), 0.7)
+    keys, values = index.Range(0.6)
+    assert keys.tolist() == [[3, 4]] and values.tolist() == [0.7]
+
+    index.Merge()
+    keys, values = index.Range(0)
+    assert keys.shape == (2, 2) and values.tolist() == [0.5, 0.7]
+
+@pytest.mark.parametrize("mode", MODES)
+def test_indexed_above (console, tmp_path, mode):
+    data, rules = Write_Facts(tmp_path / "data.csv", Create_Facts()), Write_Facts(tmp_path / "rules.gap", ABOVE)
+    expected = Run_Console(console, data, rules, mode)
+
+    console.Reset()
+    console.Set_Mode(mode)
+    console.Load_Data(data)
+    console.Load_Rules(rules)
+    assert console.Range("mid", 0, index = True) == []  ## an empty index, the rules add its first atoms
+    console.Run_FixPoint()
+
+    assert Differences(expected, console.MainDict) == []
+    assert len(expected["deep"]) > 0
+    assert console.Range("mid", 0.3) == sorted(((k, v) for k, v in expected["mid"].items() if v >= 0.3),
+        key = lambda item: item[1])
+
+@pytest.mark.parametrize("array", [True, False])
+def test_upsert (tmp_path, array):
+    data = GAP_Data()
+    data.Load(Write_Facts(tmp_path / "data.csv", Create_Facts()))
+    friend = data.data["friend"]
+    low, high = sorted(friend.items(), key = lambda item: item[1])[:2]
+    data.Maintain_TopK("friend", 3)
+    data.Index_Annotations("friend")
+    version = data.versions["friend"]
+
+    keys = [low[0], high[0], (100, 101), (100, 101), (100, 102), (100, 103), (100, 104)]
+    values = [low[1] + 0.5, high[1] / 2, 0.4, 0.999, 0.0, -0.5, 0.3]
+    added, changed, delta = data.Upsert("friend", np.array(keys) if array else keys, values)
+
+    ## the duplicates are merged (max), the new atoms without positive annotations are dropped
+    assert (added, changed) == (2, 1)
+    assert [key for key, improvement in delta] == [(100, 101), (100, 104), low[0]]
+    assert [improvement for key, improvement in delta] == pytest.approx([0.999, 0.3, 0.5])
+    assert friend[low[0]] == pytest.approx(low[1] + 0.5) and friend[high[0]] == high[1]
+    assert (100, 102) not in friend and (100, 103) not in friend
+    assert data.versions["friend"] > version
+
+    rows = set(map(tuple, data.Generate_NDArray("friend").tolist()))
+    assert rows == set(friend.keys())
+    assert data.TopK("friend", 1)[0].tolist() == [[100, 101]]
+    assert (100, 104) in [tuple(key) for key in data.Range("friend", 0.3, 0.3)[0].tolist()]
+
+def test_upsert_eps (tmp_path):
+    data = GAP_Data()
+    data.Load(Write_Facts(tmp_path / "data.csv", ["friend,0.5,1,2", "friend,0.7,2,3"]))
+
+    assert data.Upsert("friend", [(1, 2), (2, 3)], [0.505, 0.6], eps = 0.01) == (0, 0, [])
+    added, changed, delta = data.Upsert("friend", [(1, 2)], [0.52], eps = 0.01)
+    assert (added, changed) == (0, 1) and delta[0][0] == (1, 2) and delta[0][1] == pytest.approx(0.02)
+    assert data.Upsert("friend", np.zeros((0, 2), dtype = np.int32), []) == (0, 0, [])
+#endregion
@@ -0,0 +1,59 @@
+__author__ = "Bar Bokovza"
+
+#region Imports
+import numpy as np
+
+from Code.dispatch import GAP_Dispatch
+#endregion
+
+#region Engines
+class _Queue:
+    def __init__ (self):
+        self.syncs = 0
+
+    def finish (self):
+        self.syncs += 1
+
+class _Engine:
+    """
+    An engine that records its calls (Filter only)
+    """
+
+    def __init__ (self):
+        self.queue, self.calls = _Queue(), 0
+
+    def Filter (self, a, matches, places = None):
+        self.calls += 1
+        return a
+#endregion
+
+#region Tests
+def Create_Dispatch (fast):
+    dispatch = GAP_Dispatch(_Engine(), _Engine(), calibrate = False, sample = 8, explore = 32)
+    slow = "cpu" if fast == "gpu" else "gpu"
+    dispatch.models[("Filter", slow)].Estimate = lambda work: 1.0  ## stays slower after its timings
+    return dispatch
+
+def test_sync_only_observed ():
+    dispatch = Create_Dispatch("gpu")
+    a = (np.zeros((4, 2), dtype = np.int32), np.array([0, 1], dtype = np.int32))
+
+    for i in range(16):
+        dispatch.Filter(a, [])
+
+    gpu = dispatch.engines["gpu"]
+    assert gpu.calls == 16
+    assert gpu.queue.syncs == 2 * 2  ## calls 8 and 16, before and after
+
+def test_explore_other_engine ():
+    dispatch = Create_Dispatch("cpu")
+    a = (np.zeros((4, 2), dtype = np.int32), np.array([0, 1], dtype = np.int32))
+
+    for i in range(64):
+        dispatch.Filter(a, [])
+
+    assert dispatch.engines["gpu"].calls == 2
+    assert dispatch.engines["cpu"].calls == 62
+    assert dispatch.models[("Filter", "gpu")].n > 0
+    assert dispatch.Statistics()["Filter"]["gpu"][0] == 2
+#endregion
@@ -0,0 +1,155 @@
+__author__ = "Bar Bokovza"
+
+#region Imports
+import os
+
+import pytest
+
+from tests.conftest import ROOT, MODES, Create_Facts, Write_Facts, Run_Console, Differences
+#endregion
+
+#region Data
+RULES = [os.path.join(ROOT, "External", "Rules", name) for name in ["Pi.gap", "Pi2.gap"]]
+CONSTANTS = ["vip(X):a <- friend(12,X):a", "pair(7,Y):a <- friend(Y,7):a", "hot(X):0.5 <- friend(3,X):0.4",
+    "two(X,Z):a*b <- friend(12,X):a & friend(X,Z):b"]
+GATES = ["open(X):a <- friend(12,X):a & p(3):1", "warm(X):a*b <- friend(X,5):a & g1_member(7):b"]
+SHARED = ["s(X):a*b <- friend(X,Y):a & g1_member(Y):b", "t(W):c*d <- friend(W,Z):c & g1_member(Z):d"]
+FRIENDS = ["friend,0.5,12,1", "friend,0.7,12,2", "friend,0.4,3,5", "friend,0.9,7,5"]
+#endregion
+
+#region Tests
+@pytest.mark.parametrize("mode", MODES)
+def test_fixpoint (console, tmp_path, backend, mode):
+    data = Write_Facts(tmp_path / "data.csv", Create_Facts())
+    expected = Run_Console(console, data)
+
+    console.gpu = backend
+    assert Differences(expected, Run_Console(console, data, mode = mode)) == []
+    assert console.fix_point
+
+@pytest.mark.parametrize("rules", RULES)
+def test_families (console, tmp_path, rules):
+    data = Write_Facts(tmp_path / "data.csv", Create_Facts(seed = 4))
+    default, console.config["families"] = console.config["families"], True
+
+    try:
+        expected = Run_Console(console, data, rules)
+        assert len(console.comp.Families) > 0
+
+        console.config["families"] = False
+        assert Differences(expected, Run_Console(console, data, rules)) == []
+        assert len(console.comp.Families) == 0
+    finally:
+        console.config["families"] = default
+
+@pytest.mark.parametrize("mode", MODES)
+def test_share (console, tmp_path, mode):
+    data = Write_Facts(tmp_path / "data.csv", Create_Facts(seed = 7))
+    with open(RULES[0]) as filer:  ## the join of s and t is shared, and computed again when g1_member is raised
+        rules = Write_Facts(tmp_path / "rules.gap", SHARED + [line.strip() for line in filer if line.strip() != ""])
+    default = console.config["families"], console.config["share"]
+    console.config["families"], console.config["share"] = False, True  ## a family is executed without the cache
+
+    try:
+        expected = Run_Console(console, data, rules, mode)
+        assert console.Join_Statistics()["hits"] > 0
+
+        console.config["share"] = False
+        assert Differences(expected, Run_Console(console, data, rules, mode)) == []
+    finally:
+        console.config["families"], console.config["share"] = default
+
+@pytest.mark.parametrize("mode, derived", [("gauss", ["b", "c"]), ("jacobi", ["b"])])
+def test_interval (console, tmp_path, mode, derived):
+    console.Reset()
+    console.Set_Mode(mode)
+    console.Load_Data(Write_Facts(tmp_path / "data.csv", ["a,0.5,1", "b,0.1,2", "c,0.1,3"]))
+    console.Load_Rules(Write_Facts(tmp_path / "rules.gap", ["b(X):x <- a(X):x", "c(X):x <- b(X):x"]))
+    console.Run()
+
+    ## a jacobi rule reads only the atoms of the previous interval
+    assert [predicat for predicat in ["b", "c"] if (1,) in console.MainDict[predicat]] == derived
+
+def test_worklist (console, tmp_path):
+    lines = ["{0},0.001,{1}".format(name, i) for name in ["g1_member", "g2_member"] for i in range(100)]
+    data = Write_Facts(tmp_path / "data.csv", lines + Create_Facts(n = 100, edges = 600, seed = 6))
+
+    expected = Run_Console(console, data)
+    evaluations = console.evaluations
+
+    ## all the atoms are known from the start - the worklist executes only the rows of the improved atoms
+    assert Differences(expected, Run_Console(console, data, mode = "worklist")) == []
+    assert console.evaluations < evaluations / 2
+
+@pytest.mark.parametrize("rows", [1, 16])
+def test_stream (console, tmp_path, rows):
+    data = Write_Facts(tmp_path / "data.csv", Create_Facts())
+    expected = Run_Console(console, data)
+
+    default, console.config["stream"] = console.config["stream"], rows
+    try:
+        assert Differences(expected, Run_Console(console, data)) == []
+    finally:
+        console.config["stream"] = default
+
+@pytest.mark.parametrize("mode", MODES)
+def test_workers (console, tmp_path, mode):
+    data = Write_Facts(tmp_path / "data.csv", Create_Facts(seed = 3))
+    expected = Run_Console(console, data)
+
+    console.comp.Workers, console.comp.Pool = 4, None
+    try:
+        assert Differences(expected, Run_Console(console, data, mode = mode)) == []
+        assert console.comp.Pool is not None
+    finally:
+        if console.comp.Pool is not None:
+            console.comp.Pool.shutdown()
+        console.comp.Workers, console.comp.Pool = 0, None
+
+@pytest.mark.parametrize("mode", MODES)
+def test_constants (console, tmp_path, mode):
+    lines = Create_Facts(n = 20, edges = 150, seed = 5)
+    friend = {tuple(int(arg) for arg in line.split(",")[2:]): float(line.split(",")[1])
+        for line in lines if line.startswith("friend,")}
+
+    result = Run_Console(console, Write_Facts(tmp_path / "data.csv", lines),
+        Write_Facts(tmp_path / "rules.gap", CONSTANTS), mode)
+
+    assert result["vip"] == pytest.approx({(y,): v for (x, y), v in friend.items() if x == 12})
+    assert result["pair"] == pytest.approx({(7, y): v for (y, z), v in friend.items() if z == 7})
+    assert result["hot"] == pytest.approx({(y,): 0.5 for (x, y), v in friend.items() if x == 3 and v >= 0.4})
+    assert result["two"] == pytest.approx({(x, z): friend[(12, x)] * v for (x, z), v in friend.items()
+        if (12, x) in friend})
+
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("present", [True, False])
+def test_gates (console, tmp_path, mode, present):
+    gates = ["p,1,3", "g1_member,0.6,7"] if present else ["p,1,4", "g1_member,0.6,8"]
+    rules = Write_Facts(tmp_path / "rules.gap", GATES)
+    result = Run_Console(console, Write_Facts(tmp_path / "data.csv", FRIENDS + gates), rules, mode)
+
+    ## a block of only constants has no columns - it passes all the rows of the rule or none of them
+    assert result.get("open", { }) == (pytest.approx({(1,): 0.5, (2,): 0.7}) if present else { })
+    assert result.get("warm", { }) == (pytest.approx({(3,): 0.24, (7,): 0.54}) if present else { })
+
+@pytest.mark.parametrize("mode", MODES)
+def test_gates_incremental (console, tmp_path, mode):
+    rules = Write_Facts(tmp_path / "rules.gap", GATES)
+    Run_Console(console, Write_Facts(tmp_path / "data.csv", FRIENDS), rules, mode)
+    assert console.MainDict.get("open", { }) == { }
+
+    console.Insert_Data(Write_Facts(tmp_path / "insert.csv", ["p,1,3"]))
+    console.Run_FixPoint()
+    assert console.MainDict["open"] == pytest.approx({(1,): 0.5, (2,): 0.7})
+
+    console.Retract_Data(Write_Facts(tmp_path / "retract.csv", ["p,0,3"]))
+    console.Run_FixPoint()
+    assert console.MainDict.get("open", { }) == { }
+
+def test_gates_query (console, tmp_path):
+    console.Reset()
+    console.Load_Data(Write_Facts(tmp_path / "data.csv", FRIENDS + ["g1_member,0.6,7"]))
+    console.Load_Rules(Write_Facts(tmp_path / "rules.gap", GATES))
+
+    assert console.Query(["warm(3)", "warm(7)", "open(1)"]) == pytest.approx([0.24, 0.54, 0.0])
+#endregion
@@ -0,0 +1,100 @@
+__author__ = "Bar Bokovza"
+
+#region Imports
+import random
+
+import pytest
+
+from tests.conftest import MODES, Create_Facts, Write_Facts, Run_Console, Snapshot, Differences
+#endregion
+
+#region Tests
+@pytest.mark.parametrize("mode", MODES)
+def test_insert (console, tmp_path, mode):
+    lines = Create_Facts()
+    rnd = random.Random(1)
+    extra = ["friend,{0:.3f},{1},{2}".format(0.5 + 0.5 * rnd.random(), rnd.randrange(60), rnd.randrange(60))
+        for i in range(20)]
+    extra += ["p,1,{0}".format(rnd.randrange(60)) for i in range(10)] + ["g1_member,0.95,{0}".format(rnd.randrange(60))]
+
+    full = Run_Console(console, Write_Facts(tmp_path / "full.csv", lines + extra), mode = mode)
+
+    Run_Console(console, Write_Facts(tmp_path / "data.csv", lines), mode = mode)
+    console.Insert_Data(Write_Facts(tmp_path / "insert.csv", extra))
+    console.Run_FixPoint()
+
+    assert Differences(full, Snapshot(console)) == []
+
+@pytest.mark.parametrize("mode", MODES)
+def test_insert_converged (console, tmp_path, mode):
+    rules = Write_Facts(tmp_path / "rules.gap", ["b(X):x <- a(X):x", "c(X):x <- b(X):x"])
+    Run_Console(console, Write_Facts(tmp_path / "data.csv", ["a,0.1,2", "b,0.1,2", "c,0.1,2"]), rules, mode)
+    assert console.fix_point and console.intervals == 0  ## the first interval changed nothing
+
+    console.Insert_Data(Write_Facts(tmp_path / "insert.csv", ["a,0.5,1"]))
+    console.Run_FixPoint()
+    assert console.MainDict["c"] == {(1,): 0.5, (2,): 0.1}
+
+def Facts (lines):
+    """
+    :return: {(predicat, args): annotation} - the last line of a fact wins (as in Load_Data)
+    :rtype: dict
+    """
+    result = { }
+    for line in lines:
+        items = line.split(",")
+        result[(items[0], ",".join(items[2:]))] = items[1]
+    return result
+
+def Lines (facts):
+    return ["{0},{1},{2}".format(predicat, annotation, args) for (predicat, args), annotation in facts.items()]
+
+@pytest.mark.parametrize("mode", MODES)
+def test_retract (console, tmp_path, mode):
+    facts = Facts(Create_Facts())
+    rnd = random.Random(2)
+    friends = sorted(fact for fact in facts if fact[0] == "friend")
+
+    gone = rnd.sample(friends, 10) + [rnd.choice(sorted(fact for fact in facts if fact[0] == "p"))]
+    lower = [fact for fact in rnd.sample(friends, 10) if fact not in gone]
+    retract = {fact: "0" for fact in gone}
+    retract.update({fact: "{0:.3f}".format(float(facts[fact]) / 2) for fact in lower})
+
+    Run_Console(console, Write_Facts(tmp_path / "data.csv", Lines(facts)), mode = mode)
+    console.Retract_Data(Write_Facts(tmp_path / "retract.csv", Lines(retract)))
+    console.Run_FixPoint()
+    incremental = Snapshot(console)
+
+    for fact, annotation in retract.items():
+        if annotation == "0":
+            del facts[fact]
+        else:
+            facts[fact] = annotation
+    full = Run_Console(console, Write_Facts(tmp_path / "full.csv", Lines(facts)), mode = mode)
+
+    assert Differences(full, incremental) == []
+
+@pytest.mark.parametrize("mode", MODES)
+def test_retract_inserted_fact (console, tmp_path, mode):
+    facts = Facts(Create_Facts())
+    seeds = {fact: "0" for fact in facts if fact[0] in ["g1_member", "g2_member"]}
+    rest = {fact: annotation for fact, annotation in facts.items() if fact not in seeds}
+
+    derived = Run_Console(console, Write_Facts(tmp_path / "data.csv", Lines(facts)), mode = mode)
+    without = Run_Console(console, Write_Facts(tmp_path / "rest.csv", Lines(rest)), mode = mode)
+    key = min(key for key, value in derived["g1_member"].items()
+        if value > 0.01 and ("g1_member", str(key[0])) not in facts and key not in without["g1_member"])
+
+    ## a fact below the derived annotation of the atom - it is its annotation after the seeds are retracted
+    fact = {("g1_member", str(key[0])): "0.01"}
+    Run_Console(console, Write_Facts(tmp_path / "data.csv", Lines(facts)), mode = mode)
+    console.Insert_Data(Write_Facts(tmp_path / "insert.csv", Lines(fact)))
+    console.Run_FixPoint()
+    console.Retract_Data(Write_Facts(tmp_path / "retract.csv", Lines(seeds)))
+    console.Run_FixPoint()
+
+    assert console.MainDict["g1_member"].get(key) == 0.01
+    rest.update(fact)
+    assert Differences(Run_Console(console, Write_Facts(tmp_path / "full.csv", Lines(rest)), mode = mode),
+        Snapshot(console)) == []
+#endregion
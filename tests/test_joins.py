@@ -0,0 +1,55 @@
+__author__ = "Bar Bokovza"
+
+#region Imports
+import numpy as np
+import pytest
+#endregion
+
+#region Tests
+def Create_Relations (rows, keys, seed = 0):
+    """
+    Two relations a(X, Y), b(Y, Z) - Y has "keys" values
+    """
+    random = np.random.RandomState(seed)
+    a = random.randint(0, keys, (rows, 2)).astype(np.int32)
+    b = random.randint(0, keys, (rows, 2)).astype(np.int32)
+    return (a, np.array([0, 1, -1], dtype = np.int32)), (b, np.array([-1, 0, 1], dtype = np.int32))
+
+def Nested_Join (a, b):
+    """
+    The rows of a(X, Y), b(Y, Z) by a nested loop
+    """
+    return [[x, y, z] for x, y in a[0].tolist() for w, z in b[0].tolist() if y == w]
+
+@pytest.mark.parametrize("rows, keys", [(50, 5), (200, 1000), (0, 5)])
+def test_join (backend, rows, keys):
+    a, b = Create_Relations(rows, keys)
+    result, varsPic = backend.SuperJoin(a, b)
+
+    ## the rows are written at the offsets of the scanned counts - in the order of (a, b)
+    assert np.asarray(result).tolist() == Nested_Join(a, b)
+    assert np.shape(np.asarray(result)) == (len(Nested_Join(a, b)), 3)
+
+@pytest.mark.parametrize("rows, keys", [(150, 10), (64, 3), (300, 1000)])
+def test_tiled_join (opencl, rows, keys):
+    a, b = Create_Relations(rows, keys, seed = rows)
+    b_row, b_col = np.shape(b[0])
+
+    opencl.tiled_threshold = 1 << 30
+    assert not opencl.Use_Tiled(rows, b_row, b_col, 1, 3)
+    plain = np.asarray(opencl.SuperJoin(a, b)[0]).tolist()
+
+    opencl.tiled_threshold = 0
+    assert opencl.Use_Tiled(rows, b_row, b_col, 1, 3)
+    assert not opencl.Use_Tiled(rows, opencl.tile_size - 1, b_col, 1, 3)  ## b is smaller than a tile
+    tiled = np.asarray(opencl.SuperJoin(a, b)[0]).tolist()
+
+    assert tiled == plain == Nested_Join(a, b)  ## the same offsets - the same order
+
+def test_cartesian (backend):
+    a, b = Create_Relations(7, 5)
+    b = (b[0][:, 1:], np.array([-1, -1, 0], dtype = np.int32))  ## b(Z) - no joined variables
+
+    result, varsPic = backend.SuperJoin(a, b)
+    assert np.asarray(result).tolist() == [[x, y, z] for x, y in a[0].tolist() for z, in b[0].tolist()]
+#endregion
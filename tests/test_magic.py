@@ -0,0 +1,56 @@
+__author__ = "Bar Bokovza"
+
+#region Imports
+import random
+
+import pytest
+
+from Code.magic import GAP_Magic
+from tests.conftest import RULES, Create_Facts, Write_Facts, Run_Console, Snapshot
+#endregion
+
+#region Tests
+def Create_Atoms (n = 60, k = 5, seed = 3):
+    """
+    Ground atoms of the derived predicats of Pi.gap
+    """
+    rnd = random.Random(seed)
+    return ["g1_member({0})".format(rnd.randrange(n)) for i in range(k)] + \
+        ["g2_member({0})".format(rnd.randrange(n)) for i in range(k)]
+
+def Annotations (data, atoms):
+    result = []
+    for atom in atoms:
+        predicat, key = atom.rstrip(")").split("(")
+        result.append(data.get(predicat, { }).get((int(key),), 0.0))
+    return result
+
+@pytest.mark.parametrize("families", [True, False])
+def test_query (console, tmp_path, families):
+    data, atoms = Write_Facts(tmp_path / "data.csv", Create_Facts()), Create_Atoms()
+    full = Annotations(Run_Console(console, data), atoms)
+
+    default, console.config["families"] = console.config["families"], families
+    try:
+        console.Reset()
+        console.Load_Data(data)
+        console.Load_Rules(RULES)
+        before = Snapshot(console)
+        result = console.Query(atoms)
+    finally:
+        console.config["families"] = default
+
+    assert any(value > 0 for value in full)
+    assert result == pytest.approx(full, abs = 1e-4)
+    assert Snapshot(console) == before  ## the console is not changed
+
+def test_query_backend (console, tmp_path, backend):
+    data, atoms = Write_Facts(tmp_path / "data.csv", Create_Facts(seed = 2)), Create_Atoms(seed = 4)
+    full = Annotations(Run_Console(console, data), atoms)
+
+    console.Reset()
+    console.Load_Data(data)
+    console.Load_Rules(RULES)
+
+    assert GAP_Magic(console.comp).Query(atoms, console.dataHold, backend) == pytest.approx(full, abs = 1e-4)
+#endregion
@@ -0,0 +1,30 @@
+__author__ = "Bar Bokovza"
+
+#region Imports
+import numpy as np
+#endregion
+
+#region Tests
+def test_distinct_empty (backend):
+    idx, values = backend.Distinct(np.zeros((0, 3), dtype = np.int32))
+    assert np.shape(np.asarray(idx)) == (0, 3)
+
+def test_distinct (backend):
+    array = np.array([[1, 2], [0, 5], [1, 2], [0, 5], [3, 3]], dtype = np.int32)
+    idx, values = backend.Distinct(array, {(1, 2): 0.5})
+
+    rows = [tuple(row) for row in np.asarray(idx).tolist()]
+    assert sorted(rows) == [(0, 5), (1, 2), (3, 3)]
+    assert dict(zip(rows, np.asarray(values).tolist())) == {(0, 5): 1, (1, 2): 0.5, (3, 3): 1}
+
+def test_filter_empty (backend):
+    varsPic = np.array([0, 1], dtype = np.int32)
+    idx, pic = backend.Filter((np.zeros((0, 3), dtype = np.int32), varsPic), [(0, 2)])
+    assert np.shape(np.asarray(idx)) == (0, 2)
+
+def test_filter (backend):
+    varsPic = np.array([0, 1], dtype = np.int32)
+    array = np.array([[1, 2, 1], [1, 2, 3], [4, 0, 4]], dtype = np.int32)
+    idx, pic = backend.Filter((array, varsPic), [(0, 2)])
+    assert sorted(tuple(row) for row in np.asarray(idx).tolist()) == [(1, 2), (4, 0)]
+#endregion
@@ -0,0 +1,58 @@
+__author__ = "Bar Bokovza"
+
+#region Imports
+import random
+
+import pytest
+
+import Code.compiler as com
+from tests.conftest import Write_Facts
+#endregion
+
+#region Data
+SHAPES = ["g{0}(X):0.{1}*a*b<-g{0}(Y):b&p(Y):1&friend(Y,X):a&{2}(X):1",
+    "{2}(X,Y):a <- {0}(Y):a & friend(X, Y):0.{1}",
+    "{0}(X):a<-{2}(X):a&{2}(X):a",
+    "{2}(X):0.{1}<-friend(X,{1}):a",
+    "{0}(X):a*b<-{2}(X,X):a&q(X):b"]
+#endregion
+
+#region Tests
+def Create_Rules (count = 400, seed = 6):
+    """
+    Rules of some shapes with random predicats (some of them are the predicats of the other blocks)
+    """
+    rnd = random.Random(seed)
+    names = ["p", "q", "friend"] + ["r{0}".format(i) for i in range(count)]
+    return [rnd.choice(SHAPES).format(rnd.randrange(3), rnd.randrange(1, 10), rnd.choice(names)) for i in range(count)]
+
+def Structure (rule):
+    blocks = [(block.Predicat, block.Notation, block.Type, block.Arguments, block.Constants, block.Key,
+        block.VirtualVarsPic, list(block.PhysicalVarsPic), block.Matches) for block in [rule.Header] + rule.Body]
+    return rule.Text, rule.Dictionary, rule.Type, blocks, rule.Predicats, rule.Predicats_Dependent
+
+def test_registries (tmp_path):
+    lines = Create_Rules()
+    comp = com.GAP_Compiler()
+    comp.Load(Write_Facts(tmp_path / "rules.gap", lines))
+
+    assert len(comp.Rules) == len(lines)
+    assert len(comp.Parser.Shapes) < len(lines) / 10  ## the rules of a shape are copies of its first rule
+    for i, (rule, line) in enumerate(zip(comp.Rules, lines)):
+        expected = com.GAP_Rule(line + "\n")
+        assert Structure(rule) == Structure(expected)
+        assert rule.Create_Sources(i) == expected.Create_Sources(i)
+        assert rule.Plan.Scans == expected.Plan.Scans
+
+    predicats = comp.Parser.Predicats
+    assert all(block.Predicat is predicats[block.Predicat] for rule in comp.Rules for block in rule.Body)
+
+def test_errors ():
+    parser = com.GAP_Parser()
+    parser.Rule("p(X):a<-q(X):a")
+
+    with pytest.raises(ValueError):
+        parser.Rule("p(X):a&q(X):a")
+    with pytest.raises(ValueError):
+        parser.Rule("p(X):a<-q:a")
+#endregion
@@ -0,0 +1,161 @@
+__author__ = "Bar Bokovza"
+
+#region Imports
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from Code.compiler import GAP_Compiler, GAP_Rule, GAP_JoinCache, GAP_PhysicalPlan
+from Code.dataHolder import GAP_Data
+from tests.conftest import CL_PATH, RULES, Create_Facts, Write_Facts
+#endregion
+
+#region Data
+EXTRA = ["loop(X):a <- friend(X,X):a", "tri(X,Z):a*b <- friend(X,Y):a & friend(Y,Z):b & p(Z):1",
+    "back(X):a <- friend(X,Y):a & friend(Y,X):0.3", "pair(X,Y):a <- g1_member(X):a & p(Y):1"]
+SHARED = ["s(X):a*b <- friend(X,Y):a & g1_member(Y):b", "t(W):c*d <- friend(W,Z):c & g1_member(Z):d"]
+#endregion
+
+#region Tests
+class _PerOperator:
+    """
+    An agent without Execute_Plan - the rules run one operator per block
+    """
+
+    def __init__ (self, gpu):
+        self.gpu = gpu
+
+    def __getattr__ (self, name):
+        if name == "Execute_Plan":
+            raise AttributeError(name)
+        return getattr(self.gpu, name)
+
+def Zone (rule, zone):
+    """
+    :return: the rows of a "Definition Zone" by the variables of the rule
+    :rtype: list
+    """
+    idx, varsPic = zone
+    cols = [varsPic[i] for i in range(len(rule.Dictionary))]
+    return sorted(tuple(row[col] for col in cols) for row in np.asarray(idx).tolist())
+
+def Create_Rules (data, tmp_path, seed):
+    """
+    Load the facts, and compile the rules of Pi.gap and the extra rules
+    :return: list of rules
+    :rtype: list
+    """
+    data.Load(Write_Facts(tmp_path / "data.csv", Create_Facts(seed = seed)))
+
+    with open(RULES) as filer:
+        return [GAP_Rule(line) for line in filer if line.strip() != ""] + [GAP_Rule(line) for line in EXTRA]
+
+@pytest.mark.parametrize("seed", [1, 2])
+def test_fused_plan (opencl, tmp_path, seed):
+    data = GAP_Data()
+    rules = Create_Rules(data, tmp_path, seed)
+
+    sizes = []
+    for rule in rules:
+        expected = Zone(rule, rule.Create_DefinitionZone(data, _PerOperator(opencl)))
+        assert Zone(rule, rule.Create_DefinitionZone(data, opencl)) == expected
+        sizes.append(len(expected))
+
+    assert sum(size > 0 for size in sizes) >= len(rules) - 2
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_pipelined_plans (opencl, tmp_path, asynchronous):
+    from Code.opencl import GAP_OpenCL
+    gpu = GAP_OpenCL(CL_PATH, asynchronous = asynchronous)
+
+    data = GAP_Data()
+    rules = Create_Rules(data, tmp_path, 3)
+    zones = gpu.Execute_Plans([rule.Plan for rule in rules], data)  ## all the kernels are enqueued together
+
+    for rule, zone in zip(rules, zones):
+        assert Zone(rule, zone) == Zone(rule, opencl.Execute_Plan(rule.Plan, data))
+
+@pytest.mark.parametrize("rows", [1, 7, 1 << 16])
+def test_stream_zone (backend, tmp_path, rows):
+    data = GAP_Data()
+    rules = Create_Rules(data, tmp_path, 4)
+
+    for rule in rules:
+        stream, varsPic = rule.Stream_DefinitionZone(data, backend, rows)
+        batches = [np.asarray(batch).tolist() for batch in stream.Batches()]
+        expected = Zone(rule, rule.Create_DefinitionZone(data, backend))
+
+        assert Zone(rule, ([row for batch in batches for row in batch], varsPic)) == expected
+        assert stream.rows == len(expected)
+        if len(expected) > rows:
+            assert len(batches) > 1
+
+def test_pool_zone (backend, tmp_path):
+    data = GAP_Data()
+    rules = Create_Rules(data, tmp_path, 5)
+    gpu = _PerOperator(backend)  ## the blocks and the joins run on the threads of the pool
+
+    with ThreadPoolExecutor(max_workers = 4) as pool:
+        for rule in rules:
+            expected = Zone(rule, rule.Create_DefinitionZone(data, gpu))
+            assert Zone(rule, rule.Create_DefinitionZone(data, gpu, pool)) == expected
+
+            stream, varsPic = rule.Stream_DefinitionZone(data, gpu, 7, pool)
+            assert Zone(rule, (list(stream), varsPic)) == expected
+
+def test_join_cache (backend, tmp_path):
+    data = GAP_Data()
+    data.Load(Write_Facts(tmp_path / "data.csv", Create_Facts(seed = 6)))
+    rules = [GAP_Rule(rule) for rule in SHARED]  ## the same join, with other names of the variables
+    expected = [Zone(rule, rule.Create_DefinitionZone(data, backend)) for rule in rules]
+
+    joins = GAP_JoinCache()
+    assert [Zone(rule, rule.Create_DefinitionZone(data, backend, None, joins)) for rule in rules] == expected
+    assert joins.hits > 0 and joins.rows > 0 and len(expected[0]) > 0
+
+    hits, misses = joins.hits, joins.misses
+    data.Touch("g1_member")  ## a rule changed g1_member - the next join is computed again
+    assert Zone(rules[0], rules[0].Create_DefinitionZone(data, backend, None, joins)) == expected[0]
+    assert joins.hits == hits and joins.misses > misses
+
+    joins.Clear()
+    assert joins.entries == { }
+
+def test_physical_plan (backend, tmp_path):
+    data = GAP_Data()
+    rules = Create_Rules(data, tmp_path, 7)
+
+    for i, rule in enumerate(rules):
+        expected = Zone(rule, rule.Create_DefinitionZone(data, backend))
+        rule.Arrange_Execution(i, 0)
+        assert isinstance(rule.Plan, GAP_PhysicalPlan)
+
+        assert Zone(rule, rule.Create_DefinitionZone(data, backend)) == expected
+        stream, varsPic = rule.Stream_DefinitionZone(data, backend, 7)
+        assert Zone(rule, (list(stream), varsPic)) == expected
+
+def test_physical_plan_immutable ():
+    rule = GAP_Rule(EXTRA[1])
+    plan = GAP_PhysicalPlan(rule)
+
+    with pytest.raises(AttributeError):
+        plan.Scans = ()
+    with pytest.raises(AttributeError):
+        plan.Extra = None
+    with pytest.raises(TypeError):
+        plan.Joins[None] = None
+    with pytest.raises(TypeError):
+        plan.Minimums[0] = 1.0
+
+    varsPic = next(iter(plan.Joins.values()))[0]  ## the Joined Physical Variables Picture of a join
+    with pytest.raises(ValueError):
+        varsPic[0] = -1
+
+def test_batches ():
+    comp = GAP_Compiler()
+    comp.Rules = [GAP_Rule(rule) for rule in ["a(X):x <- friend(X,Y):x", "b(X):x <- p(X):1", "c(X):x <- a(X):x",
+        "d(X):x <- q(X):1 & b(X):x", "e(X):x <- c(X):x"]]
+
+    assert comp.Create_Batches() == [[0, 1], [2, 3], [4]]  ## a rule that reads an earlier header starts a batch
+#endregion
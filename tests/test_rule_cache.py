@@ -0,0 +1,70 @@
+__author__ = "Bar Bokovza"
+
+#region Imports
+import os
+
+from Code.basic import GAP_Basic
+from Code.compiler import GAP_Compiler
+from Code.dataHolder import GAP_Data
+from tests.conftest import RULES, Create_Facts, Write_Facts, Differences
+#endregion
+
+#region Tests
+def Run_Compiler (directory, data):
+    """
+    Load the rules with the cache in the directory and run them to a fix point
+    :return: (the compiler, the data of the fix point)
+    :rtype: tuple
+    """
+    compiler = GAP_Compiler(cache = directory)
+    compiler.Load(RULES)
+
+    dataHolder = GAP_Data()
+    dataHolder.Load(data)
+    compiler.Run_FixPoint(dataHolder, GAP_Basic())
+    return compiler, {predicat: dict(atoms) for predicat, atoms in dataHolder.data.items()}
+
+def test_round_trip (tmp_path):
+    directory, data = str(tmp_path / "rules"), Write_Facts(tmp_path / "data.csv", Create_Facts())
+
+    first, expected = Run_Compiler(directory, data)
+    rules = len(first.Rules)
+    assert first.Cache.Statistics() == {"hits": 0, "misses": rules, "rules": rules}
+
+    stat = os.stat(first.Cache.path)
+    second, result = Run_Compiler(directory, data)
+
+    assert second.Cache.Statistics() == {"hits": rules, "misses": 0, "rules": rules}
+    assert [rule.Text for rule in second.Rules] == [rule.Text for rule in first.Rules]
+    assert result == expected
+
+    after = os.stat(first.Cache.path)
+    assert (after.st_ino, after.st_mtime_ns) == (stat.st_ino, stat.st_mtime_ns)  ## the pack is not written again
+
+def test_broken_pack (tmp_path):
+    directory, data = str(tmp_path / "rules"), Write_Facts(tmp_path / "data.csv", Create_Facts())
+    first, expected = Run_Compiler(directory, data)
+
+    with open(first.Cache.path, "wb") as filer:
+        filer.write(b"broken")
+
+    second, result = Run_Compiler(directory, data)
+    assert second.Cache.Statistics()["hits"] == 0
+    assert result == expected
+
+def test_other_index (tmp_path):
+    directory, data = str(tmp_path / "rules"), Write_Facts(tmp_path / "data.csv", Create_Facts(seed = 2))
+    first, expected = Run_Compiler(directory, data)
+
+    with open(RULES) as filer:  ## the cached rules get their functions renamed to the new indexes
+        rules = Write_Facts(tmp_path / "reversed.gap", [line.strip() for line in filer if line.strip() != ""][::-1])
+
+    compiler = GAP_Compiler(cache = directory)
+    compiler.Load(rules)
+    dataHolder = GAP_Data()
+    dataHolder.Load(data)
+    compiler.Run_FixPoint(dataHolder, GAP_Basic())
+
+    assert compiler.Cache.Statistics()["hits"] == len(first.Rules)
+    assert Differences(expected, {predicat: dict(atoms) for predicat, atoms in dataHolder.data.items()}) == []
+#endregion
@@ -0,0 +1,56 @@
+__author__ = "Bar Bokovza"
+
+#region Imports
+import numpy as np
+
+from Code.basic import GAP_Basic
+#endregion
+
+#region Tests
+def Create_Join (rows, keys, seed = 0):
+    """
+    Two relations a(X, Y), b(Y, Z) - Y has "keys" values
+    """
+    random = np.random.RandomState(seed)
+    a = random.randint(0, keys, (rows, 2)).astype(np.int32)
+    b = random.randint(0, keys, (rows, 2)).astype(np.int32)
+    return (a, np.array([0, 1, -1], dtype = np.int32)), (b, np.array([-1, 0, 1], dtype = np.int32))
+
+def Rows (array):
+    return sorted(tuple(row) for row in np.asarray(array).tolist())
+
+def Nested_Join (a, b):
+    """
+    The rows of a(X, Y), b(Y, Z) by a nested loop
+    """
+    return [(x, y, z) for x, y in a[0].tolist() for w, z in b[0].tolist() if y == w]
+
+def test_join_order ():
+    a, b = Create_Join(50, 5)
+
+    result, varsPic = GAP_Basic().SuperJoin(a, b)
+    assert np.asarray(result).tolist() == [list(row) for row in Nested_Join(a, b)]
+
+    empty = (np.zeros((0, 2), dtype = np.int32), a[1])
+    assert np.shape(GAP_Basic().SuperJoin(empty, b)[0]) == (0, 3)
+
+def test_selective_join_in_memory ():
+    a, b = Create_Join(200, 1000)
+    basic = GAP_Basic(memory = 4096)  ## a * b rows would be ~480KB, the join is a few rows
+
+    result, varsPic = basic.SuperJoin(a, b)
+    assert basic.Spill_Statistics()["spills"] == 0
+    assert Rows(result) == Rows(GAP_Basic().SuperJoin(a, b)[0])
+
+def test_large_join_spilled ():
+    a, b = Create_Join(200, 4)
+    basic = GAP_Basic(memory = 4096)
+
+    result, varsPic = basic.SuperJoin(a, b)
+    expected = GAP_Basic().SuperJoin(a, b)[0]
+
+    assert basic.Spill_Statistics()["spills"] == 1
+    assert isinstance(result, np.memmap)
+    assert np.shape(result) == np.shape(expected)
+    assert Rows(result) == Rows(expected)
+#endregion